@@ -0,0 +1,130 @@
+"""
+Sharded prefix index for postcode autocomplete.
+
+Every matched postcode key (see postcode_codec.py) is split into area,
+district, sector and unit ("N15 5QA" -> "N", "N15", "5", "QA") and saved as
+small JSON files in output/autocomplete/:
+
+    areas.json         every area                            ["AB", "AL", ...]
+    <area>.json        {district: sector digits}             {"N1": "0123456789", "N15": "34569"}
+    <district>.json    {sector digit: unit letter pairs}     {"5": "QAQBQD...", "6": "..."}
+
+process_data.py writes them with the rest of a build's outputs, as part of
+the same generation (see output_writer.py).
+
+A prefix is completed by fetching its area file (a few hundred bytes; a
+lone letter may start several areas, listed in areas.json), then the
+district files of the districts the prefix can still reach - usually one, a
+few KB - so suggestions need neither the lookup chunks nor a scan of every
+postcode.
+
+    from autocomplete_index import AutocompleteIndex
+
+    AutocompleteIndex("output/autocomplete").complete("N15 5")   # ['N15 5QA', 'N15 5QB', ...]
+
+The JavaScript reader is completePostcode() in public/app.js.
+
+Author: postcodes.energy
+License: MIT
+"""
+
+import json
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List, Union
+
+import numpy as np
+
+from output_writer import OutputWriter
+from postcode_codec import AREA_NAMES, DISTRICT_CODES, INVALID_KEY, INWARD_CODES, UNIT_CODES, UNIT_NAMES, decode_outward
+
+AUTOCOMPLETE_DIR = "autocomplete"
+AREAS_FILE = "areas"
+
+# Suggestions returned by default
+MAX_SUGGESTIONS = 10
+
+
+def build_autocomplete_index(keys: Iterable[int]) -> Dict[str, Union[List[str], Dict[str, str]]]:
+    """Contents of every autocomplete file, by file name, from postcode keys."""
+    keys = np.unique(np.asarray(keys, dtype=np.int64))
+    keys = keys[keys != INVALID_KEY]
+
+    # Keys sort like postcodes, so sectors, districts and areas all come out in postcode order
+    sector_ids = keys // UNIT_CODES  # outward ID * 10 + sector digit
+    starts = np.flatnonzero(np.r_[True, sector_ids[1:] != sector_ids[:-1]]) if len(keys) else np.array([], dtype=int)
+    ends = np.r_[starts[1:], len(keys)]
+    outward_ids, digits = np.divmod(sector_ids[starts], INWARD_CODES // UNIT_CODES)
+    district_ids = np.unique(outward_ids)
+    districts = dict(zip(district_ids.tolist(), decode_outward(district_ids).tolist()))
+    areas = AREA_NAMES.tolist()
+
+    # Unit letters of every postcode as one string, two characters each
+    units = UNIT_NAMES.astype('S2')[keys % UNIT_CODES].tobytes().decode('ascii')
+
+    files = {AREAS_FILE: []}
+    for outward_id, digit, start, end in zip(outward_ids.tolist(), digits.tolist(), starts.tolist(), ends.tolist()):
+        district, area = districts[outward_id], areas[outward_id // DISTRICT_CODES]
+        if area not in files:
+            files[AREAS_FILE].append(area)
+            files[area] = {}
+        files[area][district] = files[area].get(district, '') + str(digit)
+        files.setdefault(district, {})[str(digit)] = units[2 * start:2 * end]
+    return files
+
+
+def write_autocomplete_index(keys: Iterable[int], output_dir: Path, writer: OutputWriter = None) -> int:
+    """
+    Save the autocomplete files for postcode keys to output_dir/autocomplete/.
+    With writer the files become part of its generation (see output_writer.py),
+    otherwise they are rewritten in place and files left by an earlier build
+    are removed. Returns the number of files.
+    """
+    if writer is None:
+        with OutputWriter(output_dir, swap=False) as writer:
+            count = write_autocomplete_index(keys, output_dir, writer)
+            writer.commit()
+        return count
+    files = build_autocomplete_index(keys)
+    for name, contents in files.items():
+        writer.write_json(f"{AUTOCOMPLETE_DIR}/{name}.json", contents)
+    return len(files)
+
+
+class AutocompleteIndex:
+    """Postcode completion over the files written by write_autocomplete_index."""
+
+    def __init__(self, index_dir: Path):
+        self.index_dir = Path(index_dir)
+        self._files = {}
+
+    def _load(self, name: str):
+        if name not in self._files:
+            path = self.index_dir / f"{name}.json"
+            self._files[name] = json.loads(path.read_text()) if path.exists() else {}
+        return self._files[name]
+
+    def complete(self, prefix: str, limit: int = MAX_SUGGESTIONS) -> List[str]:
+        """Up to limit postcodes, in order, starting with prefix (spaces and case ignored)."""
+        value = re.sub(r'\s+', '', prefix).upper()
+        area = re.match(r'[A-Z]{0,2}', value).group()
+        if not area:
+            return []
+        areas = [candidate for candidate in self._load(AREAS_FILE) if candidate.startswith(area)] if area == value else [area]
+
+        matches = []
+        districts = [item for candidate in areas for item in self._load(candidate).items()]
+        for district, sectors in districts:
+            if district.startswith(value):
+                inward = ''
+            elif value.startswith(district) and len(value) > len(district) and value[len(district)] in sectors:
+                inward = value[len(district):]
+            else:
+                continue
+            for sector, units in self._load(district).items():
+                for i in range(0, len(units), 2):
+                    if (sector + units[i:i + 2]).startswith(inward):
+                        matches.append(f"{district} {sector}{units[i:i + 2]}")
+                        if len(matches) >= limit:
+                            return matches
+        return matches
@@ -0,0 +1,436 @@
+"""
+Benchmark suite for the processing pipeline, on synthetic UK-scale data.
+
+The raw DNO and ONSPD files aren't in the repo, so this generates a
+deterministic stand-in for them: Voronoi substation polygons across the 11
+DNO files in DNO_FILES (GeoPackages in British National Grid, as the National
+Grid files are), about 2.6M postcodes in real postcode areas with districts,
+sectors and units clustered as towns are, and the household census CSV. The
+same seed and scale always give the same files.
+
+Each pipeline stage is then run on it under tracemalloc for its peak
+memory (Python and NumPy allocations - GEOS and Arrow buffers aren't
+counted), and again timed. Results are compared with the baselines in
+bench/baselines.json; the run fails when a stage is slower, or peaks higher,
+than its baseline by more than the threshold.
+
+Usage:
+    python benchmark.py                              # small scale against this machine's baselines
+    python benchmark.py --scale small medium full
+    python benchmark.py --scale medium --update-baseline
+    python benchmark.py --scale full --repeat 1 --no-memory --report bench/full.json
+
+Baselines depend on the machine, so they're kept with the synthetic data
+(bench/ isn't committed) rather than in the repo. The first run of a scale
+records its baseline; --update-baseline records a new one, say before a change
+to measure it against.
+
+Author: postcodes.energy
+License: MIT
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+import process_data
+from process_data import DNO_FILES
+from substation_query import SubstationLocator
+
+# Fraction of the full synthetic data set generated at each scale
+SCALES = {'small': 0.01, 'medium': 0.1, 'full': 1.0}
+
+# Postcodes and primary substations at full scale (ONSPD, live and terminated)
+FULL_POSTCODES = 2_600_000
+FULL_SUBSTATIONS = 4_500
+MIN_SUBSTATIONS = 220
+
+# Bumped whenever the generated data changes, so old baselines aren't compared
+GENERATOR_VERSION = 1
+
+BENCH_DIR = Path("bench")
+BASELINE_FILE = "baselines.json"
+
+# A stage regresses when it's this much slower or larger than its baseline...
+DEFAULT_THRESHOLD = 0.25
+# ...and by more than these, so timer noise on fast stages doesn't fail a run
+MIN_REGRESSION_SECONDS = 0.1
+MIN_REGRESSION_MB = 5
+
+# Mainland extent of the synthetic substations (lon/lat); postcodes offshore fall outside it
+EXTENT = (-5.8, 50.0, 1.8, 58.7)
+
+# Rough centre of each DNO's licence area - substations go to the nearest
+DNO_CENTRES = {
+    "SPEN_SPD": (-3.8, 55.8),
+    "SPEN_SPMW": (-3.0, 53.2),
+    "SSEN_SEPD": (-1.2, 51.3),
+    "SSEN_SHEPD": (-4.2, 57.4),
+    "NGRID_EM": (-1.0, 52.9),
+    "NGRID_SW_WALES": (-3.9, 51.7),
+    "NGRID_SW": (-3.8, 50.6),
+    "NGRID_WM": (-2.2, 52.4),
+    "UKPN": (0.5, 51.6),
+    "NPG": (-1.4, 54.2),
+    "ENWL": (-2.6, 54.0),
+}
+
+# Name and ID fields of each generated file, cycling through those load_substation_data recognises
+FIELD_NAMES = [('primary', 'primary_floc'), ('name', 'id'), ('SUBSTATION_NAME', 'SUBSTATION_ID'), ('site_name', 'site_id')]
+
+POSTCODE_AREAS = (
+    "AB AL B BA BB BD BH BL BN BR BS CA CB CF CH CM CO CR CT CV CW DA DD DE DG DH DL DN DT DY "
+    "E EC EH EN EX FK FY G GL GU HA HD HG HP HR HS HU HX IG IP IV KA KT KW KY L LA LD LE LL LN "
+    "LS LU M ME MK ML N NE NG NN NP NR NW OL OX PA PE PH PL PO PR RG RH RM S SA SE SG SK SL SM "
+    "SN SO SP SR SS ST SW SY TA TD TF TN TQ TR TS TW UB W WA WC WD WF WN WR WS WV YO ZE"
+).split()
+
+# Letters used in the inward code's unit part - 400 possible units per sector
+UNIT_LETTERS = "ABDEFGHJLNPQRSTUWXYZ"
+
+# Shares of postcodes without coordinates, and placed offshore (left unmatched)
+MISSING_COORDS_SHARE = 0.005
+OFFSHORE_SHARE = 0.003
+
+# Share of postcodes with a household count
+RESIDENTIAL_SHARE = 0.6
+
+
+def _postcode_structure(rng: np.random.Generator) -> pd.DataFrame:
+    """
+    Outward codes and sectors of the synthetic postcodes, with each sector's
+    centre and share of the postcodes. The same at every scale, so smaller
+    scales thin out the units but keep the chunks.
+    """
+    xmin, ymin, xmax, ymax = EXTENT
+    rows = []
+    for area in POSTCODE_AREAS:
+        centre = rng.uniform([xmin + 0.5, ymin + 0.5], [xmax - 0.5, ymax - 0.5])
+        weight = rng.lognormal(0, 0.6)
+        for number in range(1, 2 + rng.poisson(22 * weight)):
+            district = f"{area}{number}"
+            district_centre = centre + rng.normal(0, 0.15, 2)
+            sectors = np.sort(rng.choice(10, size=min(10, 1 + rng.poisson(3.8)), replace=False))
+            for sector in sectors:
+                lng, lat = district_centre + rng.normal(0, 0.02, 2)
+                rows.append((district, int(sector), lng, lat, rng.lognormal(0, 0.5)))
+    structure = pd.DataFrame(rows, columns=['district', 'sector', 'lng', 'lat', 'weight'])
+    structure['weight'] /= structure['weight'].sum()
+    return structure
+
+
+def generate_postcodes(scale: float, rng: np.random.Generator) -> pd.DataFrame:
+    """Synthetic ONSPD rows (PCDS, LAT, LONG and a few unused columns) at scale."""
+    structure = _postcode_structure(rng)
+    units = np.minimum(rng.multinomial(round(FULL_POSTCODES * scale), structure['weight']), len(UNIT_LETTERS) ** 2)
+
+    all_units = np.array([a + b for a in UNIT_LETTERS for b in UNIT_LETTERS])
+    inward = np.concatenate([np.sort(rng.choice(all_units, size=n, replace=False)) for n in units])
+    sector_rows = np.repeat(np.arange(len(structure)), units)
+    sectors = structure.iloc[sector_rows]
+
+    # Postcodes cluster around their sector's centre
+    lng = sectors['lng'].to_numpy() + rng.normal(0, 0.01, len(inward))
+    lat = sectors['lat'].to_numpy() + rng.normal(0, 0.01, len(inward))
+    offshore = rng.random(len(inward)) < OFFSHORE_SHARE
+    lng[offshore] = EXTENT[0] - rng.uniform(0.1, 1.0, offshore.sum())
+    missing = rng.random(len(inward)) < MISSING_COORDS_SHARE
+
+    return pd.DataFrame({
+        'PCD': sectors['district'].str.ljust(4).to_numpy() + sectors['sector'].astype(str).to_numpy() + inward,
+        'PCDS': sectors['district'].to_numpy() + ' ' + sectors['sector'].astype(str).to_numpy() + inward,
+        'DOTERM': np.where(rng.random(len(inward)) < 0.3, '202001', ''),
+        'LAT': np.where(missing, np.nan, lat.round(6)),
+        'LONG': np.where(missing, np.nan, lng.round(6)),
+        'OSLAUA': 'E0' + pd.Series(rng.integers(6000000, 6000400, len(inward))).astype(str).to_numpy(),
+    })
+
+
+def generate_substations(postcodes: pd.DataFrame, scale: float, rng: np.random.Generator) -> gpd.GeoDataFrame:
+    """
+    Voronoi substation polygons, smaller where postcodes are dense, each
+    assigned to the DNO with the nearest licence area centre. Edges are
+    densified and wiggled so boundaries have as many vertices as real ones.
+    """
+    xmin, ymin, xmax, ymax = EXTENT
+    count = max(MIN_SUBSTATIONS, round(FULL_SUBSTATIONS * scale))
+
+    # Most substations are seeded at postcodes, the rest spread over rural areas
+    located = postcodes.dropna(subset=['LAT', 'LONG'])
+    located = located[located['LONG'] >= xmin]
+    seeded = located.iloc[rng.choice(len(located), size=count * 4 // 5, replace=False)]
+    seeds = np.vstack([
+        seeded[['LONG', 'LAT']].to_numpy() + rng.normal(0, 0.002, (len(seeded), 2)),
+        rng.uniform([xmin, ymin], [xmax, ymax], (count - len(seeded), 2)),
+    ])
+
+    extent = shapely.box(*EXTENT)
+    cells = shapely.get_parts(shapely.voronoi_polygons(shapely.multipoints(seeds), extend_to=extent))
+    cells = shapely.intersection(cells, extent)
+    cells = cells[shapely.area(cells) > 0]
+
+    # Wiggle each vertex by a smooth function of its position, so shared edges move together
+    cells = shapely.segmentize(cells, 0.005)
+    cells = shapely.transform(cells, lambda xy: xy + 0.0008 * np.sin(xy[:, ::-1] * 157.0))
+    cells = shapely.make_valid(cells)
+
+    centres = shapely.get_coordinates(shapely.point_on_surface(cells))
+    dno_ids = list(DNO_CENTRES)
+    dno_centres = np.array([DNO_CENTRES[dno_id] for dno_id in dno_ids])
+    nearest = np.argmin(((centres[:, None, :] - dno_centres[None, :, :]) ** 2).sum(axis=2), axis=1)
+
+    return gpd.GeoDataFrame({
+        'dno_id': np.array(dno_ids)[nearest],
+        'substation_id': [f"P{i:05d}" for i in range(len(cells))],
+    }, geometry=cells, crs="EPSG:4326")
+
+
+def generate_synthetic_data(root: Path, scale: float, seed: int = 0) -> Dict:
+    """
+    Write synthetic raw/substations and raw/postcodes files to root, unless the
+    same scale and seed were generated there already. Returns their description.
+    """
+    description = {'generator': GENERATOR_VERSION, 'scale': scale, 'seed': seed}
+    description_file = root / "synthetic.json"
+    if description_file.exists():
+        existing = json.loads(description_file.read_text())
+        if {key: existing.get(key) for key in description} == description:
+            return existing
+
+    rng = np.random.default_rng(seed)
+    substations_dir = root / "raw" / "substations"
+    postcodes_dir = root / "raw" / "postcodes"
+    substations_dir.mkdir(parents=True, exist_ok=True)
+    postcodes_dir.mkdir(parents=True, exist_ok=True)
+
+    postcodes = generate_postcodes(scale, rng)
+    postcodes.to_csv(postcodes_dir / "ONSPD_SYNTHETIC.csv", index=False)
+
+    households = postcodes.sample(frac=RESIDENTIAL_SHARE, random_state=seed).sort_index()
+    pd.DataFrame({
+        'Postcode': households['PCDS'].str.replace(' ', '', regex=False).str.lower(),
+        'Count': rng.poisson(15, len(households)) + 1,
+    }).to_csv(postcodes_dir / "Household census data 2021.csv", index=False)
+
+    substations = generate_substations(postcodes, scale, rng)
+    for i, (dno_id, dno_info) in enumerate(DNO_FILES.items()):
+        name_field, id_field = FIELD_NAMES[i % len(FIELD_NAMES)]
+        gdf = substations[substations['dno_id'] == dno_id]
+        gdf = gpd.GeoDataFrame({
+            name_field: [f"{dno_id} Primary {j + 1}" for j in range(len(gdf))],
+            id_field: gdf['substation_id'].to_numpy(),
+        }, geometry=gdf.geometry.to_numpy(), crs=gdf.crs)
+
+        path = substations_dir / dno_info['file']
+        path.unlink(missing_ok=True)
+        if path.suffix == '.gpkg':
+            gdf.to_crs("EPSG:27700").to_file(path, driver="GPKG")
+        else:
+            gdf.to_file(path, driver="GeoJSON")
+
+    description.update(postcodes=len(postcodes), substations=len(substations))
+    description_file.write_text(json.dumps(description, indent=2))
+    return description
+
+
+def pipeline_stages(batch_size: int) -> List[Tuple[str, List[str], Callable]]:
+    """
+    The stages of a full build, in order, as (name, inputs, function) triples.
+    Each function is called with the results of the earlier stages named in inputs.
+    """
+    def match(postcodes, substations):
+        if batch_size:
+            postcodes = process_data.load_postcode_data(batch_size)
+        return process_data.match_postcodes_to_substations(postcodes, substations)
+
+    def save(substation_details, matched):
+        process_data.save_outputs(process_data.iter_postcode_chunks(matched), substation_details)
+
+    def locate(locator, postcodes):
+        return locator.query(postcodes.geometry.x.to_numpy(), postcodes.geometry.y.to_numpy(), crs=postcodes.crs)
+
+    return [
+        ('load_all_substations', [], lambda: process_data.load_all_substations(None)),
+        ('load_postcode_data', [], process_data.load_postcode_data),
+        ('match_postcodes_to_substations', ['load_postcode_data', 'load_all_substations'], match),
+        ('build_substation_locator', ['load_all_substations'], SubstationLocator),
+        ('locate_points', ['build_substation_locator', 'load_postcode_data'], locate),
+        ('create_postcode_lookup', ['match_postcodes_to_substations'], process_data.create_postcode_lookup),
+        ('load_household_data', [], process_data.load_household_data),
+        ('create_substation_details', ['load_all_substations', 'match_postcodes_to_substations', 'load_household_data'],
+         process_data.create_substation_details),
+        ('save_outputs', ['create_substation_details', 'match_postcodes_to_substations'], save),
+    ]
+
+
+def run_stage(stage: Callable, inputs: List, repeat: int, memory: bool) -> Tuple[object, Dict]:
+    """
+    Run a stage under tracemalloc if memory, then repeat times timed. Returns
+    its result and measurements. Each run's result is dropped before the next
+    starts, so runs don't count each other's memory.
+    """
+    measurement = {}
+    if memory:
+        tracemalloc.start()
+        try:
+            stage(*inputs)
+            measurement['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 1e6, 1)
+        finally:
+            tracemalloc.stop()
+
+    timings = []
+    result = None
+    for _ in range(repeat):
+        result = None
+        start = time.perf_counter()
+        result = stage(*inputs)
+        timings.append(time.perf_counter() - start)
+    return result, {'seconds': round(min(timings), 3), **measurement}
+
+
+def run_benchmark(scale_name: str, work_dir: Path, seed: int = 0, repeat: int = 3,
+                  memory: bool = True, batch_size: int = 0, verbose: bool = False) -> Dict:
+    """Generate (or reuse) the synthetic data for a scale and measure every pipeline stage on it."""
+    root = work_dir / scale_name
+    root.mkdir(parents=True, exist_ok=True)
+    print(f"\n=== Benchmark: {scale_name} ===\n")
+
+    start = time.perf_counter()
+    data = generate_synthetic_data(root, SCALES[scale_name], seed)
+    print(f"Synthetic data: {data['postcodes']:,} postcodes, {data['substations']:,} substations "
+          f"({time.perf_counter() - start:.1f}s)")
+
+    # The pipeline reads raw/ and writes output/ relative to the working directory
+    cwd = os.getcwd()
+    os.chdir(root)
+    results = {}
+    stages = {}
+    try:
+        pipeline = pipeline_stages(batch_size)
+        for i, (name, inputs, stage) in enumerate(pipeline):
+            log = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+            with log:
+                results[name], stages[name] = run_stage(stage, [results[key] for key in inputs], repeat, memory)
+
+            # Free results no later stage uses - at full scale they don't all fit in memory at once
+            needed = {key for _, later_inputs, _ in pipeline[i + 1:] for key in later_inputs}
+            for key in list(results):
+                if key not in needed:
+                    del results[key]
+            if name == 'locate_points':
+                # Coordinate queries (substation_query.py) are quoted as a rate
+                stages[name]['points_per_s'] = round(data['postcodes'] / max(stages[name]['seconds'], 1e-9))
+            peak = f"  peak {stages[name]['peak_mb']:>8,.1f} MB" if 'peak_mb' in stages[name] else ""
+            rate = f"  {stages[name]['points_per_s']:>10,} points/s" if 'points_per_s' in stages[name] else ""
+            print(f"  {name:<32} {stages[name]['seconds']:>8.2f}s{peak}{rate}")
+    finally:
+        os.chdir(cwd)
+
+    return {**data, 'batch_size': batch_size, 'repeat': repeat, 'stages': stages}
+
+
+def compare_to_baseline(scale_name: str, result: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """Regressions of a scale's result against its baseline, as messages (none if it passes)."""
+    if baseline.get('generator') != result['generator'] or baseline.get('seed') != result['seed']:
+        print(f"WARNING: {scale_name} baseline is for other synthetic data - not compared")
+        return []
+
+    regressions = []
+    for name, measurement in result['stages'].items():
+        expected = baseline['stages'].get(name)
+        if expected is None:
+            continue
+        for key, unit, slack in [('seconds', 's', MIN_REGRESSION_SECONDS), ('peak_mb', ' MB', MIN_REGRESSION_MB)]:
+            if key not in measurement or key not in expected:
+                continue
+            current, previous = measurement[key], expected[key]
+            if current > previous * (1 + threshold) and current - previous > slack:
+                regressions.append(f"{scale_name} {name}: {current:,.2f}{unit} vs baseline "
+                                   f"{previous:,.2f}{unit} (+{(current / previous - 1) * 100:.0f}%)")
+    return regressions
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic UK-scale data.")
+    parser.add_argument('--scale', nargs='+', choices=list(SCALES), default=['small'],
+                        help="Scales to run: " + ", ".join(f"{name} ({fraction:g})" for name, fraction in SCALES.items()))
+    parser.add_argument('--work-dir', type=Path, default=BENCH_DIR,
+                        help=f"Where synthetic data and outputs are kept between runs (default: {BENCH_DIR})")
+    parser.add_argument('--baseline', type=Path, default=None,
+                        help=f"Baselines file (default: {BASELINE_FILE} in the work directory)")
+    parser.add_argument('--update-baseline', action='store_true', help="Record this run as the baseline of its scales")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f"Fail when a stage is this fraction over its baseline (default: {DEFAULT_THRESHOLD})")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per stage; the fastest counts (default: 3)")
+    parser.add_argument('--no-memory', action='store_true', help="Skip the tracemalloc run of each stage")
+    parser.add_argument('--batch-size', type=int, default=0,
+                        help="Stream postcodes into the match stage in batches of N rows (default: 0, load at once)")
+    parser.add_argument('--seed', type=int, default=0, help="Synthetic data seed (default: 0)")
+    parser.add_argument('--report', type=Path, help="Also write this run's results to a JSON file")
+    parser.add_argument('--verbose', action='store_true', help="Show the pipeline's own output")
+    return parser.parse_args(argv)
+
+
+def main(args: argparse.Namespace = None) -> int:
+    if args is None:
+        args = parse_args()
+
+    results = {
+        scale_name: run_benchmark(scale_name, args.work_dir, args.seed, max(args.repeat, 1),
+                                  not args.no_memory, args.batch_size, args.verbose)
+        for scale_name in args.scale
+    }
+    machine = {'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count()}
+
+    if args.report:
+        args.report.parent.mkdir(parents=True, exist_ok=True)
+        args.report.write_text(json.dumps({'machine': machine, 'scales': results}, indent=2))
+        print(f"\n[OK] Saved {args.report}")
+
+    baseline_file = args.baseline or args.work_dir / BASELINE_FILE
+    baselines = json.loads(baseline_file.read_text()) if baseline_file.exists() else {'scales': {}}
+    if baselines.get('machine', machine) != machine:
+        print(f"WARNING: {baseline_file} was recorded on another machine ({baselines['machine']}) - comparing anyway")
+
+    # Scales without a baseline on this machine set one, rather than being compared with anything
+    recorded = [scale_name for scale_name in results if args.update_baseline or scale_name not in baselines['scales']]
+    if recorded:
+        baselines['machine'] = machine
+        baselines['scales'].update({scale_name: results[scale_name] for scale_name in recorded})
+        baseline_file.parent.mkdir(parents=True, exist_ok=True)
+        baseline_file.write_text(json.dumps(baselines, indent=2) + "\n")
+        print(f"\n[OK] Recorded {', '.join(recorded)} baseline(s) in {baseline_file}")
+
+    compared = [scale_name for scale_name in results if scale_name not in recorded]
+    if not compared:
+        return 0
+
+    print("\n=== Comparing to Baselines ===\n")
+    regressions = []
+    for scale_name in compared:
+        regressions += compare_to_baseline(scale_name, results[scale_name], baselines['scales'][scale_name], args.threshold)
+
+    if regressions:
+        for regression in regressions:
+            print(f"[!] {regression}")
+        print(f"\nERROR: {len(regressions)} stage measurement(s) regressed more than {args.threshold:.0%}")
+        return 1
+    print(f"[OK] No stage regressed more than {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
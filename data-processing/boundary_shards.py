@@ -0,0 +1,242 @@
+"""
+Substation metadata index, and lazily fetched boundary and postcode list shards.
+
+The web app needs every substation's name, DNO and counts up front, but a
+boundary or postcode list only when it shows that substation. So the details
+are saved as three kinds of file:
+
+    substations.json            {substation_id: {name, dno, license_area,
+                                 postcode_count, household_count, chunks,
+                                 boundary_shard, postcode_shard}}
+    boundaries/<shard>.json     the boundaries of a few hundred KB worth of
+                                substations: {substation_id: GeoJSON geometry},
+                                or a shared-arc topology of them (boundary_topology.py)
+    postcodes/<shard>.json      the sorted postcodes of tens of KB worth of
+                                substations: {substation_id: front-coded list}
+                                (postcode_lists.py)
+
+Substations are grouped into shards by DNO and licence area, so neighbours -
+which are drawn together and share arcs - tend to share a shard. Every file
+must also fit a per-file limit (Cloudflare Pages serves files of at most
+25 MB, or the budget optimize_boundaries.py was given): a shard that comes out
+larger is split in two until it fits.
+
+The JavaScript readers are loadBoundary() and loadPostcodeList() in public/app.js.
+
+Author: postcodes.energy
+License: MIT
+"""
+
+import json
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import pandas as pd
+
+from boundary_topology import build_topology, decode_topology, split_topology
+from output_writer import OutputWriter
+from postcode_lists import decode_postcode_list, encode_postcode_list
+
+DETAILS_FILE = "substations.json"
+BOUNDARIES_DIR = "boundaries"
+POSTCODES_DIR = "postcodes"
+
+# Target size of a boundary shard, bytes of GeoJSON boundaries
+SHARD_BYTES = 256 * 1024
+
+# Target size of a postcode list shard, bytes
+POSTCODE_SHARD_BYTES = 64 * 1024
+
+# Cloudflare Pages file size limit, the default largest size of any one file
+PAGES_FILE_LIMIT_MB = 25
+PAGES_FILE_BYTES = PAGES_FILE_LIMIT_MB * 1024 * 1024
+
+# Fields kept in the metadata index
+INDEX_FIELDS = ['name', 'dno', 'license_area', 'postcode_count', 'household_count', 'chunks']
+
+
+def assign_shards(details: Dict, sizes: Dict[str, int], shard_bytes: int = SHARD_BYTES) -> Dict[str, int]:
+    """
+    Shard of each substation in sizes (bytes it adds to a shard), filling
+    shards in DNO and licence area order.
+    """
+    order = sorted(
+        sizes,
+        key=lambda substation_id: (details[substation_id].get('dno') or '', details[substation_id].get('license_area') or '', substation_id)
+    )
+
+    shards = {}
+    shard = size = 0
+    for substation_id in order:
+        if size and size + sizes[substation_id] > shard_bytes:
+            shard, size = shard + 1, 0
+        shards[substation_id] = shard
+        size += sizes[substation_id]
+    return shards
+
+
+def _group(shards: Dict[str, int]) -> Dict[int, List[str]]:
+    """Substation IDs in each shard, by shard number."""
+    members: Dict[int, List[str]] = {}
+    for substation_id, shard in shards.items():
+        members.setdefault(shard, []).append(substation_id)
+    return dict(sorted(members.items()))
+
+
+def fit_shards(groups: List[List[str]], build: Callable[[List[List[str]]], List[Dict]],
+               max_file_bytes: int, kind: str) -> Tuple[List[List[str]], List[Dict]]:
+    """
+    Build shards from groups of substation IDs, splitting any shard whose
+    compact JSON is larger than max_file_bytes in two until each fits (or holds
+    one substation, which is reported). Returns the groups and their shards.
+    """
+    while True:
+        shards = build(groups)
+        sizes = [len(json.dumps(shard, separators=(',', ':')).encode('utf-8')) for shard in shards]
+        over = {i for i, size in enumerate(sizes) if size > max_file_bytes and len(groups[i]) > 1}
+        if not over:
+            break
+        groups = [part for i, members in enumerate(groups)
+                  for part in ((members[:len(members) // 2], members[len(members) // 2:]) if i in over else (members,))]
+    for members, size in zip(groups, sizes):
+        if size > max_file_bytes:
+            print(f"WARNING: The {kind} shard of {members[0]} alone is {size / 1024 / 1024:.1f} MB, "
+                  f"over the {max_file_bytes / 1024 / 1024:.3g} MB file limit")
+    return groups, shards
+
+
+def split_details(details: Dict, geometries: pd.Series = None, shard_bytes: int = SHARD_BYTES,
+                  max_file_bytes: int = PAGES_FILE_BYTES) -> Tuple[Dict, Dict[int, Dict], Dict[int, Dict]]:
+    """
+    Split substation details into the metadata index saved as substations.json,
+    the boundary shards and the postcode list shards, by shard number. With
+    geometries (full-resolution boundaries by substation ID), each boundary
+    shard is its part of one shared-arc topology built from all of them;
+    otherwise it holds the GeoJSON boundaries in details. No shard is larger
+    than max_file_bytes unless it holds a single substation.
+    """
+    boundary_shards = assign_shards(details, {
+        substation_id: len(json.dumps(detail['boundary'], separators=(',', ':')))
+        for substation_id, detail in details.items() if detail.get('boundary')
+    }, shard_bytes)
+    postcode_lists = {
+        substation_id: encode_postcode_list(detail['postcodes'])
+        for substation_id, detail in details.items() if detail.get('postcodes')
+    }
+    postcode_shards = assign_shards(
+        details, {substation_id: len(substation_id) + len(encoded) + 6 for substation_id, encoded in postcode_lists.items()},
+        POSTCODE_SHARD_BYTES
+    )
+
+    groups = list(_group(boundary_shards).values())
+    if geometries is None:
+        def build_boundaries(groups: List[List[str]]) -> List[Dict]:
+            return [{substation_id: details[substation_id]['boundary'] for substation_id in members} for members in groups]
+    else:
+        # One topology, so borders between shards are cut and simplified the same on both sides
+        substation_ids = [substation_id for members in groups for substation_id in members]
+        topology = build_topology(substation_ids, geometries.reindex(substation_ids).to_numpy())
+
+        def build_boundaries(groups: List[List[str]]) -> List[Dict]:
+            return split_topology(topology, groups)
+    groups, boundaries = fit_shards(groups, build_boundaries, max_file_bytes, "boundary")
+
+    postcode_groups, postcodes = fit_shards(
+        list(_group(postcode_shards).values()),
+        lambda groups: [{substation_id: postcode_lists[substation_id] for substation_id in members} for members in groups],
+        max_file_bytes, "postcode list"
+    )
+
+    # Shards are numbered in order again, after any splits
+    boundary_shards = {substation_id: shard for shard, members in enumerate(groups) for substation_id in members}
+    postcode_shards = {substation_id: shard for shard, members in enumerate(postcode_groups) for substation_id in members}
+    index = {}
+    for substation_id, detail in details.items():
+        index[substation_id] = {field: detail[field] for field in INDEX_FIELDS if field in detail}
+        if substation_id in boundary_shards:
+            index[substation_id]['boundary_shard'] = boundary_shards[substation_id]
+        if substation_id in postcode_shards:
+            index[substation_id]['postcode_shard'] = postcode_shards[substation_id]
+
+    return index, dict(enumerate(boundaries)), dict(enumerate(postcodes))
+
+
+def write_details(details: Dict, output_dir: Path, geometries: pd.Series = None, writer: OutputWriter = None,
+                  max_file_bytes: int = PAGES_FILE_BYTES):
+    """
+    Save substation details (with their boundaries and postcodes) to an output
+    directory as the metadata index, boundary shards and postcode list shards,
+    each at most max_file_bytes (see split_details).
+    With writer the files become part of its generation (see output_writer.py),
+    otherwise they are rewritten in place.
+    """
+    output_dir = Path(output_dir)
+    if writer is None:
+        with OutputWriter(output_dir, swap=False) as writer:
+            write_details(details, output_dir, geometries, writer, max_file_bytes)
+            writer.commit()
+        return
+    index, boundaries, postcodes = split_details(details, geometries, max_file_bytes=max_file_bytes)
+
+    size = writer.write_json(DETAILS_FILE, index).result()
+    print(f"[OK] Saved {output_dir / DETAILS_FILE} ({size / 1024 / 1024:.1f} MB)")
+    if size > max_file_bytes:
+        print(f"WARNING: {DETAILS_FILE} is over the {max_file_bytes / 1024 / 1024:.3g} MB file limit")
+
+    _write_shards(boundaries, writer, BOUNDARIES_DIR, "boundary")
+    _write_shards(postcodes, writer, POSTCODES_DIR, "postcode list")
+
+
+def _write_shards(shards: Dict[int, Dict], writer: OutputWriter, shards_dir: str, kind: str):
+    """Save shards as <shards_dir>/<shard>.json."""
+    sizes = [writer.write_json(f"{shards_dir}/{shard}.json", contents) for shard, contents in shards.items()]
+    size = sum(future.result() for future in sizes)
+    print(f"[OK] Saved {len(shards)} {kind} shards ({size / 1024 / 1024:.1f} MB total)")
+
+
+def read_shard(path: Path) -> Dict[str, Dict]:
+    """GeoJSON boundaries in one shard file, by substation ID."""
+    with open(path, 'r', encoding='utf-8') as f:
+        shard = json.load(f)
+    return decode_topology(shard) if shard.get('type') == 'Topology' else shard
+
+
+def load_boundaries(output_dir: Path) -> Dict[str, Dict]:
+    """Every boundary in an output directory, by substation ID."""
+    boundaries = {}
+    for path in sorted((Path(output_dir) / BOUNDARIES_DIR).glob('*.json')):
+        boundaries.update(read_shard(path))
+    return boundaries
+
+
+def load_postcode_lists(output_dir: Path) -> Dict[str, List[str]]:
+    """Every substation's sorted postcodes in an output directory, by substation ID."""
+    postcodes = {}
+    for path in sorted((Path(output_dir) / POSTCODES_DIR).glob('*.json')):
+        with open(path, 'r', encoding='utf-8') as f:
+            postcodes.update({substation_id: decode_postcode_list(encoded) for substation_id, encoded in json.load(f).items()})
+    return postcodes
+
+
+def read_postcode_list(output_dir: Path, substation_id: str) -> List[str]:
+    """One substation's sorted postcodes, read from its shard (empty if it has none)."""
+    with open(Path(output_dir) / DETAILS_FILE, 'r', encoding='utf-8') as f:
+        shard = json.load(f).get(substation_id, {}).get('postcode_shard')
+    if shard is None:
+        return []
+    with open(Path(output_dir) / POSTCODES_DIR / f"{shard}.json", 'r', encoding='utf-8') as f:
+        return decode_postcode_list(json.load(f)[substation_id])
+
+
+def load_details(output_dir: Path) -> Dict:
+    """Substation details from an output directory, with their boundaries and postcodes joined back in."""
+    with open(Path(output_dir) / DETAILS_FILE, 'r', encoding='utf-8') as f:
+        details = json.load(f)
+    boundaries = load_boundaries(output_dir)
+    postcodes = load_postcode_lists(output_dir)
+    for substation_id, detail in details.items():
+        detail.pop('boundary_shard', None)
+        detail.pop('postcode_shard', None)
+        detail['postcodes'] = postcodes.get(substation_id, [])
+        detail['boundary'] = boundaries.get(substation_id)
+    return details
@@ -0,0 +1,298 @@
+"""
+Shared-arc (TopoJSON) encoding of substation boundaries.
+
+Neighbouring substations share most of their edges, so GeoJSON boundaries
+store every border twice, and simplifying each polygon on its own moves the
+two copies differently, leaving slivers and gaps between neighbours. This
+builds a TopoJSON topology instead: coordinates are quantized to an integer
+grid, each ring is cut at junctions (points where the rings passing through
+disagree about their neighbours), and every arc is stored once and simplified
+once, so neighbours keep an identical border. Arcs are delta encoded.
+
+    {"type": "Topology",
+     "transform": {"scale": [s, s], "translate": [lng0, lat0]},
+     "arcs": [[[x0, y0], [dx1, dy1], ...], ...],
+     "objects": {"substations": {"type": "GeometryCollection", "geometries": [
+         {"type": "Polygon", "id": "<substation_id>", "arcs": [[0, -2]]}, ...]}}}
+
+As in TopoJSON, an arc index i < 0 means arc ~i reversed, and a position is
+(x * scale + lng0, y * scale + lat0). Both axes share one scale so that the
+simplification tolerance is the same in either direction.
+
+Boundaries fetched in shards are built as one topology and then split
+(split_topology): each shard holds the arcs its substations use, with the
+same transform, so a border between substations in different shards is the
+same simplified arc in both.
+
+The JavaScript decoder is decodeTopology() in public/app.js.
+
+Author: postcodes.energy
+License: MIT
+"""
+
+from typing import Dict, List, Sequence
+
+import numpy as np
+import shapely
+
+OBJECT_NAME = "substations"
+
+# Grid steps across the larger side of the bounding box (~11 m across the UK)
+QUANTIZATION = 100_000
+
+# Douglas-Peucker tolerance for arcs, degrees, matching the GeoJSON boundaries
+ARC_TOLERANCE = 0.001
+
+
+def _polygon_parts(geometries: Sequence):
+    """Polygon parts of each geometry and the geometry each came from."""
+    parts, owner = shapely.get_parts(np.asarray(geometries, dtype=object), return_index=True)
+    # Geometry collections (e.g. from make_valid) may hold multipolygons
+    nested = shapely.get_type_id(parts) == shapely.GeometryType.MULTIPOLYGON
+    if nested.any():
+        inner, inner_owner = shapely.get_parts(parts[nested], return_index=True)
+        parts = np.concatenate([parts[~nested], inner])
+        owner = np.concatenate([owner[~nested], owner[nested][inner_owner]])
+    polygonal = shapely.get_type_id(parts) == shapely.GeometryType.POLYGON
+    return parts[polygonal], owner[polygonal]
+
+
+def _quantized_rings(parts: np.ndarray, translate: np.ndarray, scale: float, quantization: int):
+    """
+    Quantized ring points without closing or repeated points: point keys
+    (x * quantization + y) and the ring of each point, then the part and
+    exterior flag of each ring. Rings with fewer than 3 distinct points are dropped.
+    """
+    rings, ring_part = shapely.get_rings(parts, return_index=True)
+    coords, point_ring = shapely.get_coordinates(rings, return_index=True)
+    exterior = np.r_[True, ring_part[1:] != ring_part[:-1]] if len(rings) else np.array([], dtype=bool)
+
+    grid = np.round((coords - translate) / scale).astype(np.int64)
+    keys = grid[:, 0] * quantization + grid[:, 1]
+
+    # Drop each ring's closing point, then points quantized onto their predecessor
+    last = np.r_[point_ring[1:] != point_ring[:-1], True]
+    keep = ~last
+    keys, point_ring = keys[keep], point_ring[keep]
+    repeat = np.r_[False, (keys[1:] == keys[:-1]) & (point_ring[1:] == point_ring[:-1])]
+    keys, point_ring = keys[~repeat], point_ring[~repeat]
+
+    # ... and a last point that wrapped onto the first
+    start = np.r_[True, point_ring[1:] != point_ring[:-1]]
+    first = np.flatnonzero(start)
+    end = np.r_[first[1:], len(keys)] - 1
+    wrapped = np.zeros(len(keys), dtype=bool)
+    wrapped[end[(keys[end] == keys[first]) & (end > first)]] = True
+    keys, point_ring = keys[~wrapped], point_ring[~wrapped]
+
+    # Drop collapsed rings
+    size = np.bincount(point_ring, minlength=len(rings))
+    kept = size[point_ring] >= 3
+    return keys[kept], point_ring[kept], ring_part, exterior
+
+
+def _junctions(keys: np.ndarray, point_ring: np.ndarray) -> np.ndarray:
+    """Points whose rings pass through with different neighbours."""
+    start = np.r_[True, point_ring[1:] != point_ring[:-1]]
+    first = np.flatnonzero(start)
+    end = np.r_[first[1:], len(keys)] - 1
+    ring_first = np.repeat(first, end - first + 1)
+    ring_end = np.repeat(end, end - first + 1)
+
+    position = np.arange(len(keys))
+    previous = keys[np.where(position == ring_first, ring_end, position - 1)]
+    following = keys[np.where(position == ring_end, ring_first, position + 1)]
+    low, high = np.minimum(previous, following), np.maximum(previous, following)
+
+    # A key is a junction if it's seen with more than one pair of neighbours
+    order = np.lexsort((high, low, keys))
+    sorted_keys, sorted_low, sorted_high = keys[order], low[order], high[order]
+    new_key = np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+    new_pair = new_key | np.r_[True, (sorted_low[1:] != sorted_low[:-1]) | (sorted_high[1:] != sorted_high[:-1])]
+    pairs_per_key = np.add.reduceat(new_pair.astype(np.int64), np.flatnonzero(new_key)) if len(keys) else np.array([], dtype=int)
+    junction_keys = sorted_keys[new_key][pairs_per_key > 1]
+    return np.isin(keys, junction_keys)
+
+
+def _simplify_arc(points: np.ndarray, tolerance: float, keep_interior: bool) -> np.ndarray:
+    """
+    Douglas-Peucker simplification of an arc, keeping its end points. Closed
+    arcs keep at least 4 points, and with keep_interior open arcs keep at
+    least one interior point, so the rings they make can't collapse.
+    """
+    if len(points) <= 2 or tolerance <= 0:
+        return points
+    simplified = shapely.get_coordinates(
+        shapely.simplify(shapely.linestrings(points), tolerance, preserve_topology=False)
+    ).astype(np.int64)
+    closed = (points[0] == points[-1]).all()
+    if closed and len(simplified) < 4:
+        return points
+    if keep_interior and len(simplified) == 2:
+        # The point furthest from the chord
+        chord = points[-1] - points[0]
+        offset = points[1:-1] - points[0]
+        distance = np.abs(chord[0] * offset[:, 1] - chord[1] * offset[:, 0])
+        return np.vstack([points[0], points[1 + np.argmax(distance)], points[-1]])
+    return simplified
+
+
+def build_topology(ids: Sequence[str], geometries: Sequence, tolerance: float = ARC_TOLERANCE,
+                   quantization: int = QUANTIZATION) -> Dict:
+    """
+    TopoJSON topology of the boundaries (shapely geometries in EPSG:4326), one
+    geometry per ID in the OBJECT_NAME collection. Missing or empty boundaries
+    get a null geometry. tolerance is the arc simplification tolerance in degrees.
+    """
+    parts, owner = _polygon_parts(geometries)
+    coords = shapely.get_coordinates(parts)
+    if len(coords):
+        translate = coords.min(axis=0)
+        scale = float((coords.max(axis=0) - translate).max()) / (quantization - 1) or 1.0
+    else:
+        translate, scale = np.zeros(2), 1.0
+
+    keys, point_ring, ring_part, exterior = _quantized_rings(parts, translate, scale, quantization)
+    junction = _junctions(keys, point_ring)
+
+    # Cut every ring into arcs at its junctions, storing each arc once
+    arcs: List[np.ndarray] = []
+    arc_ids: Dict[bytes, int] = {}
+    ring_arcs: Dict[int, List[int]] = {}
+    ring_starts = np.flatnonzero(np.r_[True, point_ring[1:] != point_ring[:-1]]) if len(keys) else np.array([], dtype=int)
+    ring_ends = np.r_[ring_starts[1:], len(keys)]
+
+    def add_arc(arc_keys: np.ndarray) -> int:
+        forward = arc_keys.tobytes()
+        if forward in arc_ids:
+            return arc_ids[forward]
+        backward = arc_keys[::-1].tobytes()
+        if backward in arc_ids:
+            return ~arc_ids[backward]
+        arc_ids[forward] = len(arcs)
+        arcs.append(arc_keys)
+        return len(arcs) - 1
+
+    for start, end in zip(ring_starts, ring_ends):
+        ring_keys = keys[start:end]
+        cuts = np.flatnonzero(junction[start:end])
+        if len(cuts) == 0:
+            # A ring sharing no junction is one closed arc, started at its smallest key
+            # so that a neighbour sharing the whole ring finds it
+            ring_keys = np.roll(ring_keys, -int(np.argmin(ring_keys)))
+            ring_arcs[int(point_ring[start])] = [add_arc(np.r_[ring_keys, ring_keys[:1]])]
+            continue
+        ring_keys = np.roll(ring_keys, -int(cuts[0]))
+        cuts = np.r_[cuts - cuts[0], len(ring_keys)]
+        ring_keys = np.r_[ring_keys, ring_keys[:1]]
+        ring_arcs[int(point_ring[start])] = [add_arc(ring_keys[a:b + 1]) for a, b in zip(cuts[:-1], cuts[1:])]
+
+    # Arcs making rings of two arcs keep an interior point when simplified
+    two_arc_rings = {arc if arc >= 0 else ~arc for indices in ring_arcs.values() if len(indices) <= 2 for arc in indices}
+    encoded_arcs = []
+    for i, arc_keys in enumerate(arcs):
+        points = np.column_stack([arc_keys // quantization, arc_keys % quantization])
+        points = _simplify_arc(points, tolerance / scale, i in two_arc_rings)
+        deltas = np.vstack([points[:1], np.diff(points, axis=0)])
+        encoded_arcs.append(deltas.tolist())
+
+    # Geometries: the rings of each polygon part, exteriors first
+    polygons: Dict[int, List[List[List[int]]]] = {}
+    for ring in sorted(ring_arcs):
+        part = int(ring_part[ring])
+        if exterior[ring]:
+            polygons[part] = [ring_arcs[ring]]
+        elif part in polygons:
+            polygons[part].append(ring_arcs[ring])
+
+    by_geometry: Dict[int, List] = {}
+    for part in sorted(polygons):
+        by_geometry.setdefault(int(owner[part]), []).append(polygons[part])
+
+    geometries_out = []
+    for i, substation_id in enumerate(ids):
+        polygon_arcs = by_geometry.get(i)
+        if not polygon_arcs:
+            geometries_out.append({"type": None, "id": substation_id})
+        elif len(polygon_arcs) == 1:
+            geometries_out.append({"type": "Polygon", "id": substation_id, "arcs": polygon_arcs[0]})
+        else:
+            geometries_out.append({"type": "MultiPolygon", "id": substation_id, "arcs": polygon_arcs})
+
+    return {
+        "type": "Topology",
+        "transform": {"scale": [scale, scale], "translate": translate.tolist()},
+        "arcs": encoded_arcs,
+        "objects": {OBJECT_NAME: {"type": "GeometryCollection", "geometries": geometries_out}}
+    }
+
+
+def split_topology(topology: Dict, groups: Sequence[Sequence[str]]) -> List[Dict]:
+    """
+    Split a topology into one per group of IDs, each with the arcs its
+    geometries use (renumbered) and the same transform as the whole.
+    """
+    geometries = {geometry['id']: geometry for geometry in topology['objects'][OBJECT_NAME]['geometries']}
+
+    split = []
+    for ids in groups:
+        members = [geometries[substation_id] for substation_id in ids]
+        used = sorted({index for geometry in members for index in _arc_indices(geometry.get('arcs', []))})
+        renumbered = {old: new for new, old in enumerate(used)}
+        split.append({
+            "type": "Topology",
+            "transform": topology['transform'],
+            "arcs": [topology['arcs'][old] for old in used],
+            "objects": {OBJECT_NAME: {"type": "GeometryCollection", "geometries": [
+                {**geometry, "arcs": _renumber_arcs(geometry['arcs'], renumbered)} if 'arcs' in geometry else geometry
+                for geometry in members
+            ]}}
+        })
+    return split
+
+
+def _arc_indices(arcs: List) -> List[int]:
+    """Arcs (unreversed) used by a geometry's nested rings of arc indices."""
+    if arcs and isinstance(arcs[0], int):
+        return [arc if arc >= 0 else ~arc for arc in arcs]
+    return [index for nested in arcs for index in _arc_indices(nested)]
+
+
+def _renumber_arcs(arcs: List, renumbered: Dict[int, int]) -> List:
+    """A geometry's nested rings of arc indices with the arcs renumbered, keeping reversals."""
+    if arcs and isinstance(arcs[0], int):
+        return [renumbered[arc] if arc >= 0 else ~renumbered[~arc] for arc in arcs]
+    return [_renumber_arcs(nested, renumbered) for nested in arcs]
+
+
+def decode_arcs(topology: Dict) -> List[np.ndarray]:
+    """Absolute coordinates (lng, lat) of each arc of a topology."""
+    scale = np.asarray(topology['transform']['scale'])
+    translate = np.asarray(topology['transform']['translate'])
+    return [np.cumsum(np.asarray(arc, dtype=np.int64).reshape(-1, 2), axis=0) * scale + translate
+            for arc in topology['arcs']]
+
+
+def _ring_coordinates(arcs: List[np.ndarray], indices: List[int]) -> List[List[float]]:
+    """Join a ring's arcs, dropping the point each arc shares with the one before."""
+    pieces = []
+    for n, index in enumerate(indices):
+        arc = arcs[index] if index >= 0 else arcs[~index][::-1]
+        pieces.append(arc if n == 0 else arc[1:])
+    return np.round(np.concatenate(pieces), 6).tolist()
+
+
+def decode_topology(topology: Dict, object_name: str = OBJECT_NAME) -> Dict[str, Dict]:
+    """GeoJSON geometry mapping of every boundary in a topology, by ID (None if missing)."""
+    arcs = decode_arcs(topology)
+    decoded = {}
+    for geometry in topology['objects'][object_name]['geometries']:
+        if geometry['type'] == 'Polygon':
+            coordinates = [_ring_coordinates(arcs, ring) for ring in geometry['arcs']]
+        elif geometry['type'] == 'MultiPolygon':
+            coordinates = [[_ring_coordinates(arcs, ring) for ring in polygon] for polygon in geometry['arcs']]
+        else:
+            decoded[geometry['id']] = None
+            continue
+        decoded[geometry['id']] = {"type": geometry['type'], "coordinates": coordinates}
+    return decoded
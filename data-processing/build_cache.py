@@ -0,0 +1,126 @@
+"""
+Build cache for incremental rebuilds.
+
+Each raw input is fingerprinted by content hash. The normalized substations of
+each DNO and the postcodes matched to them are cached under cache/, keyed on
+those fingerprints, so a rebuild only reloads and re-joins the licence areas
+whose inputs changed. The substation cache is also used by plain runs, so warm
+runs skip parsing the raw GeoJSON/GeoPackage files.
+
+Layout:
+    cache/manifest.json              fingerprints of the cached entries
+    cache/substations/<dno_id>.parquet  standardized substations (GeoParquet)
+    cache/matched/<dno_id>.parquet      postcodes matched to that DNO's substations
+
+Author: postcodes.energy
+License: MIT
+"""
+
+import hashlib
+import json
+from pathlib import Path
+from typing import Dict, List
+
+import geopandas as gpd
+import pandas as pd
+
+CACHE_DIR = Path("cache")
+
+# Bump when loading or matching logic changes, to invalidate existing caches
+CACHE_VERSION = 3
+
+
+def file_fingerprint(path: Path, block_size: int = 1 << 20) -> str:
+    """SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def combine_fingerprints(*parts) -> str:
+    """Fingerprint of several fingerprints or JSON-serializable settings."""
+    digest = hashlib.sha256()
+    for part in (CACHE_VERSION,) + parts:
+        digest.update(json.dumps(part, sort_keys=True).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class BuildCache:
+    """Per-DNO cache of normalized substations and matched postcodes."""
+
+    def __init__(self, cache_dir: Path = CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.manifest_file = cache_dir / "manifest.json"
+        self.manifest = {'version': CACHE_VERSION, 'files': {}, 'postcodes': {}, 'substations': {}, 'matched': {}}
+        if self.manifest_file.exists():
+            manifest = json.loads(self.manifest_file.read_text())
+            if manifest.get('version') == CACHE_VERSION:
+                self.manifest = manifest
+                self.manifest.setdefault('files', {})
+
+    def fingerprint(self, path: Path) -> str:
+        """
+        Content fingerprint of a raw input file. The hash is reused while the
+        file's size and modification time are unchanged, so warm runs don't re-read it.
+        """
+        stat = path.stat()
+        key = str(path.resolve())
+        known = self.manifest['files'].get(key)
+        if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+            return known['sha256']
+
+        sha256 = file_fingerprint(path)
+        self.manifest['files'][key] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256}
+        return sha256
+
+    def _path(self, kind: str, dno_id: str) -> Path:
+        return self.cache_dir / kind / f"{dno_id}.parquet"
+
+    def _is_fresh(self, kind: str, dno_id: str, fingerprint: str) -> bool:
+        return self.manifest[kind].get(dno_id) == fingerprint and self._path(kind, dno_id).exists()
+
+    def _store(self, kind: str, dno_id: str, fingerprint: str, df: pd.DataFrame):
+        path = self._path(kind, dno_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        df.to_parquet(path, index=False)
+        self.manifest[kind][dno_id] = fingerprint
+
+    def cached_dnos(self, kind: str) -> List[str]:
+        """DNO IDs with a cached entry of this kind ('substations' or 'matched')."""
+        return [dno_id for dno_id in self.manifest[kind] if self._path(kind, dno_id).exists()]
+
+    def substations_fresh(self, dno_id: str, fingerprint: str) -> bool:
+        return self._is_fresh('substations', dno_id, fingerprint)
+
+    def load_substations(self, dno_id: str) -> gpd.GeoDataFrame:
+        return gpd.read_parquet(self._path('substations', dno_id))
+
+    def store_substations(self, dno_id: str, fingerprint: str, gdf: gpd.GeoDataFrame):
+        self._store('substations', dno_id, fingerprint, gdf)
+
+    def matched_fresh(self, dno_id: str, fingerprint: str) -> bool:
+        return self._is_fresh('matched', dno_id, fingerprint)
+
+    def load_matched(self, dno_id: str) -> pd.DataFrame:
+        return pd.read_parquet(self._path('matched', dno_id))
+
+    def store_matched(self, dno_id: str, fingerprint: str, df: pd.DataFrame):
+        self._store('matched', dno_id, fingerprint, df)
+
+    def drop_matched(self, dno_id: str):
+        """Forget a DNO's matched postcodes (e.g. its file was removed)."""
+        self.manifest['matched'].pop(dno_id, None)
+        self._path('matched', dno_id).unlink(missing_ok=True)
+
+    @property
+    def postcodes(self) -> Dict:
+        """Fingerprint and row count of the postcode file the matched entries were built from."""
+        return self.manifest['postcodes']
+
+    def save(self):
+        """Write the manifest - call once the cached entries are all stored."""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest_file.write_text(json.dumps(self.manifest, indent=2))
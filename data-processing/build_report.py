@@ -0,0 +1,209 @@
+"""
+Per-stage instrumentation of the processing pipeline.
+
+Each stage of process_data.main() runs inside BuildReport.stage(), which
+records its wall time, CPU time (including worker processes that finished
+during it), peak resident memory, rows in and out, the bytes and files it
+wrote to the output directory, and any counts the stage adds. The report is
+saved as output/build_report.json, in the same generation as chunks_index.json:
+
+    {"generated": "...", "wall_s": 312.4, "peak_rss_mb": 2841.0, "options": {...},
+     "stages": [{"name": "match_postcodes", "wall_s": 121.3, "cpu_s": 118.9,
+                 "peak_rss_mb": 2213.5, "rows_in": 2631017, "rows_out": 2629488,
+                 "bytes_written": 0, "files_written": 0,
+                 "counts": {"matched": 2612240, "unmatched": 17248}}, ...]}
+
+Peak memory is per stage on Linux, where the process's high-water mark can be
+reset between stages; elsewhere it's the process's peak so far
+("peak_rss_scope": "process"), or missing without the resource module
+(Windows). With a profile directory, each stage is also run under cProfile
+and its stats dumped to <profile_dir>/<stage>.prof (open with
+`python -m pstats` or snakeviz).
+
+    report = BuildReport(OUTPUT_DIR)
+    with report.stage('load_households') as stage:
+        households = load_household_data()
+        stage.rows_out = len(households)
+    report.save(OUTPUT_DIR / REPORT_FILE)
+
+Author: postcodes.energy
+License: MIT
+"""
+
+import cProfile
+import json
+import os
+import platform
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+import pandas as pd
+
+from output_writer import OutputWriter
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+REPORT_FILE = "build_report.json"
+REPORT_VERSION = 1
+
+# Linux: writing 5 to clear_refs resets the VmHWM (peak RSS) reported in status
+CLEAR_REFS = Path("/proc/self/clear_refs")
+PROC_STATUS = Path("/proc/self/status")
+
+
+def _reset_peak_rss() -> bool:
+    """Reset the process's peak RSS, where the OS allows it. Returns whether it was reset."""
+    try:
+        CLEAR_REFS.write_text("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb() -> float:
+    """Peak resident memory of this process in MB (since the last reset, on Linux), or None."""
+    try:
+        for line in PROC_STATUS.read_text().splitlines():
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def _cpu_seconds() -> float:
+    """CPU time used by this process and its finished child processes."""
+    if resource is None:
+        return time.process_time()
+    return sum(
+        usage.ru_utime + usage.ru_stime
+        for usage in (resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN))
+    )
+
+
+def _written_since(directory: Path, since_ns: int, exclude: Path = None) -> Tuple[int, int]:
+    """Bytes and number of files in directory modified since since_ns."""
+    written = files = 0
+    if not directory.exists():
+        return 0, 0
+    for root, dirs, names in os.walk(directory):
+        for name in names:
+            path = Path(root) / name
+            # Links (see output_writer.py) are counted where they point
+            if path == exclude or path.is_symlink():
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if stat.st_mtime_ns >= since_ns:
+                written += stat.st_size
+                files += 1
+    return written, files
+
+
+class Stage:
+    """Measurements of one pipeline stage. Stages set rows_in, rows_out and counts themselves."""
+
+    def __init__(self, name: str, rows_in: int = None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.counts = {}
+        self.measurements = {}
+
+    def to_dict(self) -> Dict:
+        record = {'name': self.name, **self.measurements, 'rows_in': self.rows_in, 'rows_out': self.rows_out}
+        if self.counts:
+            record['counts'] = {key: int(value) for key, value in self.counts.items()}
+        return record
+
+
+class BuildReport:
+    """Records each pipeline stage run through stage() and saves them as a JSON report."""
+
+    def __init__(self, output_dir: Path, profile_dir: Path = None, options: Dict = None):
+        self.output_dir = Path(output_dir)
+        self.profile_dir = Path(profile_dir) if profile_dir else None
+        self.options = options or {}
+        self.stages: List[Stage] = []
+        self.started = time.perf_counter()
+        self.peak_rss_mb = None
+        if self.profile_dir:
+            self.profile_dir.mkdir(parents=True, exist_ok=True)
+
+    @contextmanager
+    def stage(self, name: str, rows_in: int = None) -> Iterator[Stage]:
+        """Measure the code run in the with block as the named stage."""
+        stage = Stage(name, rows_in)
+        per_stage_peak = _reset_peak_rss()
+        started_ns = time.time_ns()
+        wall = time.perf_counter()
+        cpu = _cpu_seconds()
+        profiler = cProfile.Profile() if self.profile_dir else None
+        if profiler:
+            profiler.enable()
+        try:
+            yield stage
+        finally:
+            if profiler:
+                profiler.disable()
+            stage.measurements['wall_s'] = round(time.perf_counter() - wall, 3)
+            stage.measurements['cpu_s'] = round(_cpu_seconds() - cpu, 3)
+            peak = _peak_rss_mb()
+            if peak is not None:
+                stage.measurements['peak_rss_mb'] = round(peak, 1)
+                self.peak_rss_mb = max(self.peak_rss_mb or 0, peak)
+                if not per_stage_peak:
+                    stage.measurements['peak_rss_scope'] = 'process'
+            written, files = _written_since(self.output_dir, started_ns, self.output_dir / REPORT_FILE)
+            stage.measurements['bytes_written'] = written
+            stage.measurements['files_written'] = files
+            if profiler:
+                profiler.dump_stats(self.profile_dir / f"{name}.prof")
+            self.stages.append(stage)
+
+    def to_dict(self) -> Dict:
+        return {
+            'version': REPORT_VERSION,
+            'generated': str(pd.Timestamp.now()),
+            'wall_s': round(time.perf_counter() - self.started, 3),
+            'peak_rss_mb': round(self.peak_rss_mb, 1) if self.peak_rss_mb is not None else None,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'options': self.options,
+            'stages': [stage.to_dict() for stage in self.stages],
+        }
+
+    def save(self, report_file: Path, writer: OutputWriter = None) -> Dict:
+        """
+        Write the report to report_file and print a summary table. With writer
+        report_file is relative to its output directory, and the report becomes
+        part of its generation (see output_writer.py). Returns the report.
+        """
+        report = self.to_dict()
+        if writer is None:
+            with open(report_file, 'w') as f:
+                json.dump(report, f, indent=2)
+        else:
+            writer.write_json(str(report_file), report, indent=2)
+            report_file = writer.output_dir / report_file
+
+        print(f"\n{'Stage':<32} {'Wall':>9} {'CPU':>9} {'Peak RSS':>11} {'Written':>11}")
+        for stage in report['stages']:
+            peak = f"{stage['peak_rss_mb']:,.0f} MB" if 'peak_rss_mb' in stage else "-"
+            print(f"{stage['name']:<32} {stage['wall_s']:>8.1f}s {stage['cpu_s']:>8.1f}s "
+                  f"{peak:>11} {stage['bytes_written'] / 1e6:>8,.1f} MB")
+        print(f"\n[OK] Saved {report_file} ({report['wall_s']:.1f}s total)")
+        return report
@@ -1,27 +1,38 @@
-import geopandas as gpd
-from shapely.geometry import Point
+import sys
+
+from shapely.geometry import Point, shape
 import json
 
+from boundary_shards import load_boundaries
+from postcode_index import PostcodeIndex
+
+postcode = sys.argv[1] if len(sys.argv) > 1 else 'N15 5QA'
+
 # Load substations
 print("Loading substation data...")
 with open('output/substations.json', 'r') as f:
     substations_data = json.load(f)
 
-# Create point for N15 5QA
-lat, lon = 51.58152, -0.083085
-point = Point(lon, lat)
-print(f"\nN15 5QA location: {lat}, {lon}")
+# Load substation boundaries from the boundary shards
+boundaries = load_boundaries('output')
+
+# Look up the postcode's location in the postcode index
+with PostcodeIndex('output/postcode_index.bin') as index:
+    location = index.lookup(postcode)
+if location is None:
+    print(f"\n{postcode} not found in postcode index")
+    sys.exit(1)
 
-# Check which DNO areas this is in (should be UKPN London)
-print("\nChecking nearby substations...")
+lat, lon = location['lat'], location['lng']
+point = Point(lon, lat)
+print(f"\n{postcode} location: {lat}, {lon}")
+print(f"Matched substation: {location['substation_id']}")
 
-# Find closest substations
-distances = []
+# Check which substation boundaries contain it
+print("\nChecking substation boundaries...")
 for sub_id, sub_data in substations_data.items():
-    if 'boundary' in sub_data and sub_data['boundary']:
-        # Check DNO
-        if 'UKPN' in sub_data.get('dno', '') or 'UK Power' in sub_data.get('dno', ''):
-            print(f"  Found UKPN substation: {sub_data.get('name', sub_id)}")
+    if boundaries.get(sub_id) and shape(boundaries[sub_id]).covers(point):
+        print(f"  Inside {sub_data.get('name', sub_id)} ({sub_data.get('dno', '')})")
 
 print(f"\nTotal substations in data: {len(substations_data)}")
 
@@ -0,0 +1,67 @@
+"""
+Check that bulk enrichment gives the same rows however the input is batched,
+including when no postcode in the first batch matches (so its added columns
+are all null).
+
+Usage: python check_enrich.py [--rows N] [--batch-size N]
+
+Requires output/postcode_index.bin and output/substations.json from process_data.py.
+"""
+
+import argparse
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+import enrich_postcodes
+from postcode_codec import decode_postcodes
+from postcode_index import PostcodeIndex
+
+# Inputs that shouldn't match (checked against the index)
+UNMATCHED_POSTCODES = ['ZZ99 9ZZ', 'not a postcode', '']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare batched enrichment with enrichment in one batch.")
+    parser.add_argument('--rows', type=int, default=1000, help="Matched postcodes to enrich (default 1,000)")
+    parser.add_argument('--batch-size', type=int, default=5, help="Rows per batch of the batched run (default 5)")
+    args = parser.parse_args()
+
+    for required in (enrich_postcodes.POSTCODE_INDEX_FILE, enrich_postcodes.SUBSTATIONS_FILE):
+        if not required.exists():
+            print(f"ERROR: {required} not found - run process_data.py first")
+            return
+
+    # A first batch of unmatched postcodes, then postcodes from the index
+    with PostcodeIndex(enrich_postcodes.POSTCODE_INDEX_FILE) as index:
+        matched = decode_postcodes(index.keys[::max(len(index) // args.rows, 1)][:args.rows]).tolist()
+        unmatched = [postcode for postcode in UNMATCHED_POSTCODES if postcode not in index]
+    unmatched = (unmatched * args.batch_size)[:args.batch_size]
+    rows = pd.DataFrame({'postcode': unmatched + matched, 'row': range(len(unmatched) + len(matched))}).astype(str)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        for suffix in ('.csv', '.parquet'):
+            source = tmp / f"input{suffix}"
+            if suffix == '.csv':
+                rows.to_csv(source, index=False)
+            else:
+                rows.to_parquet(source, index=False)
+
+            results = []
+            for batch_size in (args.batch_size, len(rows)):
+                output = tmp / f"output_{batch_size}{suffix}"
+                enrich_postcodes.main(enrich_postcodes.parse_args([str(source), str(output), '--batch-size', str(batch_size)]))
+                results.append(pd.read_csv(output, dtype=str) if suffix == '.csv' else pd.read_parquet(output))
+
+            batched, whole = results
+            assert_frame_equal(batched, whole)
+            assert batched['substation_id'].iloc[:len(unmatched)].isna().all()
+            print(f"\n[OK] {suffix} output in batches of {args.batch_size} matches one batch "
+                  f"({len(batched):,} rows, {batched['substation_id'].notna().sum():,} matched)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Check that the parallel spatial join (or the grid index engine) gives exactly
+the same result as the serial sjoin.
+
+Usage: python check_parallel_join.py [--engine parallel|grid] [--workers N] [--limit ROWS]
+"""
+
+import argparse
+import time
+
+import geopandas as gpd
+from geopandas.testing import assert_geodataframe_equal
+
+from grid_index import SubstationGridIndex
+from process_data import load_all_substations, load_postcode_data
+from spatial_join import TILES_PER_WORKER, create_join_pool, parallel_sjoin
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the parallel or grid spatial join with the serial sjoin.")
+    parser.add_argument('--engine', choices=['parallel', 'grid'], default='parallel', help="Join engine to check")
+    parser.add_argument('--workers', type=int, default=4, help="Worker processes for the parallel join")
+    parser.add_argument('--limit', type=int, default=0, help="Only check the first ROWS postcodes (default: all)")
+    args = parser.parse_args()
+
+    substations = load_all_substations()
+    postcodes = load_postcode_data()
+    if postcodes is None:
+        return
+    if args.limit:
+        postcodes = postcodes.iloc[:args.limit]
+
+    print(f"\nSerial join of {len(postcodes):,} postcodes...")
+    start = time.perf_counter()
+    serial = gpd.sjoin(postcodes, substations, how='left', predicate='within')
+    print(f"  {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    if args.engine == 'grid':
+        print("Grid index join...")
+        grid_index = SubstationGridIndex.from_substations(substations)
+        print(f"  built in {time.perf_counter() - start:.1f}s")
+        start = time.perf_counter()
+        joined = grid_index.sjoin(postcodes, substations)
+    else:
+        print(f"Parallel join with {args.workers} workers...")
+        with create_join_pool(substations, args.workers) as executor:
+            joined = parallel_sjoin(postcodes, substations, executor, n_tiles=args.workers * TILES_PER_WORKER)
+    print(f"  {time.perf_counter() - start:.1f}s")
+
+    assert_geodataframe_equal(joined, serial, check_dtype=False, check_index_type=False)
+    print(f"\n[OK] {args.engine.capitalize()} join matches serial join ({len(serial):,} rows)")
+
+
+if __name__ == "__main__":
+    main()
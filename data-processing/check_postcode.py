@@ -1,37 +1,22 @@
-import pandas as pd
-import json
+import sys
 
-# Check in ONSPD
-print("Checking ONSPD file...")
-df = pd.read_csv('raw/postcodes/ONSPD_Online_latest_Postcode_Centroids_.csv', usecols=['PCDS', 'LAT', 'LONG'])
-n15_5qa = df[df['PCDS'] == 'N15 5QA']
-print(f"N15 5QA in ONSPD: {len(n15_5qa) > 0}")
-if len(n15_5qa) > 0:
-    print(f"  LAT: {n15_5qa.iloc[0]['LAT']}, LONG: {n15_5qa.iloc[0]['LONG']}")
+from postcode_index import PostcodeIndex
 
-# Check in processed data
-print("\nChecking processed data...")
-with open('output/postcode_lookup.json', 'r') as f:
-    lookup = json.load(f)
+# Postcodes to check, e.g. python check_postcode.py "N15 5QA" N155QA
+postcodes = sys.argv[1:] or ['N15 5QA']
 
-# Check N15 area
-if 'N15' in lookup:
-    print(f"N15 area found with {len(lookup['N15'])} postcodes")
+# Check in the postcode index written by process_data.py
+print("Checking postcode index...")
+with PostcodeIndex('output/postcode_index.bin') as index:
+    print(f"Index holds {len(index):,} postcodes and {len(index.substation_ids):,} substations")
     
-    # Check for N15 5QA with space
-    if 'N15 5QA' in lookup['N15']:
-        print("  'N15 5QA' (with space) found!")
-        print(f"  Substation: {lookup['N15']['N15 5QA']}")
-    else:
-        print("  'N15 5QA' (with space) NOT found")
-    
-    # Check for N155QA without space
-    if 'N155QA' in lookup['N15']:
-        print("  'N155QA' (without space) found!")
-    else:
-        print("  'N155QA' (without space) NOT found")
-    
-    # Show some sample N15 postcodes
-    print(f"\n  Sample N15 postcodes: {list(lookup['N15'].keys())[:5]}")
-else:
-    print("N15 area NOT found in lookup")
+    for row in index.lookup_many(postcodes).itertuples():
+        if not row.found:
+            print(f"\n'{row.postcode}' NOT found")
+            continue
+        print(f"\n'{row.postcode}' found!")
+        print(f"  LAT: {row.lat}, LONG: {row.lng}")
+        if row.substation_id is None:
+            print("  Not matched to any substation")
+        else:
+            print(f"  Substation: {row.substation_id}")
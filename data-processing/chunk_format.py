@@ -0,0 +1,217 @@
+"""
+Compact binary encoding for postcode lookup chunks (chunks/<outward>.bin,
+or chunks/<shard>.bin in the sharded layout, see chunk_shards.py).
+
+A chunk holds the same data as chunks/<outward>.json - substation ID and
+coordinates for every postcode in one outward code - as contiguous typed
+arrays instead of repeated JSON objects. All integers are little-endian.
+
+    offset  type                  contents
+    0       4 bytes               magic b'PEC2'
+    4       uint32                count: number of postcodes
+    8       uint32                outward: the outward code's ID (postcode key // INWARD_CODES)
+    12      uint32                table_bytes: length of the string table
+    16      int32[count]          latitude, fixed point (degrees * COORD_SCALE)
+            int32[count]          longitude, fixed point (degrees * COORD_SCALE)
+            uint16[count]         index into the chunk's substation IDs
+            uint16[count]         postcode inward codes (postcode key % INWARD_CODES,
+                                  see postcode_codec.py: sector * 676 + unit letters)
+            utf-8[table_bytes]    string table, newline separated: the
+                                  outward code, then the substation IDs
+
+Chunks holding postcodes assigned by the nearest-substation fallback end with
+an optional section (absent when there are none):
+
+            uint32                nearest: number of fallback postcodes
+            uint32[nearest]       their rows
+            uint32[nearest]       their distance to the substation, metres
+
+Shards span several outward codes, so they are encoded with magic b'PES1':
+the same header with outward 0, full keys in place of the inward codes, and
+the shard's first postcode prefix in place of the outward code. The keys go
+before the substation indices to keep them 4-byte aligned:
+
+    16      int32[count]          latitude
+            int32[count]          longitude
+            uint32[count]         postcode keys
+            uint16[count]         index into the shard's substation IDs
+            utf-8[table_bytes]    the shard's prefix, then the substation IDs
+
+followed by the same optional nearest section.
+
+Postcodes are sorted by key, so a single postcode can be found by binary
+search, and outward * INWARD_CODES + inward gives each one's full key.
+COORD_SCALE keeps the 6 decimal places published in ONSPD, so coordinates
+decode to exactly the values in the JSON chunks.
+
+The JavaScript decoder is decodeChunk() in public/app.js.
+
+Author: postcodes.energy
+License: MIT
+"""
+
+import struct
+from pathlib import Path
+from typing import Dict, NamedTuple, Tuple
+
+import numpy as np
+import pandas as pd
+
+from matched_frame import COORD_SCALE
+from postcode_codec import INWARD_CODES, KEY_DTYPE, decode_outward, decode_postcodes, encode_postcodes
+
+MAGIC = b'PEC2'
+SHARD_MAGIC = b'PES1'
+HEADER = struct.Struct('<4sIII')
+NEAREST_HEADER = struct.Struct('<I')
+
+
+class ChunkArrays(NamedTuple):
+    """Decoded chunk as NumPy arrays, sorted by postcode."""
+    outward: str  # outward code, or the prefix a shard starts at
+    keys: np.ndarray  # postcode keys (see postcode_codec.py)
+    postcodes: np.ndarray
+    substation_ids: np.ndarray
+    lat: np.ndarray
+    lng: np.ndarray
+    distance_m: np.ndarray  # nearest-fallback distance, NaN where the postcode is within its substation
+
+    def find(self, postcode: str) -> int:
+        """Row of a postcode (in any spacing and case), or -1 if it isn't in the chunk."""
+        key = encode_postcodes([postcode])[0]
+        row = int(np.searchsorted(self.keys, key))
+        if row < len(self.keys) and self.keys[row] == key:
+            return row
+        return -1
+
+
+def encode_chunk(outward: str, chunk: pd.DataFrame) -> bytes:
+    """
+    Encode one outward code's postcodes (columns key, substation_id, lat, long,
+    and optionally match_type / match_distance_m from the nearest fallback).
+    As with the JSON chunks, the last row wins if a postcode appears twice.
+    """
+    chunk = chunk.drop_duplicates('key', keep='last').sort_values('key', kind='stable')
+    outward_ids, inward = np.divmod(chunk['key'].to_numpy(dtype=np.int64), INWARD_CODES)
+    outward_id = outward_ids[0] if len(outward_ids) else encode_postcodes([f"{outward} 0AA"])[0] // INWARD_CODES
+    if (outward_ids != outward_id).any() or decode_outward([outward_id])[0] != outward:
+        raise ValueError(f"Chunk {outward} has postcodes outside its outward code")
+
+    substation_ids, substation_idx = _substation_indices(chunk, outward)
+    table = '\n'.join([outward] + substation_ids.tolist()).encode('utf-8')
+
+    return b''.join([
+        HEADER.pack(MAGIC, len(chunk), int(outward_id), len(table)),
+        _coordinates(chunk),
+        substation_idx.astype('<u2').tobytes(),
+        inward.astype('<u2').tobytes(),
+        table,
+        _nearest_section(chunk)
+    ])
+
+
+def encode_shard(prefix: str, chunk: pd.DataFrame) -> bytes:
+    """
+    Encode one shard's postcodes (the same columns as encode_chunk), which may
+    span several outward codes. prefix is the routing prefix the shard starts at.
+    """
+    chunk = chunk.drop_duplicates('key', keep='last').sort_values('key', kind='stable')
+    substation_ids, substation_idx = _substation_indices(chunk, prefix)
+    table = '\n'.join([prefix] + substation_ids.tolist()).encode('utf-8')
+
+    return b''.join([
+        HEADER.pack(SHARD_MAGIC, len(chunk), 0, len(table)),
+        _coordinates(chunk),
+        chunk['key'].to_numpy().astype('<u4').tobytes(),
+        substation_idx.astype('<u2').tobytes(),
+        table,
+        _nearest_section(chunk)
+    ])
+
+
+def _substation_indices(chunk: pd.DataFrame, name: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Sorted substation IDs of a chunk, and each row's index into them."""
+    substation_ids, substation_idx = np.unique(chunk['substation_id'].to_numpy(dtype=str), return_inverse=True)
+    if len(substation_ids) > np.iinfo(np.uint16).max:
+        raise ValueError(f"Chunk {name} has too many substations for uint16 indices")
+    return substation_ids, substation_idx
+
+
+def _coordinates(chunk: pd.DataFrame) -> bytes:
+    """Fixed-point latitude then longitude arrays of a chunk."""
+    return (
+        np.rint(chunk['lat'].to_numpy(dtype=float) * COORD_SCALE).astype('<i4').tobytes() +
+        np.rint(chunk['long'].to_numpy(dtype=float) * COORD_SCALE).astype('<i4').tobytes()
+    )
+
+
+def _nearest_section(chunk: pd.DataFrame) -> bytes:
+    """Optional section listing the rows assigned by the nearest fallback."""
+    if 'match_type' not in chunk.columns:
+        return b''
+    rows = np.flatnonzero(chunk['match_type'].to_numpy() == 'nearest')
+    if not len(rows):
+        return b''
+    distance = np.rint(chunk['match_distance_m'].to_numpy(dtype=float)[rows])
+    return NEAREST_HEADER.pack(len(rows)) + rows.astype('<u4').tobytes() + distance.astype('<u4').tobytes()
+
+
+def decode_chunk_arrays(data: bytes) -> ChunkArrays:
+    """Decode a binary chunk or shard into NumPy arrays."""
+    magic, count, outward_id, table_bytes = HEADER.unpack_from(data)
+    if magic not in (MAGIC, SHARD_MAGIC):
+        raise ValueError("Not a binary postcode chunk")
+
+    offset = HEADER.size
+    lat = np.frombuffer(data, dtype='<i4', count=count, offset=offset)
+    offset += 4 * count
+    lng = np.frombuffer(data, dtype='<i4', count=count, offset=offset)
+    offset += 4 * count
+    if magic == SHARD_MAGIC:
+        keys = np.frombuffer(data, dtype='<u4', count=count, offset=offset).astype(KEY_DTYPE)
+        offset += 4 * count
+    substation_idx = np.frombuffer(data, dtype='<u2', count=count, offset=offset)
+    offset += 2 * count
+    if magic == MAGIC:
+        inward = np.frombuffer(data, dtype='<u2', count=count, offset=offset)
+        keys = (inward.astype(np.int64) + outward_id * INWARD_CODES).astype(KEY_DTYPE)
+        offset += 2 * count
+    table = data[offset:offset + table_bytes].decode('utf-8').split('\n')
+    offset += table_bytes
+
+    distance_m = np.full(count, np.nan)
+    if len(data) > offset:
+        (nearest,) = NEAREST_HEADER.unpack_from(data, offset)
+        offset += NEAREST_HEADER.size
+        rows = np.frombuffer(data, dtype='<u4', count=nearest, offset=offset)
+        distance_m[rows] = np.frombuffer(data, dtype='<u4', count=nearest, offset=offset + 4 * nearest)
+
+    outward, substation_ids = table[0], np.array(table[1:], dtype=str)
+    return ChunkArrays(
+        outward=outward,
+        keys=keys,
+        postcodes=decode_postcodes(keys),
+        substation_ids=substation_ids[substation_idx] if count else np.array([], dtype=str),
+        lat=lat / COORD_SCALE,
+        lng=lng / COORD_SCALE,
+        distance_m=distance_m
+    )
+
+
+def decode_chunk(data: bytes) -> Dict:
+    """Decode a binary chunk into the same dict as its JSON chunk."""
+    chunk = decode_chunk_arrays(data)
+    lookup = {
+        postcode: {'substation_id': substation_id, 'lat': lat, 'lng': lng}
+        for postcode, substation_id, lat, lng in zip(
+            chunk.postcodes.tolist(), chunk.substation_ids.tolist(), chunk.lat.tolist(), chunk.lng.tolist()
+        )
+    }
+    for row in np.flatnonzero(~np.isnan(chunk.distance_m)).tolist():
+        lookup[chunk.postcodes[row]].update(match='nearest', distance_m=int(chunk.distance_m[row]))
+    return lookup
+
+
+def read_chunk(path: Path) -> Dict:
+    """Read a binary chunk file into the same dict as its JSON chunk."""
+    return decode_chunk(Path(path).read_bytes())
@@ -0,0 +1,153 @@
+"""
+Size-balanced postcode lookup shards, and a routing index to find them.
+
+By default the lookup is written as one chunk per outward code, which at UK
+scale is thousands of files from a few hundred bytes (rural districts) to
+tens of KB (central London). The sharded layout packs the same rows into
+files of about a target size instead:
+
+    - districts larger than the target are split into their sectors
+      ("N15 5"), the smallest unit a postcode can be routed by
+    - consecutive districts and sectors, in postcode order, are packed
+      together until a shard is as close to the target as it can get
+
+A shard is a contiguous range of postcodes, so it is found from the sorted
+prefixes the shards start at, saved in chunks_index.json:
+
+    {"layout": "shards", "shards": ["AB10", "AB16 5", "AB21", ...], ...}
+
+Shard i is chunks/<i>.json or chunks/<i>.bin (see chunk_format.py), and
+holds every postcode from shards[i] up to shards[i + 1]. Formatted postcodes
+("N15 5QA") sort as strings in the same order as their keys, so the shard of
+a postcode is the last prefix that sorts before or equal to it.
+
+Shard sizes are estimated from the rows, for the format the web app loads
+first: binary where it is written, otherwise JSON.
+
+The JavaScript reader is routeChunk() in public/app.js.
+
+    reader = ChunkReader(Path("output"))
+    reader.lookup("n155qa")  # {'substation_id': ..., 'lat': ..., 'lng': ...}
+
+Author: postcodes.energy
+License: MIT
+"""
+
+import json
+from bisect import bisect_right
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from chunk_format import read_chunk
+from postcode_codec import INWARD_CODES, UNIT_CODES, decode_outward, format_postcodes
+
+CHUNKS_DIR = "chunks"
+INDEX_FILE = "chunks_index.json"
+
+# Estimated bytes a postcode adds to a shard: a binary row (coordinates, key
+# and substation index), or a JSON entry less its substation ID. Binary shards
+# also list each of their substation IDs once.
+BINARY_ROW_BYTES = 14
+JSON_ROW_BYTES = 65
+
+
+def _piece_bytes(pieces: np.ndarray, substation_ids: pd.Series, chunk_format: str) -> np.ndarray:
+    """Estimated size of each piece of sorted matched rows (categorical substation_id)."""
+    codes = substation_ids.cat.codes.to_numpy().astype(np.int64)
+    id_bytes = np.asarray(substation_ids.cat.categories.str.len(), dtype=np.int64)
+    piece_start = np.zeros(len(codes), dtype=bool)
+    piece_start[pieces] = True
+    piece = np.cumsum(piece_start) - 1
+    if chunk_format == 'json':
+        return np.bincount(piece, weights=JSON_ROW_BYTES + id_bytes[codes], minlength=len(pieces))
+
+    # Rows, plus the string table entry of each substation in the piece
+    pairs = np.unique(piece * len(id_bytes) + codes)
+    table = np.bincount(pairs // len(id_bytes), weights=id_bytes[pairs % len(id_bytes)] + 1, minlength=len(pieces))
+    return BINARY_ROW_BYTES * np.diff(np.r_[pieces, len(codes)]) + table
+
+
+def plan_shards(keys: np.ndarray, substation_ids: pd.Series, shard_bytes: int,
+                chunk_format: str = 'both') -> Tuple[np.ndarray, List[str]]:
+    """
+    Pack sorted postcode keys (with each row's categorical substation_id) into
+    shards of about shard_bytes in chunk_format. Returns the first row of each
+    shard and the prefix it starts at.
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    if not len(keys):
+        return np.array([], dtype=int), []
+
+    # Pieces are whole districts, or the sectors of districts over the target
+    outward = keys // INWARD_CODES
+    sector = keys // UNIT_CODES
+    district_start = np.r_[True, outward[1:] != outward[:-1]]
+    districts = np.flatnonzero(district_start)
+    district_bytes = _piece_bytes(districts, substation_ids, chunk_format)
+    split = np.repeat(district_bytes > shard_bytes, np.diff(np.r_[districts, len(keys)]))
+    pieces = np.flatnonzero(district_start | (split & np.r_[True, sector[1:] != sector[:-1]]))
+    piece_bytes = _piece_bytes(pieces, substation_ids, chunk_format)
+
+    # Start a new shard where adding the next piece takes it further past the
+    # target than it is short of it
+    first = []
+    size = 0
+    for piece, nbytes in enumerate(piece_bytes.tolist()):
+        if not first or (size and size + nbytes - shard_bytes > shard_bytes - size):
+            first.append(piece)
+            size = 0
+        size += nbytes
+
+    starts = pieces[first]
+    outwards = decode_outward(outward[starts]).tolist()
+    sectors = ((keys[starts] % INWARD_CODES) // UNIT_CODES).tolist()
+    routes = [
+        outward_code if starts_district else f"{outward_code} {sector_digit}"
+        for outward_code, sector_digit, starts_district in zip(outwards, sectors, district_start[starts].tolist())
+    ]
+    return starts, routes
+
+
+def find_shard(routes: List[str], postcode: str) -> int:
+    """Shard holding a formatted postcode ("N15 5QA"), or -1 if it comes before every shard."""
+    return bisect_right(routes, postcode) - 1
+
+
+class ChunkReader:
+    """Postcode lookups over the chunk files in an output directory, in either layout."""
+
+    def __init__(self, output_dir: Path):
+        self.chunks_dir = Path(output_dir) / CHUNKS_DIR
+        index = json.loads((Path(output_dir) / INDEX_FILE).read_text())
+        self.routes = index.get('shards')
+        self._chunks = {}
+
+    def chunk_name(self, postcode: str) -> Optional[str]:
+        """Name of the chunk file a postcode (in any spacing and case) would be in."""
+        postcode = format_postcodes([postcode])[0]
+        if not postcode:
+            return None
+        if self.routes is None:
+            return postcode.split()[0]
+        shard = find_shard(self.routes, postcode)
+        return str(shard) if shard >= 0 else None
+
+    def load(self, name: str) -> Dict:
+        """Lookup dict of one chunk file, preferring the binary file."""
+        if name not in self._chunks:
+            binary_file, json_file = self.chunks_dir / f"{name}.bin", self.chunks_dir / f"{name}.json"
+            if binary_file.exists():
+                self._chunks[name] = read_chunk(binary_file)
+            else:
+                self._chunks[name] = json.loads(json_file.read_text()) if json_file.exists() else {}
+        return self._chunks[name]
+
+    def lookup(self, postcode: str) -> Optional[Dict]:
+        """Substation and coordinates of a postcode, or None if it isn't in the lookup."""
+        name = self.chunk_name(postcode)
+        if name is None:
+            return None
+        return self.load(name).get(format_postcodes([postcode])[0])
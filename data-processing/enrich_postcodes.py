@@ -0,0 +1,251 @@
+"""
+Bulk enrichment: tag every row of a large CSV or Parquet file with the
+primary substation, DNO and licence area serving its postcode.
+
+The input is streamed in batches; each batch is looked up at once against the
+postcode index (postcode_index.py) and appended to the output as soon as it
+is done, so memory stays flat however large the file is. Postcodes are
+normalized as normalizePostcode() in public/app.js does.
+
+Usage:
+    python enrich_postcodes.py customers.csv customers_enriched.csv
+    python enrich_postcodes.py meters.parquet meters_enriched.parquet --postcode-column PCD --workers 4
+
+Requires output/postcode_index.bin and output/substations.json from process_data.py.
+
+Author: postcodes.energy
+License: MIT
+"""
+
+import argparse
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, Iterator, List
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pcsv
+import pyarrow.parquet as pq
+from tqdm import tqdm
+
+from postcode_index import PostcodeIndex
+
+OUTPUT_DIR = Path("output")
+POSTCODE_INDEX_FILE = OUTPUT_DIR / "postcode_index.bin"
+SUBSTATIONS_FILE = OUTPUT_DIR / "substations.json"
+
+# Input rows looked up at a time
+ENRICH_BATCH_SIZE = 500_000
+
+# Columns tried, case-insensitively, when --postcode-column isn't given
+POSTCODE_COLUMNS = ['postcode', 'pcds', 'pcd', 'post_code', 'postcode_normalized']
+
+# Columns added to each row
+ENRICH_COLUMNS = ['substation_id', 'substation_name', 'dno', 'license_area']
+
+# Their type in the output, declared rather than taken from the first batch -
+# if none of its postcodes match, they are all null and Arrow infers type null
+ENRICH_TYPE = pa.large_string()
+
+# Per-process lookup state (see init_lookup)
+_INDEX = None
+_DETAILS = None
+
+
+def normalize_postcodes(postcodes: pd.Series) -> pd.Series:
+    """
+    Normalize postcodes as normalizePostcode() in app.js does: remove all
+    whitespace, uppercase, then put a space before the last 3 characters.
+    """
+    clean = postcodes.fillna('').astype(str).str.replace(r'\s+', '', regex=True).str.upper()
+    long_enough = clean.str.len() >= 5
+    return clean.where(~long_enough, clean.str[:-3] + ' ' + clean.str[-3:])
+
+
+def load_substation_metadata(details_file: Path = SUBSTATIONS_FILE) -> pd.DataFrame:
+    """Name, DNO and licence area of each substation, indexed by substation ID."""
+    with open(details_file) as f:
+        details = json.load(f)
+    return pd.DataFrame.from_dict(
+        {
+            substation_id: {
+                'substation_name': info.get('name'),
+                'dno': info.get('dno'),
+                'license_area': info.get('license_area')
+            }
+            for substation_id, info in details.items()
+        },
+        orient='index',
+        columns=ENRICH_COLUMNS[1:]
+    )
+
+
+def init_lookup(index_file: Path, metadata: pd.DataFrame):
+    """Open the postcode index in this process (the memory map is shared through the page cache)."""
+    global _INDEX, _DETAILS
+    _INDEX = PostcodeIndex(index_file)
+    _DETAILS = metadata
+
+
+def enrich_batch(batch: pd.DataFrame, postcode_column: str) -> pd.DataFrame:
+    """Add the ENRICH_COLUMNS to one batch of rows (init_lookup must have been called)."""
+    found = _INDEX.lookup_many(normalize_postcodes(batch[postcode_column]))
+    substation_id = found['substation_id']
+    details = _DETAILS.reindex(substation_id.to_numpy())
+
+    enriched = batch.reset_index(drop=True)
+    enriched['substation_id'] = substation_id
+    for column in ENRICH_COLUMNS[1:]:
+        enriched[column] = details[column].to_numpy()
+    return enriched
+
+
+def find_postcode_column(columns: List[str], requested: str = None) -> str:
+    """The input's postcode column: the one requested, or the first of POSTCODE_COLUMNS present."""
+    if requested:
+        if requested not in columns:
+            raise ValueError(f"Column '{requested}' not found in input (columns: {', '.join(columns)})")
+        return requested
+    by_name = {column.lower(): column for column in columns}
+    for candidate in POSTCODE_COLUMNS:
+        if candidate in by_name:
+            return by_name[candidate]
+    raise ValueError(f"No postcode column found in input - pass --postcode-column (columns: {', '.join(columns)})")
+
+
+def read_batches(path: Path, batch_size: int) -> Iterator[pd.DataFrame]:
+    """Stream a CSV or Parquet file in batches of rows. CSV values are kept as text."""
+    if path.suffix.lower() == '.parquet':
+        for record_batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+            yield record_batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=batch_size)
+
+
+def count_rows(path: Path) -> int:
+    """Rows in the input, for the progress bar (None for CSV, which would need a full read)."""
+    if path.suffix.lower() == '.parquet':
+        return pq.ParquetFile(path).metadata.num_rows
+    return None
+
+
+class BatchWriter:
+    """Appends enriched batches to a CSV or Parquet file as they arrive."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.parquet = path.suffix.lower() == '.parquet'
+        self._writer = None
+        self._schema = None
+
+    def write(self, batch: pd.DataFrame):
+        table = pa.Table.from_pandas(batch, preserve_index=False)
+        if self._writer is None:
+            self._schema = pa.schema(
+                [field.with_type(ENRICH_TYPE) if field.name in ENRICH_COLUMNS else field for field in table.schema],
+                metadata=table.schema.metadata
+            )
+            writer = pq.ParquetWriter if self.parquet else pcsv.CSVWriter
+            self._writer = writer(str(self.path), self._schema)
+        self._writer.write_table(table.cast(self._schema))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+    def __enter__(self) -> "BatchWriter":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def enrich_batches(batches: Iterable[pd.DataFrame], postcode_column: str,
+                   index_file: Path, metadata: pd.DataFrame, workers: int = 1) -> Iterator[pd.DataFrame]:
+    """Enrich a stream of batches in input order, across worker processes if workers > 1."""
+    if workers <= 1:
+        init_lookup(index_file, metadata)
+        for batch in batches:
+            yield enrich_batch(batch, postcode_column)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_lookup, initargs=(index_file, metadata)) as executor:
+        # Keep a bounded number of batches in flight so memory stays flat
+        pending = []
+        for batch in batches:
+            pending.append(executor.submit(enrich_batch, batch, postcode_column))
+            if len(pending) >= 2 * workers:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Tag each row of a CSV or Parquet file with the substation, DNO and licence area of its postcode."
+    )
+    parser.add_argument('input', type=Path, help="Input .csv or .parquet file")
+    parser.add_argument('output', type=Path, help="Output .csv or .parquet file")
+    parser.add_argument('--postcode-column', help=f"Postcode column (default: first of {', '.join(POSTCODE_COLUMNS)})")
+    parser.add_argument(
+        '--batch-size', type=int, default=ENRICH_BATCH_SIZE,
+        help=f"Rows looked up at a time (default {ENRICH_BATCH_SIZE:,})"
+    )
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes for lookups (default 1)")
+    parser.add_argument('--index', type=Path, default=POSTCODE_INDEX_FILE, help=f"Postcode index (default {POSTCODE_INDEX_FILE})")
+    parser.add_argument(
+        '--substations', type=Path, default=SUBSTATIONS_FILE,
+        help=f"Substation details (default {SUBSTATIONS_FILE})"
+    )
+    return parser.parse_args(argv)
+
+
+def main(args: argparse.Namespace = None):
+    if args is None:
+        args = parse_args()
+
+    print("\n=== Enriching Postcodes ===\n")
+
+    for required in (args.input, args.index, args.substations):
+        if not required.exists():
+            print(f"ERROR: {required} not found")
+            return
+
+    metadata = load_substation_metadata(args.substations)
+    print(f"[OK] Loaded {len(metadata):,} substations")
+
+    batches = read_batches(args.input, args.batch_size)
+    first = next(batches, None)
+    if first is None:
+        print("ERROR: Input file is empty")
+        return
+    try:
+        postcode_column = find_postcode_column(list(first.columns), args.postcode_column)
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        return
+    print(f"Postcode column: {postcode_column}")
+
+    def all_batches():
+        yield first
+        yield from batches
+
+    rows = unmatched = 0
+    start = time.perf_counter()
+    with BatchWriter(args.output) as writer, tqdm(total=count_rows(args.input), unit=' rows', desc="Enriching") as progress:
+        for enriched in enrich_batches(all_batches(), postcode_column, args.index, metadata, args.workers):
+            writer.write(enriched)
+            rows += len(enriched)
+            unmatched += int(enriched['substation_id'].isna().sum())
+            progress.update(len(enriched))
+    elapsed = time.perf_counter() - start
+
+    print(f"\n[OK] Enriched {rows:,} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):,.0f} rows/s)")
+    print(f"[!] Unmatched: {unmatched:,} rows ({unmatched / max(rows, 1):.1%})")
+    print(f"[OK] Saved {args.output}")
+
+
+if __name__ == "__main__":
+    main()
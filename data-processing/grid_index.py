@@ -0,0 +1,296 @@
+"""
+Hierarchical grid index for point-in-substation lookups.
+
+Almost every postcode lies deep inside one substation polygon, so most of the
+country can be answered without a polygon test at all. The index covers the
+substation polygons with a uniform grid of root cells and subdivides each cell
+into quadrants, quadtree style, until it is either:
+
+- empty: no polygon touches it, so no point in it matches;
+- interior: it lies strictly inside exactly one polygon and touches no other,
+  so every point in it matches that polygon (answered in O(1));
+- a boundary leaf at the maximum depth: points in it are tested exactly
+  against the few polygons that intersect it.
+
+Queries are vectorized over arrays of points and give the same matches as
+a shapely 'within' test against every polygon. The index is saved to and
+loaded from a single .npz file so later builds and query tools can reuse it,
+with a digest of the polygons it was built from: a DNO republishing changed
+polygons under the same substation IDs makes a saved index stale.
+
+Author: postcodes.energy
+License: MIT
+"""
+
+import hashlib
+import io
+from pathlib import Path
+from typing import Sequence, Tuple
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from shapely.strtree import STRtree
+
+# Cells are classified using boxes grown by this margin (degrees, ~0.1 mm) so
+# points that round into a neighbouring cell are still covered by its test
+CELL_MARGIN = 1e-9
+
+# Leaf values: >= 0 is the polygon a whole cell lies inside
+EMPTY = -1
+# Boundary leaves store -2 - k, where k indexes their candidate polygon list
+BOUNDARY_BASE = -2
+
+
+def geometry_digest(polygons: Sequence) -> str:
+    """SHA-256 of the polygons' WKB, in order."""
+    digest = hashlib.sha256()
+    for wkb in shapely.to_wkb(np.asarray(polygons, dtype=object)).tolist():
+        wkb = wkb or b''
+        digest.update(len(wkb).to_bytes(8, 'little'))
+        digest.update(wkb)
+    return digest.hexdigest()
+
+
+class SubstationGridIndex:
+    """Multi-resolution grid over substation polygons answering point-in-polygon queries."""
+
+    def __init__(self, polygons: np.ndarray, substation_ids: np.ndarray,
+                 origin: Tuple[float, float], cell_size: float, shape: Tuple[int, int],
+                 child: np.ndarray, leaf: np.ndarray,
+                 candidate_offsets: np.ndarray, candidates: np.ndarray, digest: str = ''):
+        self.polygons = polygons
+        self.substation_ids = substation_ids
+        self.origin = origin
+        self.cell_size = cell_size
+        self.shape = shape  # (rows, cols) of root cells
+        self.child = child  # first of 4 child nodes, or -1 for a leaf
+        self.leaf = leaf  # leaf value (see EMPTY / BOUNDARY_BASE)
+        self.candidate_offsets = candidate_offsets
+        self.candidates = candidates
+        self.digest = digest  # geometry_digest of the polygons built from
+        shapely.prepare(self.polygons)
+
+    @classmethod
+    def build(cls, polygons: Sequence, substation_ids: Sequence,
+              cell_size: float = 0.1, max_depth: int = 5) -> "SubstationGridIndex":
+        """
+        Build the index over polygons (in EPSG:4326) with root cells of
+        cell_size degrees, subdivided at most max_depth times.
+        """
+        polygons = np.asarray(polygons, dtype=object)
+        shapely.prepare(polygons)
+        tree = STRtree(polygons)
+
+        minx, miny, maxx, maxy = shapely.total_bounds(polygons)
+        cols = max(1, int(np.ceil((maxx - minx) / cell_size)))
+        rows = max(1, int(np.ceil((maxy - miny) / cell_size)))
+
+        # Root cells, numbered row-major
+        iy, ix = np.divmod(np.arange(rows * cols), cols)
+        cell_x = minx + ix * cell_size
+        cell_y = miny + iy * cell_size
+        size = cell_size
+
+        child_levels, leaf_levels = [], []
+        candidates = np.array([], dtype=np.int64)
+        candidate_lengths = np.array([], dtype=np.int64)
+        next_node = rows * cols
+
+        for depth in range(max_depth + 1):
+            n = len(cell_x)
+            boxes = shapely.box(cell_x - CELL_MARGIN, cell_y - CELL_MARGIN,
+                                cell_x + size + CELL_MARGIN, cell_y + size + CELL_MARGIN)
+            cell_idx, polygon_idx = tree.query(boxes, predicate='intersects')
+            order = np.lexsort((polygon_idx, cell_idx))
+            cell_idx, polygon_idx = cell_idx[order], polygon_idx[order]
+
+            counts = np.bincount(cell_idx, minlength=n)
+            starts = np.r_[0, np.cumsum(counts)[:-1]]
+
+            leaf = np.full(n, EMPTY, dtype=np.int64)
+            child = np.full(n, -1, dtype=np.int64)
+
+            # Cells touched by a single polygon that lies strictly inside it
+            single = np.flatnonzero(counts == 1)
+            owner = polygon_idx[starts[single]]
+            inside = shapely.contains_properly(polygons[owner], boxes[single])
+            leaf[single[inside]] = owner[inside]
+
+            mixed = np.flatnonzero(counts > 0)
+            mixed = mixed[leaf[mixed] == EMPTY]
+
+            if depth == max_depth:
+                # Boundary leaves keep the polygons that actually intersect them
+                is_mixed = np.zeros(n, dtype=bool)
+                is_mixed[mixed] = True
+                leaf[mixed] = BOUNDARY_BASE - np.arange(len(mixed))
+                candidates = polygon_idx[is_mixed[cell_idx]]
+                candidate_lengths = counts[mixed]
+            else:
+                child[mixed] = next_node + 4 * np.arange(len(mixed))
+                next_node += 4 * len(mixed)
+
+            child_levels.append(child)
+            leaf_levels.append(leaf)
+
+            if depth == max_depth or not len(mixed):
+                break
+
+            # Quadrants of the subdivided cells: q = 2 * qy + qx
+            size /= 2
+            quadrant = np.tile(np.arange(4), len(mixed))
+            cell_x = np.repeat(cell_x[mixed], 4) + (quadrant % 2) * size
+            cell_y = np.repeat(cell_y[mixed], 4) + (quadrant // 2) * size
+
+        return cls(
+            polygons=polygons,
+            substation_ids=np.asarray(substation_ids, dtype=str),
+            origin=(float(minx), float(miny)),
+            cell_size=float(cell_size),
+            shape=(rows, cols),
+            child=np.concatenate(child_levels),
+            leaf=np.concatenate(leaf_levels),
+            candidate_offsets=np.r_[0, np.cumsum(candidate_lengths)].astype(np.int64),
+            candidates=candidates.astype(np.int64),
+            digest=geometry_digest(polygons)
+        )
+
+    @classmethod
+    def from_substations(cls, substations: gpd.GeoDataFrame, **kwargs) -> "SubstationGridIndex":
+        """Build the index from the standardized substations frame of load_all_substations."""
+        return cls.build(substations.geometry.to_numpy(), substations['substation_id'].astype(str), **kwargs)
+
+    def query(self, x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the polygons containing each point (longitude x, latitude y).
+        Returns (point positions, polygon positions) for every match, as a
+        'within' test against every polygon would.
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        rows, cols = self.shape
+
+        # Root cell of each point, and its position inside that cell in [0, 1)
+        fx = (x - self.origin[0]) / self.cell_size
+        fy = (y - self.origin[1]) / self.cell_size
+        with np.errstate(invalid='ignore'):
+            ix = np.floor(fx)
+            iy = np.floor(fy)
+            # Points on the far edge of the grid belong to the last cell
+            ix = np.where(ix == cols, cols - 1, ix)
+            iy = np.where(iy == rows, rows - 1, iy)
+            valid = (ix >= 0) & (ix < cols) & (iy >= 0) & (iy < rows)
+
+        points = np.flatnonzero(valid)
+        fx = fx[points] - ix[points]
+        fy = fy[points] - iy[points]
+        node = (iy[points] * cols + ix[points]).astype(np.int64)
+
+        # Descend one quadtree level per iteration
+        internal = self.child[node] >= 0
+        while internal.any():
+            qx = fx[internal] >= 0.5
+            qy = fy[internal] >= 0.5
+            node[internal] = self.child[node[internal]] + 2 * qy + qx
+            fx[internal] = fx[internal] * 2 - qx
+            fy[internal] = fy[internal] * 2 - qy
+            internal = self.child[node] >= 0
+
+        value = self.leaf[node]
+
+        # Interior cells answer directly
+        inside = value >= 0
+        point_idx = [points[inside]]
+        polygon_idx = [value[inside]]
+
+        # Boundary cells fall back to an exact test against their candidates
+        boundary = value <= BOUNDARY_BASE
+        if boundary.any():
+            k = BOUNDARY_BASE - value[boundary]
+            starts = self.candidate_offsets[k]
+            lengths = self.candidate_offsets[k + 1] - starts
+            pairs_point = np.repeat(points[boundary], lengths)
+            offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            pairs_polygon = self.candidates[np.repeat(starts, lengths) + offsets]
+            hit = shapely.contains(self.polygons[pairs_polygon], shapely.points(x[pairs_point], y[pairs_point]))
+            point_idx.append(pairs_point[hit])
+            polygon_idx.append(pairs_polygon[hit])
+
+        point_idx = np.concatenate(point_idx)
+        polygon_idx = np.concatenate(polygon_idx)
+        order = np.lexsort((polygon_idx, point_idx))
+        return point_idx[order], polygon_idx[order]
+
+    def sjoin(self, points: gpd.GeoDataFrame, substations: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+        """Same result as gpd.sjoin(points, substations, how='left', predicate='within')."""
+        from spatial_join import join_from_indices
+
+        point_idx, polygon_idx = self.query(points.geometry.x.to_numpy(), points.geometry.y.to_numpy())
+        return join_from_indices(points, substations, point_idx, polygon_idx)
+
+    def matches(self, substations: gpd.GeoDataFrame) -> bool:
+        """
+        Whether this index was built from these substations: the same IDs in the
+        same order, with the same geometry. Indexes saved without a digest never match.
+        """
+        if not np.array_equal(self.substation_ids, substations['substation_id'].astype(str).to_numpy()):
+            return False
+        return bool(self.digest) and self.digest == geometry_digest(substations.geometry.to_numpy())
+
+    def stats(self) -> dict:
+        """Counts of node types, for reporting."""
+        leaves = self.leaf[self.child < 0]
+        return {
+            'nodes': len(self.leaf),
+            'interior_cells': int((leaves >= 0).sum()),
+            'empty_cells': int((leaves == EMPTY).sum()),
+            'boundary_cells': int((leaves <= BOUNDARY_BASE).sum()),
+        }
+
+    def to_bytes(self) -> bytes:
+        """The .npz file save() writes, as bytes."""
+        buffer = io.BytesIO()
+        self.save(buffer)
+        return buffer.getvalue()
+
+    def save(self, path: Path):
+        """Save the index, including its polygons as WKB, to a .npz file (or a binary file object)."""
+        wkb = [b'' if geom is None else shapely.to_wkb(geom) for geom in self.polygons]
+        np.savez_compressed(
+            path,
+            polygon_wkb=np.frombuffer(b''.join(wkb), dtype=np.uint8),
+            polygon_wkb_lengths=np.array([len(w) for w in wkb], dtype=np.int64),
+            substation_ids=self.substation_ids,
+            origin=np.array(self.origin),
+            cell_size=np.array(self.cell_size),
+            shape=np.array(self.shape),
+            child=self.child,
+            leaf=self.leaf,
+            candidate_offsets=self.candidate_offsets,
+            candidates=self.candidates,
+            digest=np.array(self.digest)
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "SubstationGridIndex":
+        """Load an index written by save()."""
+        with np.load(path) as data:
+            blob = data['polygon_wkb'].tobytes()
+            ends = np.cumsum(data['polygon_wkb_lengths'])
+            polygons = np.array([
+                shapely.from_wkb(blob[end - length:end]) if length else None
+                for end, length in zip(ends.tolist(), data['polygon_wkb_lengths'].tolist())
+            ], dtype=object)
+            return cls(
+                polygons=polygons,
+                substation_ids=data['substation_ids'],
+                origin=tuple(data['origin'].tolist()),
+                cell_size=float(data['cell_size']),
+                shape=tuple(data['shape'].tolist()),
+                child=data['child'],
+                leaf=data['leaf'],
+                candidate_offsets=data['candidate_offsets'],
+                candidates=data['candidates'],
+                digest=str(data['digest']) if 'digest' in data else ''
+            )
@@ -0,0 +1,101 @@
+"""
+Compact in-memory form of the matched postcodes.
+
+A spatial join returns every postcode with its float coordinates, a point
+geometry, index_right and all of the substation's columns (substation_id,
+name, DNO, licence area) repeated on each of millions of rows. The pipeline
+only needs three things from it, so each join result (or batch) is reduced
+as soon as it is joined to:
+
+    key            uint32    postcode key (see postcode_codec.py)
+    substation_id  category  code into the substation table's IDs (NaN if unmatched)
+    lat_e6         int32     latitude, fixed point (degrees * COORD_SCALE)
+    long_e6        int32     longitude, fixed point (degrees * COORD_SCALE)
+
+indexed by the postcode's row in the postcode file. That is 14 bytes a row
+plus the index, where the joined frame takes several hundred. The nearest
+substation fallback adds match_type (category) and match_distance_m.
+
+Coordinates are kept to 1e-6 degrees (about 0.1 m), the precision ONSPD
+publishes, so they convert back to the same floats. expand_matches() turns
+rows back into formatted postcodes, substation IDs and float coordinates
+as the chunks are written.
+
+    matched = compact_matches(gpd.sjoin(postcodes, substations, how='left'), substations)
+
+Author: postcodes.energy
+License: MIT
+"""
+
+from typing import Iterable, Tuple
+
+import numpy as np
+import pandas as pd
+
+from postcode_codec import KEY_DTYPE, decode_postcodes
+
+# Fixed-point scale of coordinates, shared by the matched frame, the binary chunks
+# (chunk_format.py) and the postcode index (postcode_index.py)
+COORD_SCALE = 1_000_000
+COORD_DTYPE = np.int32
+
+# Columns of a compact matched frame, before the nearest fallback
+MATCHED_COLUMNS = ['key', 'substation_id', 'lat_e6', 'long_e6']
+
+
+def substation_dtype(substations: pd.DataFrame) -> pd.CategoricalDtype:
+    """Categorical dtype of the substation IDs in a substation table, in table order."""
+    return pd.CategoricalDtype(pd.unique(substations['substation_id'].astype(str)))
+
+
+def quantize(degrees: np.ndarray) -> np.ndarray:
+    """Fixed-point coordinates (degrees * COORD_SCALE) of float degrees."""
+    return np.rint(np.asarray(degrees, dtype=float) * COORD_SCALE).astype(COORD_DTYPE)
+
+
+def coordinates(matched: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """Float latitudes and longitudes of compact matched rows."""
+    return (matched['lat_e6'].to_numpy() / COORD_SCALE, matched['long_e6'].to_numpy() / COORD_SCALE)
+
+
+def compact_matches(joined: pd.DataFrame, substations: pd.DataFrame, keep: Iterable[str] = ()) -> pd.DataFrame:
+    """
+    Compact matched frame of a join of postcodes to substations (columns key,
+    lat, long and index_right, plus anything else, which is dropped). keep
+    names extra columns to carry over as they are.
+    """
+    # Substation codes via each row's substation row, rather than hashing millions of ID strings
+    dtype = substation_dtype(substations)
+    row_codes = dtype.categories.get_indexer(substations['substation_id'].astype(str))
+    rows = substations.index.get_indexer(joined['index_right'])
+    codes = np.r_[row_codes, -1][rows]
+
+    compact = pd.DataFrame({
+        'key': joined['key'].to_numpy(dtype=KEY_DTYPE),
+        'substation_id': pd.Categorical.from_codes(codes, dtype=dtype),
+        'lat_e6': quantize(joined['lat']),
+        'long_e6': quantize(joined['long']),
+    }, index=joined.index)
+    for column in keep:
+        compact[column] = joined[column].to_numpy()
+    return compact
+
+
+def expand_matches(matched: pd.DataFrame) -> pd.DataFrame:
+    """
+    Rows of a compact matched frame (usually one chunk) with formatted
+    postcodes, substation IDs and float coordinates: columns key, pcd,
+    substation_id, lat, long, and match_type / match_distance_m if present.
+    """
+    lat, long = coordinates(matched)
+    rows = pd.DataFrame({
+        'key': matched['key'].to_numpy(),
+        'pcd': decode_postcodes(matched['key'].to_numpy()).astype(object),
+        'substation_id': matched['substation_id'].to_numpy(dtype=object),
+        'lat': lat,
+        'long': long,
+    }, index=matched.index)
+    for column in ('match_type', 'match_distance_m'):
+        if column in matched.columns:
+            rows[column] = matched[column].to_numpy()
+    return rows
@@ -0,0 +1,284 @@
+"""
+Fit substation boundaries into a byte budget with a bounded error.
+
+Cloudflare Pages serves files of at most 25 MB, and the substation
+boundaries are most of the substation details. Rather than one hand-picked
+tolerance and precision for every polygon, this searches per substation for
+the smallest GeoJSON encoding - a simplification tolerance combined with a
+number of decimal places - whose displacement (Hausdorff distance from the
+original) stays within an error bound. The error bound is tightened level by
+level (binary search over a ladder of errors up to max_error_m), and the
+finest level whose boundaries fit the budget is kept. Each level is evaluated
+in parallel worker processes.
+
+Run by process_data.py --boundary-budget, or on an existing output directory.
+Boundaries are always simplified from the full-resolution polygons in
+substations.parquet, never from the already simplified shards, so the error
+bound holds however many times it is run. The details and boundary shards of
+process_data.py's output/ are rewritten as a new generation (see
+output_writer.py); a copied directory is rewritten in place:
+
+    python optimize_boundaries.py output --budget-mb 25 --max-error-m 100
+    python optimize_boundaries.py ../public/data --polygons output/substations.parquet
+
+Author: postcodes.energy
+License: MIT
+"""
+
+import argparse
+import json
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from shapely.geometry import mapping
+
+from boundary_shards import DETAILS_FILE, PAGES_FILE_LIMIT_MB, load_details, write_details
+from output_writer import OutputWriter, live_dir, uses_generations
+
+# Full-resolution substation polygons saved by process_data.py
+SUBSTATION_TABLE_FILE = "substations.parquet"
+
+# Largest boundary displacement allowed by default, metres
+DEFAULT_MAX_ERROR_M = 100
+
+# Metres per degree of latitude; a degree of longitude is shorter across the
+# UK, so errors converted with this are upper bounds
+METRES_PER_DEGREE = 111_320
+
+# Error levels searched: max_error_m, then halving every two levels
+ERROR_LEVELS = 16
+
+# Decimal places considered for coordinates
+DECIMALS = range(3, 7)
+
+# Times the simplification tolerance is halved before falling back to rounding only
+TOLERANCE_STEPS = 4
+
+# Substations per task sent to a worker
+BATCH_SIZE = 256
+
+# Boundaries, set once per worker process by _init_worker
+_WORKER_GEOMETRIES = None
+
+
+def error_levels(max_error_m: float, levels: int = ERROR_LEVELS) -> np.ndarray:
+    """Error bounds to search, coarsest (max_error_m) first."""
+    return max_error_m * 2.0 ** (-np.arange(levels) / 2)
+
+
+def rounding_error_m(decimals: int) -> float:
+    """Largest displacement from rounding both coordinates to this many decimal places."""
+    return np.hypot(0.5, 0.5) * 10.0 ** -decimals * METRES_PER_DEGREE
+
+
+def candidate_decimals(error_m: float) -> List[int]:
+    """Decimal places whose rounding error leaves room for simplification within error_m."""
+    return [decimals for decimals in DECIMALS if rounding_error_m(decimals) < error_m]
+
+
+def simplify_rings(geom, tolerance: float):
+    """
+    Douglas-Peucker simplification of each polygon ring as an open line, which
+    keeps every ring within tolerance. (Simplifying rings directly also drops
+    their start points, which can move them further.) Rings that would
+    collapse are kept as they are.
+    """
+    if geom.geom_type not in ('Polygon', 'MultiPolygon'):
+        return shapely.simplify(geom, tolerance, preserve_topology=False)
+
+    polygons = []
+    for polygon in shapely.get_parts(geom):
+        rings = []
+        for ring in [polygon.exterior, *polygon.interiors]:
+            coords = shapely.get_coordinates(ring)
+            simplified = shapely.get_coordinates(shapely.simplify(shapely.linestrings(coords), tolerance, preserve_topology=False))
+            rings.append(simplified if len(simplified) >= 4 else coords)
+        polygons.append(shapely.Polygon(rings[0], rings[1:]))
+    return polygons[0] if geom.geom_type == 'Polygon' else shapely.MultiPolygon(polygons)
+
+
+def simplify_boundary(geom, error_m: float, decimals: int, keep_valid: bool = True):
+    """
+    Simplify and round a boundary, displacing it by at most error_m.
+    Simplified rings that cross fall back to topology preserving
+    simplification, which can overshoot, so its result is checked (Hausdorff
+    distance) and the tolerance halved until it fits.
+    With keep_valid, returns None if rounding to decimals makes the boundary invalid.
+    """
+    simplify_error_m = error_m - rounding_error_m(decimals)
+    simplified = simplify_rings(geom, simplify_error_m / METRES_PER_DEGREE)
+
+    if keep_valid and not simplified.is_valid:
+        tolerance = simplify_error_m / METRES_PER_DEGREE
+        simplified = geom
+        for _ in range(TOLERANCE_STEPS):
+            candidate = shapely.simplify(geom, tolerance, preserve_topology=True)
+            if shapely.hausdorff_distance(geom, candidate) * METRES_PER_DEGREE <= simplify_error_m:
+                simplified = candidate
+                break
+            tolerance /= 2
+
+    rounded = shapely.transform(simplified, lambda coords: np.round(coords, decimals))
+    if keep_valid and not rounded.is_valid:
+        return None
+    return rounded
+
+
+def encode_boundary(geom, error_m: float) -> str:
+    """
+    Smallest compact GeoJSON of a boundary within error_m ('null' if missing or empty).
+    Valid boundaries stay valid; if no rounding keeps one valid it is left unrounded.
+    """
+    if geom is None or geom.is_empty:
+        return 'null'
+    keep_valid = geom.is_valid
+    candidates = [simplify_boundary(geom, error_m, decimals, keep_valid) for decimals in candidate_decimals(error_m)]
+    candidates = [candidate for candidate in candidates if candidate is not None] or [geom]
+    return min((json.dumps(mapping(candidate), separators=(',', ':')) for candidate in candidates), key=len)
+
+
+def _init_worker(geometries: np.ndarray):
+    """Receive the boundaries once per worker process."""
+    global _WORKER_GEOMETRIES
+    _WORKER_GEOMETRIES = geometries
+
+
+def _encode_level(start: int, end: int, error_m: float) -> List[str]:
+    """Smallest encoding within error_m of each boundary in [start, end)."""
+    return [encode_boundary(geom, error_m) for geom in _WORKER_GEOMETRIES[start:end]]
+
+
+def optimize_boundaries(geometries: Sequence, budget_bytes: int, max_error_m: float = DEFAULT_MAX_ERROR_M,
+                        workers: int = 1) -> Tuple[List[str], float]:
+    """
+    Encode boundaries (shapely geometries in EPSG:4326) as GeoJSON strings
+    totalling at most budget_bytes, with the smallest error bound that fits.
+    Returns the encoded boundaries and the error bound used, in metres. If even
+    max_error_m doesn't fit, the max_error_m encodings are returned.
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    levels = error_levels(max_error_m)
+    batches = [(start, min(start + BATCH_SIZE, len(geometries))) for start in range(0, len(geometries), BATCH_SIZE)]
+
+    executor = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(geometries,)) if workers > 1 else None
+    if executor is None:
+        _init_worker(geometries)
+
+    def encode(level: int) -> List[str]:
+        error_m = levels[level]
+        if executor is None:
+            parts = [_encode_level(start, end, error_m) for start, end in batches]
+        else:
+            parts = executor.map(_encode_level, *zip(*batches), [error_m] * len(batches)) if batches else []
+        encoded = [boundary for part in parts for boundary in part]
+        size = sum(map(len, encoded))
+        print(f"  error <= {error_m:,.1f} m: {size / 1024 / 1024:.2f} MB")
+        return encoded
+
+    try:
+        # Binary search for the finest level that fits: level 0 is the coarsest
+        best_level, best = 0, encode(0)
+        if sum(map(len, best)) > budget_bytes:
+            print(f"WARNING: Boundaries don't fit in {budget_bytes / 1024 / 1024:.1f} MB even at {max_error_m:,.0f} m error")
+            return best, float(levels[0])
+
+        low, high = 1, len(levels) - 1
+        while low <= high:
+            level = (low + high) // 2
+            encoded = encode(level)
+            if sum(map(len, encoded)) <= budget_bytes:
+                best_level, best = level, encoded
+                low = level + 1
+            else:
+                high = level - 1
+        return best, float(levels[best_level])
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        _init_worker(None)
+
+
+def fit_details_to_budget(details: Dict, geometries: Sequence, budget_mb: float,
+                          max_error_m: float = DEFAULT_MAX_ERROR_M, workers: int = 1) -> Dict:
+    """
+    Replace each substation's boundary in details with the optimized encoding
+    of its geometry, so the details and boundaries fit in budget_mb.
+    geometries is in the same order as details.
+    """
+    print("\n=== Optimizing Boundaries ===\n")
+
+    # Everything but the boundaries is fixed: size the details with null boundaries
+    # (postcode lists are saved separately, see boundary_shards.py)
+    stripped = {substation_id: {**detail, 'boundary': None} for substation_id, detail in details.items()}
+    metadata = {substation_id: {field: value for field, value in detail.items() if field != 'postcodes'}
+                for substation_id, detail in stripped.items()}
+    fixed_bytes = len(json.dumps(metadata, separators=(',', ':')).encode()) - len('null') * len(details)
+    budget_bytes = int(budget_mb * 1024 * 1024) - fixed_bytes
+    print(f"Budget {budget_mb:g} MB: {max(budget_bytes, 0) / 1024 / 1024:.2f} MB for {len(details):,} boundaries "
+          f"(max error {max_error_m:g} m)")
+
+    encoded, error_m = optimize_boundaries(geometries, budget_bytes, max_error_m, workers)
+    for detail, boundary in zip(stripped.values(), encoded):
+        detail['boundary'] = json.loads(boundary)
+
+    print(f"[OK] Boundaries within {error_m:,.1f} m, {sum(map(len, encoded)) / 1024 / 1024:.2f} MB")
+    return stripped
+
+
+def load_polygons(path: Path, substation_ids: List[str]) -> np.ndarray:
+    """Full-resolution polygon of each substation from a substation table, in order (None if missing)."""
+    table = gpd.read_parquet(path, columns=['substation_id', 'geometry']).to_crs("EPSG:4326")
+    geometries = table.drop_duplicates('substation_id', keep='last').set_index('substation_id').geometry
+    return geometries.reindex(substation_ids).to_numpy()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit the substation boundaries in an output directory into a size budget.")
+    parser.add_argument('directory', type=Path, help="Directory holding substations.json and its boundary shards")
+    parser.add_argument(
+        '--polygons', type=Path, default=None,
+        help=f"Full-resolution polygons to simplify (default: {SUBSTATION_TABLE_FILE} in the directory)"
+    )
+    parser.add_argument(
+        '--budget-mb', type=float, default=PAGES_FILE_LIMIT_MB,
+        help=f"Largest size of the details and boundaries in MB (default: {PAGES_FILE_LIMIT_MB}, the Cloudflare Pages limit)"
+    )
+    parser.add_argument(
+        '--max-error-m', type=float, default=DEFAULT_MAX_ERROR_M,
+        help=f"Largest boundary displacement in metres (default: {DEFAULT_MAX_ERROR_M})"
+    )
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes (default: 1)")
+    args = parser.parse_args()
+
+    live = live_dir(args.directory)
+    polygons_file = args.polygons or live / SUBSTATION_TABLE_FILE
+    for required in (live / DETAILS_FILE, polygons_file):
+        if not required.exists():
+            print(f"ERROR: {required} not found")
+            return
+
+    print(f"Loading {args.directory}...")
+    details = load_details(live)
+    geometries = load_polygons(polygons_file, list(details))
+
+    details = fit_details_to_budget(details, geometries, args.budget_mb, args.max_error_m, args.workers)
+    # The budget also caps each file, so no boundary shard is larger than it
+    max_file_bytes = int(args.budget_mb * 1024 * 1024)
+    if not uses_generations(args.directory):
+        write_details(details, args.directory, max_file_bytes=max_file_bytes)
+        return
+
+    # Only the details and boundaries change - the rest of the live generation carries over
+    with OutputWriter(args.directory) as writer:
+        write_details(details, args.directory, writer=writer, max_file_bytes=max_file_bytes)
+        kept = writer.keep_rest()
+        generation = writer.commit()
+    print(f"[OK] Kept {kept:,} unchanged files, now live as generation {generation['generation']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+"""
+Concurrent, verified writes of the web app's data files, swapped in as one generation.
+
+A build writes thousands of chunk files, substations.json,
+chunks_index.json, the boundary and postcode list shards, the autocomplete
+index, substations.parquet, postcode_index.bin, the grid index and overlap
+report where built, and build_report.json. Written in place one at a time, a
+crash or a copy taken mid-build (into public/data/, say) could pick up chunks
+of two builds next to either build's substations.json.
+Instead each build's files are staged and then switched in together:
+
+    output/.staging/                  the build in progress
+    output/.generations/<id>/         complete, verified generations
+    output/current -> .generations/<id>
+    output/chunks -> current/chunks   likewise every other file and directory of
+                                      the build (substations.json, ...)
+
+OutputWriter serializes and writes files on a thread pool into .staging/,
+recording each file's size and CRC-32. commit() waits for the writes, checks
+the staged files against that record - the same files, sizes and checksums -
+and renames the staging directory into .generations/. Replacing the current
+link is then a single rename, which moves every path under output/ to the new
+generation at once. If anything fails before the swap, the staged files are
+discarded and the previous generation stays live.
+
+The generation before the live one is kept for readers still inside it until
+the next build starts, which takes it over as its staging directory. Most of
+the files a build writes have the same names as last time, and rewriting a
+file is much cheaper than creating one and deleting the old one - only files
+shared with another generation are removed first, and files the build doesn't
+write again are removed before verifying.
+
+Files an incremental build leaves unchanged are carried over from the live
+generation as hard links (keep), without copying.
+
+Where symlinks aren't available (Windows without developer mode) output/current
+is a directory instead, and the generation is renamed over it: the live one is
+renamed aside into .generations/ and the new one into its place, so a reader
+sees one build or the other (or, between the two renames, no current/), never
+a mix. There are no top-level links then - read the live output from
+output/current/ (live_dir), which works either way. Copy the outputs with
+cp -rL, or from output/current/, to follow the links.
+
+    with OutputWriter(Path("output"), threads=4) as writer:
+        writer.write_json("substations.json", index)
+        writer.write("chunks/AB1.bin", partial(encode_chunk, "AB1", rows))
+        writer.commit()
+
+To rewrite only some of the live generation's files (as optimize_boundaries.py
+does), write them and carry the rest over with keep_rest before committing.
+With swap=False files are written straight into the directory instead (for a
+copied output, such as public/data/), and files in written subdirectories
+that weren't written are removed.
+
+Author: postcodes.energy
+License: MIT
+"""
+
+import json
+import os
+import shutil
+import threading
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+STAGING_DIR = ".staging"
+GENERATIONS_DIR = ".generations"
+CURRENT_LINK = "current"
+
+# Threads serializing and writing files, at most one per CPU. With one thread
+# files are written as they're given, without the pool.
+WRITER_THREADS = 4
+
+# Writes queued per thread before write() waits, which bounds the data held in memory
+QUEUED_PER_THREAD = 8
+
+
+class OutputWriter:
+    """Write a set of output files concurrently, then verify them and make them live together."""
+
+    def __init__(self, output_dir: Path, threads: int = WRITER_THREADS, swap: bool = True):
+        self.output_dir = Path(output_dir)
+        self.swap = swap
+        self.threads = max(min(threads, os.cpu_count() or 1), 1)
+        self.target_dir = self.output_dir / STAGING_DIR if swap else self.output_dir
+        if swap:
+            self._recycle()
+        self.target_dir.mkdir(parents=True, exist_ok=True)
+
+        # Size and CRC-32 of each file, by name relative to the output directory
+        # (no checksum for files carried over by keep)
+        self.files: Dict[str, Tuple[int, Optional[int]]] = {}
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.threads * QUEUED_PER_THREAD)
+        self._executor = ThreadPoolExecutor(max_workers=self.threads) if self.threads > 1 else None
+        self._pending = []
+        self._directories = set()
+        self._committed = False
+
+    def __enter__(self) -> 'OutputWriter':
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if self._executor:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+        if self.swap and not self._committed and self.target_dir.exists():
+            shutil.rmtree(self.target_dir)
+
+    def _recycle(self):
+        """Take over the oldest generation that isn't live as the staging directory."""
+        generations = self.output_dir / GENERATIONS_DIR
+        if not self.target_dir.exists() and generations.is_dir():
+            # A staging directory left by a build that failed before its swap is
+            # reused as it is - it was never live
+            current = self.output_dir / CURRENT_LINK
+            live = Path(os.readlink(current)).name if current.is_symlink() else None
+            spare = sorted(path for path in generations.iterdir() if path.name != live)
+            if spare:
+                spare[0].rename(self.target_dir)
+
+        # Rewriting a file hard linked by keep would change it in the generation it came from too
+        for directory, _, names in os.walk(self.target_dir):
+            for name in names:
+                path = os.path.join(directory, name)
+                if os.lstat(path).st_nlink > 1:
+                    os.unlink(path)
+
+    def _path(self, name: str) -> Path:
+        """Target path of a file, creating its directory."""
+        if name in self.files:
+            raise ValueError(f"{name} is already part of this output")
+        path = self.target_dir / name
+        if path.parent not in self._directories:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._directories.add(path.parent)
+        return path
+
+    def write(self, name: str, serialize: Callable[[], bytes]) -> Future:
+        """
+        Serialize and write a file (name relative to the output directory) on the
+        thread pool. Returns a future of its size in bytes.
+        """
+        path = self._path(name)
+        self.files[name] = (0, None)
+        if self._executor is None:
+            future = Future()
+            future.set_result(self._write(name, path, serialize))
+            return future
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._write, name, path, serialize)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        self._pending.append(future)
+        return future
+
+    def _write(self, name: str, path: Path, serialize: Callable[[], bytes]) -> int:
+        data = serialize()
+        path.write_bytes(data)
+        checksum = zlib.crc32(data)
+        with self._lock:
+            self.files[name] = (len(data), checksum)
+        return len(data)
+
+    def write_json(self, name: str, contents, indent: int = None) -> Future:
+        """Write contents as JSON - compact unless indent is given. Returns a future of its size."""
+        if indent is None:
+            return self.write(name, lambda: json.dumps(contents, separators=(',', ':')).encode('utf-8'))
+        return self.write(name, lambda: json.dumps(contents, indent=indent).encode('utf-8'))
+
+    def keep(self, name: str) -> bool:
+        """
+        Carry a file over unchanged from the live output, hard linked where the
+        file system allows. Returns False if there is no such file.
+        """
+        source = live_dir(self.output_dir) / name
+        if not source.is_file():
+            return False
+        if not self.swap:
+            self.files[name] = (source.stat().st_size, None)
+            return True
+        path = self._path(name)
+        path.unlink(missing_ok=True)
+        try:
+            os.link(source.resolve(), path)
+        except OSError:
+            shutil.copy2(source, path)
+        self.files[name] = (path.stat().st_size, None)
+        return True
+
+    def keep_rest(self) -> int:
+        """
+        Carry over every file of the live generation that hasn't been written,
+        except from the subdirectories written to, whose other files are stale.
+        For rewriting some of a generation's files. Returns the files kept.
+        """
+        live = self.output_dir / CURRENT_LINK
+        written_dirs = {directory.relative_to(self.target_dir) for directory in self._directories} - {Path('.')}
+        kept = 0
+        for path in sorted(live.rglob('*')):
+            name = path.relative_to(live)
+            if path.is_file() and name.as_posix() not in self.files and name.parent not in written_dirs:
+                kept += self.keep(name.as_posix())
+        return kept
+
+    def commit(self) -> Dict[str, object]:
+        """
+        Wait for the writes, verify the files and make them live. Returns the
+        generation made live (None with swap=False) and its files and bytes.
+        """
+        for future in self._pending:
+            future.result()
+        if self._executor:
+            self._executor.shutdown()
+        self._remove_stale()
+        self._verify()
+
+        generation = self._swap() if self.swap else None
+        self._committed = True
+        return {'generation': generation, 'files': len(self.files), 'bytes': sum(size for size, _ in self.files.values())}
+
+    def _verify(self):
+        """Check the written files against the sizes and checksums recorded as they were written."""
+        names = sorted(self.files)
+
+        def matches(name: str) -> bool:
+            size, checksum = self.files[name]
+            path = self.target_dir / name
+            if checksum is None:
+                return path.is_file() and path.stat().st_size == size
+            data = path.read_bytes() if path.is_file() else b''
+            return len(data) == size and zlib.crc32(data) == checksum
+
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            mismatched = [name for name, ok in zip(names, executor.map(matches, names)) if not ok]
+        if mismatched:
+            raise ValueError(f"{len(mismatched)} written files are missing or don't match their checksums, e.g. {mismatched[0]}")
+
+    def _swap(self) -> str:
+        """Move the staged files into a new generation and point the output at it."""
+        generations = self.output_dir / GENERATIONS_DIR
+        generations.mkdir(exist_ok=True)
+        generation = base = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        suffix = 1
+        while (generations / generation).exists():
+            # Only if the clock has stepped back
+            generation, suffix = f"{base}.{suffix}", suffix + 1
+        self.target_dir.rename(generations / generation)
+
+        current = self.output_dir / CURRENT_LINK
+        previous = os.readlink(current) if current.is_symlink() else None
+        names = sorted(path.name for path in (generations / generation).iterdir())
+        try:
+            _replace_link(current, Path(GENERATIONS_DIR) / generation)
+        except OSError as error:
+            print(f"WARNING: can't link {current} ({error}) - renaming the generation to {current}/ instead")
+            previous = generations / f"{generation}.previous"
+            _rename_into_place(generations / generation, current, previous)
+            # Without links the top-level names are left from an older build - the live one is in current/
+            for name in names:
+                if name != CURRENT_LINK:
+                    _remove(self.output_dir / name)
+            for path in generations.iterdir():
+                if path != previous:
+                    _remove(path)
+            return generation
+
+        # Each top-level name links through current, so replacing current switches them all
+        for name in names:
+            link = self.output_dir / name
+            if not (link.is_symlink() and os.readlink(link) == str(Path(CURRENT_LINK) / name)):
+                _replace_link(link, Path(CURRENT_LINK) / name)
+
+        # Keep the previous generation for readers still in it, remove older ones
+        keep = {generation, Path(previous).name if previous else None}
+        for path in generations.iterdir():
+            if path.name not in keep:
+                _remove(path)
+        return generation
+
+    def _remove_stale(self):
+        """
+        Remove files that weren't written: anywhere in the staging directory, or
+        with swap=False, in the subdirectories written to.
+        """
+        if self.swap:
+            written = {os.path.normpath(os.path.join(self.target_dir, name)) for name in self.files}
+            for directory, _, names in os.walk(self.target_dir, topdown=False):
+                for name in names:
+                    path = os.path.join(directory, name)
+                    if path not in written:
+                        os.unlink(path)
+                if directory != str(self.target_dir) and not os.listdir(directory):
+                    os.rmdir(directory)
+            return
+
+        written = {self.target_dir / name for name in self.files}
+        for directory in self._directories - {self.target_dir}:
+            for path in directory.iterdir():
+                if path.is_file() and path not in written:
+                    path.unlink()
+
+
+def uses_generations(output_dir: Path) -> bool:
+    """Whether an output directory's files are swapped in as generations by OutputWriter."""
+    current = Path(output_dir) / CURRENT_LINK
+    return current.is_symlink() or (current.is_dir() and (Path(output_dir) / GENERATIONS_DIR).is_dir())
+
+
+def live_dir(output_dir: Path) -> Path:
+    """
+    Directory holding the live files of an output directory: current/ where its
+    files are swapped in as generations (the only place they are where symlinks
+    aren't available), otherwise the directory itself.
+    """
+    return Path(output_dir) / CURRENT_LINK if uses_generations(output_dir) else Path(output_dir)
+
+
+def _replace_link(link: Path, target: Path):
+    """Point link at target (relative to the link's directory) with one rename, replacing whatever is there."""
+    temporary = link.with_name(f".{link.name}.link")
+    _remove(temporary)
+    os.symlink(target, temporary, target_is_directory=(link.parent / target).is_dir())
+    if link.is_dir() and not link.is_symlink():
+        # A plain directory from an output written before generations
+        shutil.rmtree(link)
+    os.replace(temporary, link)
+
+
+def _rename_into_place(source_dir: Path, live: Path, aside: Path):
+    """
+    Replace the directory live with source_dir, moving the old one to aside.
+    Directories can't be renamed over each other on Windows, so it takes two
+    renames; if the second fails the old directory is put back.
+    """
+    _remove(aside)
+    if live.is_symlink():
+        live.unlink()
+    elif live.exists():
+        live.rename(aside)
+    try:
+        source_dir.rename(live)
+    except OSError:
+        if aside.exists():
+            aside.rename(live)
+        raise
+
+
+def _remove(path: Path):
+    """Remove a file, link or directory tree, if there is one."""
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path)
+    elif path.exists() or path.is_symlink():
+        path.unlink()
@@ -0,0 +1,90 @@
+"""
+Deterministic resolution of postcodes that fall inside overlapping substations.
+
+A left 'within' join returns one row per substation polygon containing a
+postcode, so where polygons overlap - along licence-area seams, or between
+SPEN primary-group polygons - a postcode appears several times. These helpers
+keep exactly one row per postcode, chosen by a fixed rule, and report the
+overlaps that were resolved.
+
+Rules (lower rank wins; remaining ties go to the earlier substation row):
+    last          the last matching substation, as the lookup chunks keep
+    smallest      the smallest polygon by area (the most specific area)
+    largest       the largest polygon by area
+    dno-priority  the DNO listed first in DNO_FILES, then the smallest polygon
+
+Author: postcodes.energy
+License: MIT
+"""
+
+from typing import List, Tuple
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from postcode_codec import decode_postcodes
+
+OVERLAP_RULES = ['last', 'smallest', 'largest', 'dno-priority']
+
+# Equal-area CRS for comparing polygon areas (British National Grid)
+AREA_CRS = "EPSG:27700"
+
+
+def overlap_priority(substations: gpd.GeoDataFrame, rule: str, dno_order: List[str] = None) -> np.ndarray:
+    """Rank of each substation row under the rule (lower wins), with no ties."""
+    position = np.arange(len(substations))
+    if rule == 'last':
+        keys = (-position,)
+    else:
+        area = substations.geometry.to_crs(AREA_CRS).area.to_numpy() if len(substations) else np.array([])
+        if rule == 'smallest':
+            keys = (position, area)
+        elif rule == 'largest':
+            keys = (position, -area)
+        elif rule == 'dno-priority':
+            dno_order = list(dno_order or [])
+            dno_rank = substations['dno_id'].map({dno_id: i for i, dno_id in enumerate(dno_order)})
+            keys = (position, area, dno_rank.fillna(len(dno_order)).to_numpy())
+        else:
+            raise ValueError(f"Unknown overlap rule '{rule}' (expected one of {', '.join(OVERLAP_RULES)})")
+
+    rank = np.empty(len(substations), dtype=np.int64)
+    rank[np.lexsort(keys)] = position
+    return rank
+
+
+def resolve_overlaps(joined: pd.DataFrame, positions: np.ndarray,
+                     priority: np.ndarray) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Keep one row per postcode of a left join indexed by postcode row (with
+    columns key, substation_id and dno_id). positions gives each row's substation row (-1 if unmatched) and priority
+    the rank of each substation row from overlap_priority.
+
+    Returns the resolved rows in their original order, and a report of each
+    overlapping postcode: pcd, the chosen substation_id, and all candidates
+    (substation IDs and DNOs, best first).
+    """
+    postcode = joined.index.to_numpy()
+    rank = np.where(positions >= 0, priority[np.maximum(positions, 0)], -1)
+
+    # Best-ranked row of each postcode
+    order = np.lexsort((rank, postcode))
+    sorted_postcode = postcode[order]
+    first = np.r_[True, sorted_postcode[1:] != sorted_postcode[:-1]] if len(order) else np.array([], dtype=bool)
+    keep = np.sort(order[first])
+
+    # Overlap report: postcodes with more than one candidate substation
+    group = np.cumsum(first) - 1
+    group_size = np.bincount(group)
+    overlapping = order[group_size[group] > 1]
+    candidates = joined.iloc[overlapping][['key', 'substation_id', 'dno_id']].astype({'substation_id': str, 'dno_id': str})
+    candidates = candidates.assign(pcd=decode_postcodes(candidates['key'].to_numpy()), _postcode=postcode[overlapping])
+    report = candidates.groupby('_postcode', sort=True).agg(
+        pcd=('pcd', 'first'),
+        substation_id=('substation_id', 'first'),
+        candidates=('substation_id', ';'.join),
+        dnos=('dno_id', lambda dnos: ';'.join(pd.unique(dnos)))
+    ).reset_index(drop=True)
+
+    return joined.iloc[keep], report
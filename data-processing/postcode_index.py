@@ -0,0 +1,202 @@
+"""
+National postcode index: one packed, memory-mapped file for bulk lookups.
+
+The pipeline writes output/postcode_index.bin with every postcode in the
+build, its substation and its coordinates (full builds also keep unmatched
+postcodes, with no substation). PostcodeIndex
+memory-maps the file, so opening it takes milliseconds and nothing is read
+into memory until it is used. Lookups binary-search a sorted array of
+postcode keys (see postcode_codec.py), and every postcode of an area,
+district or sector is one contiguous run of rows (rows_in).
+
+    from postcode_index import PostcodeIndex
+
+    index = PostcodeIndex("output/postcode_index.bin")
+    index.lookup("N15 5QA")       # {'postcode': 'N15 5QA', 'substation_id': ..., 'lat': ..., 'lng': ...}
+    index.lookup_many(postcodes)  # DataFrame, one row per input postcode
+    index.rows_in("N15 5")        # slice of the rows of sector N15 5
+
+File layout (little-endian):
+
+    offset  type              contents
+    0       4 bytes           magic b'PEIX'
+    4       uint32            format version
+    8       uint64            count: number of postcodes
+    16      uint64            table_bytes: length of the substation ID table
+    24      8 bytes           reserved
+    32      uint32[count]     postcode keys, sorted (see postcode_codec.py)
+            uint32[count]     substation index (NO_SUBSTATION if unmatched)
+            int32[count]      latitude, fixed point (degrees * COORD_SCALE)
+            int32[count]      longitude, fixed point (degrees * COORD_SCALE)
+            utf-8[table_bytes] substation IDs, newline separated
+
+Author: postcodes.energy
+License: MIT
+"""
+
+import mmap
+import struct
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from matched_frame import COORD_SCALE
+from postcode_codec import INVALID_KEY, encode_postcodes, postcode_range
+
+MAGIC = b'PEIX'
+VERSION = 2
+HEADER = struct.Struct('<4sIQQ8x')
+NO_SUBSTATION = np.iinfo(np.uint32).max
+
+
+def write_postcode_index(matched: pd.DataFrame, path: Path) -> int:
+    """
+    Write the index from the matched postcodes (a compact matched frame, see
+    matched_frame.py). Unmatched postcodes are kept with no substation.
+    Returns the number of postcodes.
+    """
+    data, count = encode_postcode_index(matched)
+    Path(path).write_bytes(data)
+    return count
+
+
+def encode_postcode_index(matched: pd.DataFrame) -> Tuple[bytes, int]:
+    """The index file's contents for the matched postcodes (see write_postcode_index) and the number of postcodes."""
+    keys = matched['key'].to_numpy()
+    codes = matched['substation_id'].cat.codes.to_numpy()
+    valid = keys != INVALID_KEY
+    keys, codes = keys[valid], codes[valid]
+
+    # One row per postcode: prefer a matched row, and as with the chunks the last one wins
+    order = np.lexsort((codes >= 0, keys))
+    last = np.r_[keys[order][1:] != keys[order][:-1], True] if len(order) else np.array([], dtype=bool)
+    rows = np.flatnonzero(valid)[order[last]]
+    keys, codes = keys[order[last]], codes[order[last]]
+
+    # Table of the substation IDs used, sorted, and each row's index into it
+    categories = matched['substation_id'].cat.categories.to_numpy(dtype=str)
+    used = np.unique(codes[codes >= 0])
+    substation_ids = np.sort(categories[used])
+    table_index = np.full(len(categories) + 1, NO_SUBSTATION, dtype='<u4')
+    table_index[used] = np.searchsorted(substation_ids, categories[used])
+    index = table_index[codes]
+    table = '\n'.join(substation_ids.tolist()).encode('utf-8')
+
+    data = b''.join([
+        HEADER.pack(MAGIC, VERSION, len(rows), len(table)),
+        keys.astype('<u4').tobytes(),
+        index.tobytes(),
+        matched['lat_e6'].to_numpy()[rows].astype('<i4').tobytes(),
+        matched['long_e6'].to_numpy()[rows].astype('<i4').tobytes(),
+        table
+    ])
+    return data, len(rows)
+
+
+class PostcodeIndex:
+    """Memory-mapped postcode -> substation and coordinates lookup."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, count, table_bytes = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{self.path} is not a version {VERSION} postcode index")
+
+        offset = HEADER.size
+        self.keys = np.frombuffer(self._mmap, dtype='<u4', count=count, offset=offset)
+        offset += 4 * count
+        self._substation_idx = np.frombuffer(self._mmap, dtype='<u4', count=count, offset=offset)
+        offset += 4 * count
+        self._lat = np.frombuffer(self._mmap, dtype='<i4', count=count, offset=offset)
+        offset += 4 * count
+        self._lng = np.frombuffer(self._mmap, dtype='<i4', count=count, offset=offset)
+        offset += 4 * count
+        self._table_span = (offset, offset + table_bytes)
+        self._substation_ids = None
+
+    @property
+    def substation_ids(self) -> np.ndarray:
+        """All substation IDs in the index (read on first use)."""
+        if self._substation_ids is None:
+            start, end = self._table_span
+            table = self._mmap[start:end].decode('utf-8')
+            self._substation_ids = np.array(table.split('\n') if table else [], dtype=object)
+        return self._substation_ids
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, postcode: str) -> bool:
+        return self._find(encode_postcodes([postcode]))[0] >= 0
+
+    def _find(self, keys: np.ndarray) -> np.ndarray:
+        """Row of each key, or -1 where it isn't in the index."""
+        rows = np.searchsorted(self.keys, keys)
+        found = rows < len(self.keys)
+        found[found] = self.keys[rows[found]] == keys[found]
+        found &= keys != INVALID_KEY
+        return np.where(found, rows, -1)
+
+    def rows_in(self, prefix: str) -> slice:
+        """Rows of every postcode in an area ("N"), district ("N15") or sector ("N15 5")."""
+        start, end = postcode_range(prefix)
+        return slice(*np.searchsorted(self.keys, [start, end]).tolist())
+
+    def lookup(self, postcode: str) -> Optional[Dict]:
+        """Substation ID (None if unmatched) and coordinates of one postcode, or None if unknown."""
+        row = int(self._find(encode_postcodes([postcode]))[0])
+        if row < 0:
+            return None
+        substation = int(self._substation_idx[row])
+        return {
+            'postcode': postcode,
+            'substation_id': None if substation == NO_SUBSTATION else self.substation_ids[substation],
+            'lat': int(self._lat[row]) / COORD_SCALE,
+            'lng': int(self._lng[row]) / COORD_SCALE
+        }
+
+    def lookup_many(self, postcodes: Iterable[str]) -> pd.DataFrame:
+        """
+        Look up many postcodes at once, in any common format ("n15 5qa", "N155QA").
+        Returns one row per input: postcode, substation_id, lat, lng and found.
+        Unknown postcodes have found=False and empty fields.
+        """
+        postcodes = pd.Series(postcodes, dtype=object).reset_index(drop=True)
+        rows = self._find(encode_postcodes(postcodes))
+        found = rows >= 0
+        hit = rows[found]
+
+        substation_idx = np.full(len(rows), NO_SUBSTATION, dtype=np.int64)
+        substation_idx[found] = self._substation_idx[hit]
+        has_substation = substation_idx != NO_SUBSTATION
+        substation_id = np.full(len(rows), None, dtype=object)
+        substation_id[has_substation] = self.substation_ids[substation_idx[has_substation]]
+
+        lat = np.full(len(rows), np.nan)
+        lng = np.full(len(rows), np.nan)
+        lat[found] = self._lat[hit] / COORD_SCALE
+        lng[found] = self._lng[hit] / COORD_SCALE
+
+        return pd.DataFrame({
+            'postcode': postcodes,
+            'substation_id': substation_id,
+            'lat': lat,
+            'lng': lng,
+            'found': found
+        })
+
+    def close(self):
+        """Release the memory map (arrays from this index must not be used afterwards)."""
+        self.keys = self._substation_idx = self._lat = self._lng = None
+        self._mmap.close()
+
+    def __enter__(self) -> "PostcodeIndex":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,44 @@
+"""
+Compact encoding of a substation's sorted postcode list.
+
+Sorted postcodes share long prefixes with their predecessor ("N15 5QA",
+"N15 5QB", ...), so each is stored as a digit - the number of leading
+characters it shares with the previous postcode - followed by the rest of it
+(front coding), comma separated:
+
+    ["N15 5QA", "N15 5QB", "N15 5RA", "N16 0AB"]  ->  "0N15 5QA,6B,5RA,26 0AB"
+
+Postcodes are at most 8 characters, so the shared length is one digit. The
+result is a plain JSON string, about a third of the size of the list.
+
+The JavaScript decoder is decodePostcodeList() in public/app.js.
+
+Author: postcodes.energy
+License: MIT
+"""
+
+from typing import List
+
+
+def encode_postcode_list(postcodes: List[str]) -> str:
+    """Front-code a sorted list of postcodes."""
+    encoded = []
+    previous = ''
+    for postcode in postcodes:
+        shared = 0
+        limit = min(len(postcode), len(previous), 9)
+        while shared < limit and postcode[shared] == previous[shared]:
+            shared += 1
+        encoded.append(f"{shared}{postcode[shared:]}")
+        previous = postcode
+    return ','.join(encoded)
+
+
+def decode_postcode_list(encoded: str) -> List[str]:
+    """Postcodes of a front-coded list, in order."""
+    postcodes = []
+    previous = ''
+    for entry in encoded.split(',') if encoded else []:
+        previous = previous[:int(entry[0])] + entry[1:]
+        postcodes.append(previous)
+    return postcodes
@@ -15,14 +15,41 @@ Author: postcodes.energy
 License: MIT
 """
 
+import argparse
 import geopandas as gpd
+import io
+import numpy as np
 import pandas as pd
+import pyogrio
+import shapely
 import json
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import Dict, List
+from typing import Callable, Dict, Iterable, Iterator, List, Set, Tuple, Union
 import warnings
+from pyproj import Transformer
+from shapely.geometry import mapping
+from shapely.strtree import STRtree
 from tqdm import tqdm
 
+from autocomplete_index import write_autocomplete_index
+from boundary_shards import PAGES_FILE_BYTES, write_details
+from build_cache import CACHE_DIR, BuildCache, combine_fingerprints
+from build_report import REPORT_FILE, BuildReport, Stage
+from chunk_format import encode_chunk, encode_shard
+from chunk_shards import plan_shards
+from grid_index import SubstationGridIndex
+from matched_frame import compact_matches, coordinates, expand_matches, substation_dtype
+from optimize_boundaries import DEFAULT_MAX_ERROR_M, fit_details_to_budget
+from output_writer import OutputWriter, live_dir
+from overlaps import OVERLAP_RULES, overlap_priority, resolve_overlaps
+from postcode_codec import (INVALID_KEY, INWARD_CODES, KEY_DTYPE, decode_outward, decode_postcodes,
+                            encode_postcodes, outward_codes)
+from postcode_index import encode_postcode_index
+from publish import PUBLISH_DIR, brotli, publish_artifacts
+from spatial_join import TILES_PER_WORKER, create_join_pool, parallel_sjoin
+
 warnings.filterwarnings('ignore')
 
 # Paths
@@ -30,6 +57,27 @@ RAW_SUBSTATIONS = Path("raw/substations")
 RAW_POSTCODES = Path("raw/postcodes")
 OUTPUT_DIR = Path("output")
 
+# Postcode rows read and spatially joined at a time (caps peak memory on large ONSPD files)
+POSTCODE_BATCH_SIZE = 250_000
+
+# Matched rows expanded to formatted postcodes and IDs at a time while writing chunks
+CHUNK_EXPAND_ROWS = 50_000
+
+# Saved grid index for the 'grid' join engine
+GRID_INDEX_FILE = "substation_grid.npz"
+
+# Memory-mapped national postcode index for bulk lookups (see postcode_index.py)
+POSTCODE_INDEX_FILE = "postcode_index.bin"
+
+# Postcodes that fell inside overlapping substations, and how each was resolved
+OVERLAP_REPORT_FILE = "overlap_report.csv"
+
+# Standardized substation polygons and details for coordinate queries (see substation_query.py)
+SUBSTATION_TABLE_FILE = "substations.parquet"
+
+# Projected CRS for nearest-substation distances (British National Grid, metres)
+DISTANCE_CRS = "EPSG:27700"
+
 # DNO file mapping - update this based on your actual files
 DNO_FILES = {
     "SPEN_SPD": {
@@ -90,20 +138,37 @@ DNO_FILES = {
 }
 
 
-def load_substation_data(file_path: Path, dno_id: str, dno_info: Dict) -> gpd.GeoDataFrame:
+def load_substation_data(file_path: Path, dno_id: str, dno_info: Dict,
+                         log: Callable[[str], None] = print) -> gpd.GeoDataFrame:
     """
     Load substation boundary data from GeoJSON or GeoPackage.
     Standardize field names and add DNO metadata.
+    Progress messages go to log (print by default).
     """
-    print(f"Loading {dno_id} from {file_path.name}...")
+    log(f"Loading {dno_id} from {file_path.name}...")
+    
+    # Try to identify substation name/ID from existing fields
+    # Check multiple possible field names
+    name_candidates = ['primary', 'name', 'substation', 'site_name', 'Sub_Name', 'SUBSTATION_NAME']
+    id_candidates = ['primary_floc', 'id', 'substation_id', 'site_id', 'Sub_ID', 'SUBSTATION_ID']
     
     try:
-        # Read file (handles both GeoJSON and GeoPackage)
-        gdf = gpd.read_file(file_path)
+        # Read only the first matching name and ID fields, via pyogrio's Arrow path
+        # (handles both GeoJSON and GeoPackage)
+        fields = list(pyogrio.read_info(file_path)['fields'])
+        columns = [
+            next((col for col in candidates if col in fields), None)
+            for candidates in (name_candidates, id_candidates)
+        ]
+        gdf = pyogrio.read_dataframe(
+            file_path,
+            columns=list(dict.fromkeys(col for col in columns if col)),
+            use_arrow=True
+        )
         
         # Ensure it's in WGS84 (EPSG:4326) for web mapping
         if gdf.crs != "EPSG:4326":
-            print(f"  Converting from {gdf.crs} to EPSG:4326")
+            log(f"  Converting from {gdf.crs} to EPSG:4326")
             gdf = gdf.to_crs("EPSG:4326")
         
         # Add standardized metadata
@@ -111,63 +176,97 @@ def load_substation_data(file_path: Path, dno_id: str, dno_info: Dict) -> gpd.Ge
         gdf['dno_name'] = dno_info['dno_name']
         gdf['license_area'] = dno_info['license_area']
         
-        # Try to identify substation name/ID from existing fields
-        # Check multiple possible field names
-        name_candidates = ['primary', 'name', 'substation', 'site_name', 'Sub_Name', 'SUBSTATION_NAME']
-        id_candidates = ['primary_floc', 'id', 'substation_id', 'site_id', 'Sub_ID', 'SUBSTATION_ID']
-        
         gdf['substation_name'] = None
         for col in name_candidates:
             if col in gdf.columns:
                 gdf['substation_name'] = gdf[col].astype(str)
-                print(f"  Using '{col}' for substation name")
+                log(f"  Using '{col}' for substation name")
                 break
         
         gdf['substation_id'] = None
         for col in id_candidates:
             if col in gdf.columns:
                 gdf['substation_id'] = gdf[col].astype(str)
-                print(f"  Using '{col}' for substation ID")
+                log(f"  Using '{col}' for substation ID")
                 break
         
         # If no ID found, create one from DNO + index
         if gdf['substation_id'].isna().all() or (gdf['substation_id'] == 'None').all():
-            print(f"  No ID field found, creating IDs from index")
+            log(f"  No ID field found, creating IDs from index")
             gdf['substation_id'] = [f"{dno_id}_{i:04d}" for i in range(len(gdf))]
         
         # If no name found, use ID as name
         if gdf['substation_name'].isna().all() or (gdf['substation_name'] == 'None').all():
-            print(f"  No name field found, using ID as name")
+            log(f"  No name field found, using ID as name")
             gdf['substation_name'] = gdf['substation_id']
         
         # Keep only essential columns
         essential_cols = ['substation_id', 'substation_name', 'dno_id', 'dno_name', 'license_area', 'geometry']
         gdf = gdf[essential_cols]
         
-        print(f"  Loaded {len(gdf)} substations")
+        log(f"  Loaded {len(gdf)} substations")
         return gdf
         
     except Exception as e:
-        print(f"  ERROR loading {file_path}: {e}")
+        log(f"  ERROR loading {file_path}: {e}")
         return None
 
 
-def load_all_substations() -> gpd.GeoDataFrame:
-    """Load and combine all DNO substation data."""
+def load_dno_substations(file_path: Path, dno_id: str, dno_info: Dict,
+                         cache: BuildCache = None) -> Tuple[gpd.GeoDataFrame, str, List[str]]:
+    """
+    Load one DNO's standardized substations, from the cache if its file and
+    DNO_FILES entry are unchanged. Returns (substations, fingerprint, log messages);
+    the fingerprint is None when the data came from the cache or there is no cache.
+    """
+    messages = []
+    
+    if cache is None:
+        return load_substation_data(file_path, dno_id, dno_info, log=messages.append), None, messages
+    
+    fingerprint = combine_fingerprints(cache.fingerprint(file_path), dno_id, dno_info)
+    if cache.substations_fresh(dno_id, fingerprint):
+        messages.append(f"Loading {dno_id} from cache (unchanged)")
+        return cache.load_substations(dno_id), None, messages
+    
+    return load_substation_data(file_path, dno_id, dno_info, log=messages.append), fingerprint, messages
+
+
+def load_all_substations(cache: BuildCache = None) -> gpd.GeoDataFrame:
+    """
+    Load and combine all DNO substation data.
+    DNO files are read concurrently. With a build cache, DNOs whose file (and
+    DNO_FILES entry) are unchanged since the last run are read from the
+    GeoParquet cache instead, and newly loaded DNOs are added to it.
+    """
     print("\n=== Loading All DNO Substation Data ===\n")
     
     all_substations = []
     
-    for dno_id, dno_info in DNO_FILES.items():
-        file_path = RAW_SUBSTATIONS / dno_info['file']
-        
-        if not file_path.exists():
-            print(f"WARNING: {file_path} not found, skipping...")
-            continue
+    with ThreadPoolExecutor() as pool:
+        futures = {}
+        for dno_id, dno_info in DNO_FILES.items():
+            file_path = RAW_SUBSTATIONS / dno_info['file']
+            
+            if not file_path.exists():
+                print(f"WARNING: {file_path} not found, skipping...")
+                continue
+            
+            futures[dno_id] = pool.submit(load_dno_substations, file_path, dno_id, dno_info, cache)
         
-        gdf = load_substation_data(file_path, dno_id, dno_info)
-        if gdf is not None:
-            all_substations.append(gdf)
+        # Collect in DNO_FILES order so the combined frame is the same on every run
+        for dno_id, future in futures.items():
+            gdf, fingerprint, messages = future.result()
+            for message in messages:
+                print(message)
+            
+            if gdf is not None:
+                all_substations.append(gdf)
+                if fingerprint is not None:
+                    cache.store_substations(dno_id, fingerprint, gdf)
+    
+    if cache is not None:
+        cache.save()
     
     # Combine all substations
     if all_substations:
@@ -178,13 +277,8 @@ def load_all_substations() -> gpd.GeoDataFrame:
         raise ValueError("No substation data could be loaded!")
 
 
-def load_postcode_data() -> gpd.GeoDataFrame:
-    """
-    Load UK postcode location data.
-    Expects ONSPD or Code-Point CSV with postcode, latitude, longitude columns.
-    """
-    print("\n=== Loading Postcode Data ===\n")
-    
+def find_postcode_file() -> Path:
+    """Find the postcode CSV in raw/postcodes (ONSPD preferred), or None if there isn't one."""
     # Look for postcode file in raw/postcodes (prioritize ONSPD files)
     postcode_files = list(RAW_POSTCODES.glob("ONSPD*.csv"))
     
@@ -194,36 +288,86 @@ def load_postcode_data() -> gpd.GeoDataFrame:
         # Exclude household census file
         postcode_files = [f for f in postcode_files if 'Household' not in f.name]
     
-    if not postcode_files:
+    return postcode_files[0] if postcode_files else None
+
+
+def sniff_postcode_columns(postcode_file: Path) -> Dict[str, str]:
+    """
+    Read the CSV header once and map the file's postcode, latitude and longitude
+    columns to 'pcd', 'lat' and 'long'. Column names are matched case-insensitively.
+    """
+    header = pd.read_csv(postcode_file, nrows=0).columns
+    by_lower = {col.lower(): col for col in header}
+    
+    # ONSPD typical columns: 'pcds', 'lat', 'long' (upper or lower case)
+    columns = {}
+    for source, target in [('pcds', 'pcd'), ('lat', 'lat'), ('long', 'long')]:
+        if source not in by_lower:
+            raise ValueError(f"Column '{source.upper()}'/'{source}' not found in {postcode_file.name}")
+        columns[by_lower[source]] = target
+    return columns
+
+
+def postcodes_to_geodataframe(df: pd.DataFrame) -> gpd.GeoDataFrame:
+    """
+    Drop rows without coordinates or a standard postcode, replace pcd with
+    each postcode's integer key (see postcode_codec.py), and build point
+    geometries from lat/long.
+    """
+    df = df.dropna(subset=['lat', 'long'])
+    keys = encode_postcodes(df['pcd'])
+    valid = keys != INVALID_KEY
+    df = df.loc[valid, ['lat', 'long']].assign(key=keys[valid])
+    return gpd.GeoDataFrame(
+        df,
+        geometry=gpd.points_from_xy(df['long'], df['lat']),
+        crs="EPSG:4326"
+    )
+
+
+def iter_postcode_batches(postcode_file: Path, columns: Dict[str, str],
+                          batch_size: int) -> Iterator[gpd.GeoDataFrame]:
+    """Stream the postcode CSV as GeoDataFrames of at most batch_size rows."""
+    reader = pd.read_csv(
+        postcode_file,
+        usecols=list(columns),
+        dtype={source: (str if target == 'pcd' else 'float64') for source, target in columns.items()},
+        chunksize=batch_size
+    )
+    for df in reader:
+        yield postcodes_to_geodataframe(df.rename(columns=columns))
+
+
+def load_postcode_data(batch_size: int = 0) -> Union[gpd.GeoDataFrame, Iterator[gpd.GeoDataFrame]]:
+    """
+    Load UK postcode location data.
+    Expects ONSPD or Code-Point CSV with postcode, latitude, longitude columns.
+    If batch_size is set, returns a stream of GeoDataFrame batches of at most
+    that many rows instead of loading the whole file at once.
+    """
+    print("\n=== Loading Postcode Data ===\n")
+    
+    postcode_file = find_postcode_file()
+    
+    if postcode_file is None:
         print("ERROR: No postcode CSV file found in raw/postcodes/")
         print("Please download ONSPD or OS Code-Point data and place in raw/postcodes/")
         return None
     
-    postcode_file = postcode_files[0]
     print(f"Loading postcodes from {postcode_file.name}...")
     
     # Read CSV (adjust column names based on your data source)
-    # ONSPD typical columns: 'pcd', 'lat', 'long'
     # Code-Point: different format, may need adjustment
     
     try:
-        # Try ONSPD column names - try both uppercase and lowercase
-        try:
-            df = pd.read_csv(postcode_file, usecols=['PCDS', 'LAT', 'LONG'])
-            df = df.rename(columns={'PCDS': 'pcd', 'LAT': 'lat', 'LONG': 'long'})
-        except:
-            # Try lowercase column names
-            df = pd.read_csv(postcode_file, usecols=['pcds', 'lat', 'long'])
-            df = df.rename(columns={'pcds': 'pcd'})
+        columns = sniff_postcode_columns(postcode_file)
         
-        df = df.dropna(subset=['lat', 'long'])
+        if batch_size:
+            print(f"Streaming postcodes in batches of {batch_size:,} rows")
+            return iter_postcode_batches(postcode_file, columns, batch_size)
         
-        # Create GeoDataFrame from lat/long
-        gdf = gpd.GeoDataFrame(
-            df,
-            geometry=gpd.points_from_xy(df['long'], df['lat']),
-            crs="EPSG:4326"
-        )
+        df = pd.read_csv(postcode_file, usecols=list(columns)).rename(columns=columns)
+        gdf = postcodes_to_geodataframe(df)
         
         print(f"[OK] Loaded {len(gdf)} postcodes")
         return gdf
@@ -234,21 +378,112 @@ def load_postcode_data() -> gpd.GeoDataFrame:
         return None
 
 
-def match_postcodes_to_substations(postcodes: gpd.GeoDataFrame, 
-                                   substations: gpd.GeoDataFrame) -> pd.DataFrame:
+def join_postcodes(postcodes: gpd.GeoDataFrame, substations: gpd.GeoDataFrame,
+                   executor: Executor = None, workers: int = 1,
+                   grid_index: SubstationGridIndex = None) -> gpd.GeoDataFrame:
+    """
+    Spatial join: find which substation polygon each postcode falls within.
+    With an executor the join is partitioned into spatial tiles run in parallel;
+    with a grid index, points are answered from its cells.
+    """
+    if grid_index is not None:
+        return grid_index.sjoin(postcodes, substations)
+    if executor is None:
+        return gpd.sjoin(postcodes, substations, how='left', predicate='within')
+    return parallel_sjoin(postcodes, substations, executor, n_tiles=workers * TILES_PER_WORKER)
+
+
+def load_grid_index(substations: gpd.GeoDataFrame, index_file: Path = None,
+                    writer: OutputWriter = None) -> SubstationGridIndex:
+    """
+    Load a saved grid index if it was built from these substations,
+    otherwise build one and save it for later runs and query tools - to
+    index_file if given, otherwise to output/. With writer, output/'s index
+    is saved as part of its generation (carried over if it was reused).
+    """
+    output_file = OUTPUT_DIR / GRID_INDEX_FILE
+    live_files = {output_file.absolute(), (live_dir(OUTPUT_DIR) / GRID_INDEX_FILE).absolute()}
+    in_output = writer is not None and (index_file is None or Path(index_file).absolute() in live_files)
+    if index_file is not None and index_file.exists():
+        grid_index = SubstationGridIndex.load(index_file)
+        if grid_index.matches(substations):
+            print(f"Using grid index {index_file}")
+            if in_output:
+                writer.keep(GRID_INDEX_FILE)
+            return grid_index
+        print(f"WARNING: {index_file} was built from different substations or geometry, rebuilding...")
+    
+    print("Building grid index...")
+    grid_index = SubstationGridIndex.from_substations(substations)
+    stats = grid_index.stats()
+    print(f"  {stats['interior_cells']:,} interior cells, {stats['boundary_cells']:,} boundary cells")
+    
+    index_file = index_file or output_file
+    if in_output:
+        writer.write(GRID_INDEX_FILE, grid_index.to_bytes)
+    else:
+        index_file.parent.mkdir(parents=True, exist_ok=True)
+        grid_index.save(index_file)
+    print(f"[OK] Saved grid index to {index_file}")
+    return grid_index
+
+
+def match_postcodes_to_substations(postcodes: Union[gpd.GeoDataFrame, Iterable[gpd.GeoDataFrame]], 
+                                   substations: gpd.GeoDataFrame,
+                                   workers: int = 1,
+                                   engine: str = 'sjoin',
+                                   grid_index_file: Path = None,
+                                   overlaps: str = 'all',
+                                   keep_columns: List[str] = (),
+                                   writer: OutputWriter = None) -> pd.DataFrame:
     """
     Perform spatial join to match each postcode to its substation area.
+    postcodes may be a single GeoDataFrame or a stream of batches from
+    load_postcode_data(batch_size=...). Batches are joined one at a time and
+    reduced to a compact matched frame (see matched_frame.py), so memory is
+    bounded by the batch size. keep_columns names join columns to keep as well.
+    With workers > 1 each join is split into spatial tiles across a process pool.
+    engine='grid' answers points from a hierarchical grid index instead (see grid_index.py).
+    overlaps='all' keeps a row for every substation containing a postcode; any
+    rule in OVERLAP_RULES keeps one row per postcode as each batch is joined.
+    With writer, the grid index and overlap report are saved as part of its generation.
     """
     print("\n=== Matching Postcodes to Substations ===\n")
     print("This may take several minutes...")
     
-    # Spatial join: find which substation polygon each postcode falls within
-    matched = gpd.sjoin(
-        postcodes,
-        substations,
-        how='left',
-        predicate='within'
-    )
+    executor = None
+    grid_index = None
+    if engine == 'grid':
+        grid_index = load_grid_index(substations, grid_index_file, writer)
+    elif workers > 1:
+        print(f"Joining in parallel across {workers} worker processes")
+        executor = create_join_pool(substations, workers)
+    
+    priority = None
+    reports = []
+    if overlaps != 'all':
+        print(f"Resolving overlapping substations by rule '{overlaps}'")
+        priority = overlap_priority(substations, overlaps, list(DNO_FILES))
+    
+    def join(batch):
+        joined = join_postcodes(batch, substations, executor, workers, grid_index)
+        if priority is not None:
+            positions = substations.index.get_indexer(joined['index_right'])
+            joined, report = resolve_overlaps(joined, positions, priority)
+            reports.append(report)
+        return compact_matches(joined, substations, keep_columns)
+    
+    try:
+        if isinstance(postcodes, gpd.GeoDataFrame):
+            matched = join(postcodes)
+        else:
+            batches = [join(batch) for batch in tqdm(postcodes, desc="Matching postcode batches")]
+            empty = pd.DataFrame(columns=['key', 'lat', 'long', 'index_right'] + list(keep_columns))
+            matched = pd.concat(batches) if batches else compact_matches(empty, substations, keep_columns)
+            print(f"[OK] Loaded {len(matched):,} postcodes")
+    finally:
+        if executor is not None:
+            executor.shutdown()
     
     # Count matches
     matched_count = matched['substation_id'].notna().sum()
@@ -257,196 +492,833 @@ def match_postcodes_to_substations(postcodes: gpd.GeoDataFrame,
     print(f"\n[OK] Matched: {matched_count:,} postcodes")
     print(f"[!] Unmatched: {unmatched_count:,} postcodes")
     print(f"  (Unmatched postcodes are likely on boundaries, offshore, or in data gaps)")
+    print(f"[OK] Matched frame: {matched.memory_usage(deep=True).sum() / 1024 / 1024:,.1f} MB in memory")
+    
+    if priority is not None:
+        save_overlap_report(pd.concat(reports, ignore_index=True) if reports else None, overlaps, writer)
     
     return matched
 
 
-def create_postcode_lookup(matched: pd.DataFrame) -> Dict:
+def save_overlap_report(report: pd.DataFrame, rule: str, writer: OutputWriter = None):
     """
-    Create optimized postcode lookup structure.
-    Groups postcodes by outward code (e.g., "SW1") for efficient loading.
-    Now includes coordinates for map markers.
+    Summarize the resolved overlaps and save them to output/overlap_report.csv,
+    as part of writer's generation if given.
     """
-    print("\n=== Creating Postcode Lookup ===\n")
+    if report is None or report.empty:
+        report = pd.DataFrame(columns=['pcd', 'substation_id', 'candidates', 'dnos'])
+    
+    report_file = OUTPUT_DIR / OVERLAP_REPORT_FILE
+    if writer is not None:
+        csv = report.to_csv(index=False).encode('utf-8')
+        writer.write(OVERLAP_REPORT_FILE, lambda: csv)
+    else:
+        OUTPUT_DIR.mkdir(exist_ok=True)
+        report.to_csv(report_file, index=False)
+    
+    print(f"\n[!] {len(report):,} postcodes fell inside overlapping substations (resolved by '{rule}')")
+    for dnos, count in report['dnos'].value_counts().head(5).items():
+        print(f"  {dnos}: {count:,}")
+    print(f"[OK] Saved overlap report to {report_file}")
+
+
+def match_postcodes_incremental(substations: gpd.GeoDataFrame, cache: BuildCache,
+                                batch_size: int = 0, workers: int = 1,
+                                engine: str = 'sjoin',
+                                grid_index_file: Path = None,
+                                overlaps: str = 'all',
+                                writer: OutputWriter = None) -> Tuple[pd.DataFrame, Set[str]]:
+    """
+    Match postcodes to substations, re-joining only the DNOs whose substations
+    (or the postcode file) changed since the cached build. Cached matches for
+    the other DNOs are reused. The cache keeps every match, so overlaps are
+    resolved after the DNOs are combined, as in a full build.
+    
+    Returns the matched postcodes, in the same row order as a full join, and
+    the outward codes whose chunks need rewriting (None if all of them do).
+    """
+    print("\n=== Incremental Matching ===\n")
+    
+    postcode_file = find_postcode_file()
+    if postcode_file is None:
+        print("ERROR: No postcode CSV file found in raw/postcodes/")
+        return None, None
     
-    # Remove unmatched postcodes
-    matched = matched[matched['substation_id'].notna()].copy()
+    postcode_fingerprint = cache.fingerprint(postcode_file)
+    postcodes_changed = cache.postcodes.get('fingerprint') != postcode_fingerprint
     
-    # Extract outward code (first part of postcode)
-    matched['outward'] = matched['pcd'].str.extract(r'^([A-Z]{1,2}\d{1,2}[A-Z]?)', expand=False)
+    dno_ids = list(pd.unique(substations['dno_id']))
+    fingerprints = {
+        dno_id: combine_fingerprints(cache.manifest['substations'][dno_id], postcode_fingerprint)
+        for dno_id in dno_ids
+    }
+    changed = [dno_id for dno_id in dno_ids if not cache.matched_fresh(dno_id, fingerprints[dno_id])]
+    removed = [dno_id for dno_id in cache.cached_dnos('matched') if dno_id not in dno_ids]
+    
+    print(f"Reusing cached matches for {len(dno_ids) - len(changed)} licence areas")
     
-    lookup = {}
+    # Chunks touched by the previous matches of changed or removed DNOs
+    touched = set()
+    for dno_id in changed + removed:
+        if dno_id in cache.cached_dnos('matched'):
+            previous = cache.load_matched(dno_id)
+            touched.update(outward_codes(previous['key']))
     
-    for outward in tqdm(matched['outward'].unique(), desc="Building lookup"):
-        outward_data = matched[matched['outward'] == outward]
+    if changed:
+        print(f"Re-matching {len(changed)} licence areas: {', '.join(changed)}")
         
-        lookup[outward] = {
-            postcode: {
-                'substation_id': substation_id,
-                'lat': lat,
-                'lng': lng
-            }
-            for postcode, substation_id, lat, lng in zip(
-                outward_data['pcd'],
-                outward_data['substation_id'],
-                outward_data['lat'],
-                outward_data['long']
-            )
+        postcodes = load_postcode_data(batch_size=batch_size)
+        if postcodes is None:
+            return None, None
+        
+        joined = match_postcodes_to_substations(
+            postcodes, substations[substations['dno_id'].isin(changed)],
+            workers=workers, engine=engine, grid_index_file=grid_index_file,
+            keep_columns=['index_right', 'dno_id'], writer=writer
+        )
+        cache.postcodes.update(fingerprint=postcode_fingerprint, count=int(joined.index.nunique()))
+        
+        # Row keys that give the full join's order: postcode row, then substation row within its DNO
+        joined = joined[joined['substation_id'].notna()].copy()
+        dno_start = pd.Series(np.arange(len(substations)), index=substations.index).groupby(substations['dno_id']).min()
+        joined['postcode_row'] = joined.index
+        joined['substation_row'] = (
+            substations.index.get_indexer(joined['index_right']) - joined['dno_id'].map(dno_start).to_numpy()
+        ).astype(np.int32)
+        joined = joined.drop(columns='index_right').reset_index(drop=True)
+        
+        for dno_id in changed:
+            dno_matched = joined[joined['dno_id'] == dno_id]
+            cache.store_matched(dno_id, fingerprints[dno_id], dno_matched)
+            touched.update(outward_codes(dno_matched['key']))
+    elif writer is not None and engine == 'grid':
+        # Nothing was joined, so the grid index carries over into the new generation as it is
+        writer.keep(GRID_INDEX_FILE)
+    
+    for dno_id in removed:
+        cache.drop_matched(dno_id)
+    cache.save()
+    
+    # Combine per-DNO matches in DNO order, then order by postcode row
+    matched = pd.concat([cache.load_matched(dno_id) for dno_id in dno_ids], ignore_index=True)
+    matched = matched.sort_values('postcode_row', kind='stable')
+    matched.index = pd.Index(matched.pop('postcode_row').to_numpy())
+    matched['substation_id'] = matched['substation_id'].astype(substation_dtype(substations))
+    matched['dno_id'] = matched['dno_id'].astype('category')
+    
+    if overlaps != 'all':
+        dno_start = pd.Series(np.arange(len(substations)), index=substations.index).groupby(substations['dno_id']).min()
+        positions = matched['dno_id'].map(dno_start).to_numpy() + matched['substation_row'].to_numpy()
+        matched, report = resolve_overlaps(matched, positions, overlap_priority(substations, overlaps, list(DNO_FILES)))
+        save_overlap_report(report, overlaps, writer)
+    matched = matched.drop(columns=['substation_row', 'dno_id'])
+    
+    matched_count = matched.index.nunique()
+    print(f"\n[OK] Matched: {matched_count:,} postcodes")
+    print(f"[!] Unmatched: {cache.postcodes['count'] - matched_count:,} postcodes")
+    
+    if postcodes_changed or not (live_dir(OUTPUT_DIR) / "chunks").exists():
+        return matched, None
+    print(f"[OK] {len(touched)} postcode areas need rewriting")
+    return matched, touched
+
+
+def assign_nearest_substations(matched: pd.DataFrame, substations: gpd.GeoDataFrame,
+                               max_distance: float) -> pd.DataFrame:
+    """
+    Fallback for postcodes outside every substation polygon (coast, islands,
+    DNO seams): assign each to the nearest polygon within max_distance metres,
+    using one nearest-neighbour query of an STRtree over all unmatched points.
+    
+    Adds match_type ('within', 'nearest', or missing if still unmatched) and
+    match_distance_m (0 for postcodes within their polygon).
+    """
+    print("\n=== Nearest Substation Fallback ===\n")
+    
+    matched = matched.copy()
+    substation_codes = matched['substation_id'].cat.codes.to_numpy().copy()
+    within = substation_codes >= 0
+    # Codes of the match_type categories: 0 within, 1 nearest, -1 still unmatched
+    match_type = np.where(within, 0, -1).astype(np.int8)
+    distance = np.where(within, 0.0, np.nan)
+    unmatched = np.flatnonzero(~within)
+    
+    if len(unmatched):
+        # Distances in metres: project points and polygons to British National Grid
+        to_bng = Transformer.from_crs(substations.crs or "EPSG:4326", DISTANCE_CRS, always_xy=True)
+        lat, long = coordinates(matched.iloc[unmatched])
+        x, y = to_bng.transform(long, lat)
+        polygons = substations.geometry.to_crs(DISTANCE_CRS).to_numpy()
+        
+        tree = STRtree(polygons)
+        (point_idx, polygon_idx), nearest_distance = tree.query_nearest(
+            shapely.points(x, y), max_distance=max_distance, return_distance=True, all_matches=False
+        )
+        rows = unmatched[point_idx]
+        
+        # Point each assigned postcode at its nearest substation's ID
+        categories = matched['substation_id'].cat.categories
+        substation_codes[rows] = categories.get_indexer(substations['substation_id'].astype(str).to_numpy()[polygon_idx])
+        match_type[rows] = 1
+        distance[rows] = nearest_distance
+    
+    matched['substation_id'] = pd.Categorical.from_codes(substation_codes, dtype=matched['substation_id'].dtype)
+    matched['match_type'] = pd.Categorical.from_codes(match_type, categories=['within', 'nearest'])
+    matched['match_distance_m'] = distance
+    
+    nearest = match_type == 1
+    assigned = int(nearest.sum())
+    print(f"[OK] Assigned {assigned:,} of {len(unmatched):,} unmatched postcodes to a substation within {max_distance:,.0f} m")
+    if assigned:
+        print(f"  Median distance {np.median(distance[nearest]):,.0f} m")
+    print(f"[!] Still unmatched: {len(unmatched) - assigned:,} postcodes")
+    return matched
+
+
+def _sorted_matches(matched: pd.DataFrame) -> Tuple[pd.DataFrame, np.ndarray]:
+    """Matched rows with a substation, sorted by key, and their keys."""
+    matched = matched[matched['substation_id'].notna()]
+    
+    # Stable sort keeps the original row order of a postcode matched more than once
+    keys = matched['key'].to_numpy()
+    order = np.argsort(keys, kind='stable')
+    return matched.iloc[order], keys[order]
+
+
+def _iter_row_groups(rows: pd.DataFrame, names: List[str], starts: np.ndarray) -> Iterator[Tuple[str, pd.DataFrame]]:
+    """
+    Yield (name, rows) for each group of contiguous rows starting at starts,
+    expanding a block of whole groups (about CHUNK_EXPAND_ROWS rows) at a time.
+    """
+    ends = np.r_[starts[1:], len(rows)]
+    
+    # First group of each block: groups starting in the same CHUNK_EXPAND_ROWS rows
+    blocks = np.flatnonzero(np.r_[True, np.diff(starts // CHUNK_EXPAND_ROWS) > 0]) if len(starts) else np.array([], dtype=int)
+    for first, last in zip(blocks.tolist(), np.r_[blocks[1:], len(starts)].tolist()):
+        offset = int(starts[first])
+        block = expand_matches(rows.iloc[offset:ends[last - 1]])
+        for name, start, end in zip(names[first:last], starts[first:last].tolist(), ends[first:last].tolist()):
+            yield name, block.iloc[start - offset:end - offset]
+
+
+def iter_postcode_chunks(matched: pd.DataFrame) -> Iterator[Tuple[str, pd.DataFrame]]:
+    """
+    Yield (outward code, postcodes) pairs, where postcodes is a frame of the
+    matched rows (key, pcd, substation_id, lat, long, plus match_type and
+    match_distance_m after the nearest fallback, see expand_matches) for that
+    outward code. Sorts the matched postcodes by key once - which orders them
+    by outward code, then postcode - and slices each chunk from contiguous
+    rows, so chunks can be written as soon as they are built.
+    """
+    rows, keys = _sorted_matches(matched)
+    outward = keys // INWARD_CODES
+    
+    # Start offset of each run of identical outward codes
+    starts = np.flatnonzero(np.r_[True, outward[1:] != outward[:-1]]) if len(outward) else np.array([], dtype=int)
+    yield from _iter_row_groups(rows, decode_outward(outward[starts]).tolist(), starts)
+
+
+def shard_postcode_chunks(matched: pd.DataFrame, shard_bytes: int,
+                          chunk_format: str = 'both') -> Tuple[List[str], Iterator[Tuple[str, pd.DataFrame]]]:
+    """
+    Pack the matched postcodes into shards of about shard_bytes (see
+    chunk_shards.py). Returns the prefix each shard starts at, and a stream of
+    (shard number, postcodes) pairs like iter_postcode_chunks.
+    """
+    rows, keys = _sorted_matches(matched)
+    starts, routes = plan_shards(keys, rows['substation_id'], shard_bytes, chunk_format)
+    print(f"[OK] Packed {len(rows):,} postcodes into {len(routes):,} shards of about {shard_bytes / 1024:.0f} KB")
+    return routes, _iter_row_groups(rows, [str(shard) for shard in range(len(routes))], starts)
+
+
+def chunk_to_dict(chunk: pd.DataFrame) -> Dict:
+    """
+    Convert a chunk's rows to the JSON lookup structure: postcode -> substation and coordinates.
+    Postcodes assigned by the nearest fallback also get match 'nearest' and distance_m.
+    """
+    lookup = {
+        postcode: {
+            'substation_id': substation_id,
+            'lat': lat,
+            'lng': lng
         }
+        for postcode, substation_id, lat, lng in zip(
+            chunk['pcd'].tolist(),
+            chunk['substation_id'].tolist(),
+            chunk['lat'].tolist(),
+            chunk['long'].tolist()
+        )
+    }
+    if 'match_type' in chunk.columns:
+        nearest = chunk[chunk['match_type'].to_numpy() == 'nearest']
+        for postcode, distance in zip(nearest['pcd'].tolist(), nearest['match_distance_m'].tolist()):
+            lookup[postcode].update(match='nearest', distance_m=round(distance))
+    return lookup
+
+
+def iter_postcode_lookup(matched: pd.DataFrame) -> Iterator[Tuple[str, Dict]]:
+    """Yield (outward code, postcode lookup dict) pairs - see iter_postcode_chunks."""
+    for outward, chunk in iter_postcode_chunks(matched):
+        yield outward, chunk_to_dict(chunk)
+
+
+def create_postcode_lookup(matched: pd.DataFrame) -> Dict:
+    """
+    Create optimized postcode lookup structure.
+    Groups postcodes by outward code (e.g., "SW1") for efficient loading.
+    Now includes coordinates for map markers.
+    """
+    print("\n=== Creating Postcode Lookup ===\n")
+    
+    lookup = dict(iter_postcode_lookup(matched))
     
     print(f"[OK] Created lookup for {len(lookup)} postcode areas")
     return lookup
 
 
-def load_household_data() -> Dict[str, int]:
+def load_household_data() -> pd.DataFrame:
     """
     Load Census 2021 household count data by postcode.
-    Returns a dictionary mapping postcode to household count.
+    Returns a table of postcode keys ('key', see postcode_codec.py) and household
+    counts ('households'), with one row per postcode.
     """
     print("\n=== Loading Household Data ===\n")
     
     household_file = RAW_POSTCODES / "Household census data 2021.csv"
+    empty = pd.DataFrame({'key': pd.Series(dtype=KEY_DTYPE), 'households': pd.Series(dtype='int64')})
     
     if not household_file.exists():
         print(f"WARNING: Household data file not found: {household_file}")
         print("Proceeding without household counts...")
-        return {}
+        return empty
     
     try:
-        df = pd.read_csv(household_file)
-        # Normalize postcodes (remove spaces, uppercase)
-        df['Postcode'] = df['Postcode'].str.replace(' ', '').str.upper()
-        households = dict(zip(df['Postcode'], df['Count']))
+        df = pd.read_csv(household_file, usecols=['Postcode', 'Count'])
+        households = pd.DataFrame({
+            # Census postcodes have no space ("ab101aa") - the codec reads any form
+            'key': encode_postcodes(df['Postcode']),
+            'households': pd.to_numeric(df['Count'], errors='coerce').fillna(0).astype('int64')
+        })
+        households = households[households['key'] != INVALID_KEY].drop_duplicates('key', keep='last')
         print(f"[OK] Loaded household data for {len(households):,} postcodes")
         return households
     except Exception as e:
         print(f"ERROR loading household data: {e}")
-        return {}
+        return empty
+
+
+def aggregate_substation_postcodes(matched: pd.DataFrame, households: pd.DataFrame) -> pd.DataFrame:
+    """
+    Aggregate matched postcodes per substation in one columnar pass.
+    Returns a frame indexed by substation_id with postcode_count, household_count,
+    chunks (sorted outward codes) and postcodes (sorted postcode list).
+    """
+    codes = matched['substation_id'].cat.codes.to_numpy()
+    rows = codes >= 0
+    codes = codes[rows]
+    keys = matched['key'].to_numpy()[rows]
+    
+    # Household totals via a merge on the integer postcode key
+    households = pd.DataFrame({'key': keys}).merge(households, on='key', how='left')['households']
+    households = households.fillna(0).to_numpy(dtype='int64')
+    
+    # Sort once so each substation's postcodes form a contiguous, sorted slice
+    order = np.lexsort((keys, codes))
+    codes, keys, households = codes[order], keys[order], households[order]
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(codes) else np.array([], dtype=int)
+    ends = np.r_[starts[1:], len(codes)]
+    
+    pcd = decode_postcodes(keys).tolist()
+    household_totals = np.add.reduceat(households, starts) if len(starts) else np.array([], dtype='int64')
+    
+    # Rows are in key order within each substation, so its outward codes are too
+    outward = keys // INWARD_CODES
+    first = np.r_[True, (codes[1:] != codes[:-1]) | (outward[1:] != outward[:-1])] if len(codes) else np.array([], dtype=bool)
+    outward_names = decode_outward(outward[first]).tolist()
+    outward_starts = np.searchsorted(np.flatnonzero(first), np.r_[starts, len(codes)])
+    
+    aggregated = pd.DataFrame({
+        'postcode_count': (ends - starts).tolist(),
+        'household_count': household_totals.tolist(),
+        'postcodes': [pcd[start:end] for start, end in zip(starts.tolist(), ends.tolist())],
+        'chunks': [outward_names[start:end] for start, end in zip(outward_starts[:-1].tolist(), outward_starts[1:].tolist())]
+    }, index=pd.Index(matched['substation_id'].cat.categories[codes[starts]], name='substation_id'))
+    
+    return aggregated
+
+
+def geometry_to_geojson(geom) -> Dict:
+    """Convert a shapely geometry to a GeoJSON geometry mapping (None if missing or empty)."""
+    if geom is None or geom.is_empty:
+        return None
+    return mapping(geom)
 
 
 def create_substation_details(substations: gpd.GeoDataFrame, 
                                matched: pd.DataFrame,
-                               household_data: Dict[str, int]) -> Dict:
+                               household_data: pd.DataFrame) -> Dict:
     """
     Create substation details with simplified boundaries, postcode counts, and postcode lists.
     """
     print("\n=== Creating Substation Details ===\n")
     
-    # Get postcodes per substation
-    postcode_groups = matched.groupby('substation_id')['pcd'].apply(list).to_dict()
+    # Outward codes, postcode counts, household totals and postcode lists per substation
+    aggregated = aggregate_substation_postcodes(matched, household_data).to_dict('index')
     
     # Simplify geometries for faster web rendering
-    substations['geometry'] = substations['geometry'].simplify(tolerance=0.001)
+    boundaries = substations.geometry.simplify(tolerance=0.001)
     
     details = {}
     
-    for _, row in tqdm(substations.iterrows(), total=len(substations), desc="Processing substations"):
-        substation_id = row['substation_id']
-        postcodes = postcode_groups.get(substation_id, [])
-        
-        # Extract unique outward codes (chunk names) for this substation
-        outward_codes = set()
-        for pc in postcodes:
-            outward_match = pd.Series([pc]).str.extract(r'^([A-Z]{1,2}\d{1,2}[A-Z]?)', expand=False)
-            if not outward_match.isna().all():
-                outward_codes.add(outward_match[0])
-        
-        # Calculate total households for this substation
-        total_households = 0
-        for pc in postcodes:
-            pc_normalized = pc.replace(' ', '').upper()
-            total_households += household_data.get(pc_normalized, 0)
+    for substation_id, name, dno, license_area, geom in zip(
+        substations['substation_id'],
+        substations['substation_name'],
+        substations['dno_name'],
+        substations['license_area'],
+        boundaries
+    ):
+        stats = aggregated.get(substation_id)
         
         details[substation_id] = {
-            'name': row['substation_name'],
-            'dno': row['dno_name'],
-            'license_area': row['license_area'],
-            'postcode_count': len(postcodes),
-            'household_count': total_households,
-            'chunks': sorted(list(outward_codes)),  # List of chunk files to load
-            'postcodes': sorted(postcodes),  # Include sorted list of all postcodes
-            'boundary': json.loads(gpd.GeoSeries([row['geometry']]).to_json())['features'][0]['geometry']
+            'name': name,
+            'dno': dno,
+            'license_area': license_area,
+            'postcode_count': stats['postcode_count'] if stats else 0,
+            'household_count': stats['household_count'] if stats else 0,
+            'chunks': stats['chunks'] if stats else [],  # List of chunk files to load
+            'postcodes': stats['postcodes'] if stats else [],  # Include sorted list of all postcodes
+            'boundary': geometry_to_geojson(geom)
         }
     
     print(f"[OK] Created details for {len(details)} substations")
     return details
 
 
-def save_outputs(postcode_lookup: Dict, substation_details: Dict):
-    """Save processed data as JSON files - split by postcode area."""
+def lookup_to_chunk(postcodes: Dict) -> pd.DataFrame:
+    """Convert a JSON lookup chunk (postcode -> substation and coordinates) back to chunk rows."""
+    return pd.DataFrame({
+        'key': encode_postcodes(list(postcodes)),
+        'pcd': list(postcodes),
+        'substation_id': [v['substation_id'] for v in postcodes.values()],
+        'lat': [v['lat'] for v in postcodes.values()],
+        'long': [v['lng'] for v in postcodes.values()],
+        'match_type': [v.get('match', 'within') for v in postcodes.values()],
+        'match_distance_m': [v.get('distance_m', 0) for v in postcodes.values()]
+    })
+
+
+def save_outputs(postcode_chunks: Union[Dict, Iterable[Tuple[str, pd.DataFrame]]], substation_details: Dict,
+                 areas: List[str] = None, chunk_format: str = 'both', overlaps: str = 'all',
+                 boundary_geometries: pd.Series = None, shards: List[str] = None, postcode_keys: np.ndarray = None,
+                 writer: OutputWriter = None, max_file_bytes: int = PAGES_FILE_BYTES) -> Dict:
+    """
+    Save processed data as JSON files - split by postcode area.
+    postcode_chunks may be a lookup dict from create_postcode_lookup or a stream
+    of (area, rows) pairs from iter_postcode_chunks, in which case each chunk is
+    written as it arrives.
+    
+    chunk_format is 'json', 'binary' (compact .bin chunks, see chunk_format.py)
+    or 'both' - binary chunks with JSON kept as a fallback. overlaps records the
+    overlap rule the chunks were built with.
+    
+    With shards (the prefix each shard starts at, from shard_postcode_chunks)
+    postcode_chunks are numbered shards instead, and the prefixes are saved in
+    the chunk index as their routing table; areas then lists the outward codes
+    in the build.
+    
+    Substation details are saved as a metadata index (substations.json) and
+    boundary shards (boundaries/, see boundary_shards.py). With
+    boundary_geometries (full-resolution boundaries by substation ID) the shards
+    are shared-arc topologies of them, otherwise GeoJSON. Shards larger than
+    max_file_bytes are split.
+    
+    With postcode_keys (the keys of every postcode with a substation) the
+    prefix index the web app uses for autocomplete is saved too
+    (autocomplete/, see autocomplete_index.py).
+    
+    For incremental builds, areas lists every postcode area in the build and
+    postcode_chunks holds only the chunks to rewrite; the other areas' chunk
+    files are carried over from the live output unchanged.
+    
+    Files are serialized and written on a thread pool into a staging directory,
+    verified, and then made live together as one generation (see output_writer.py),
+    so output/ never holds a mix of two builds. With writer the files are added
+    to its generation instead, for the caller to commit with the rest of the
+    build's files. Returns the chunk index.
+    """
+    if writer is None:
+        with OutputWriter(OUTPUT_DIR) as writer:
+            chunk_index = save_outputs(postcode_chunks, substation_details, areas, chunk_format, overlaps,
+                                       boundary_geometries, shards, postcode_keys, writer, max_file_bytes)
+            commit_outputs(writer)
+        return chunk_index
     print("\n=== Saving Output Files ===\n")
     
-    OUTPUT_DIR.mkdir(exist_ok=True)
-    CHUNKS_DIR = OUTPUT_DIR / "chunks"
-    CHUNKS_DIR.mkdir(exist_ok=True)
+    if isinstance(postcode_chunks, dict):
+        postcode_chunks = ((area, lookup_to_chunk(postcodes)) for area, postcodes in postcode_chunks.items())
     
-    # Save individual chunk files (one per postcode area)
-    print(f"Saving {len(postcode_lookup)} chunk files...")
-    total_size = 0
+    write_json = chunk_format in ('json', 'both')
+    write_binary = chunk_format in ('binary', 'both')
+    suffixes = (['.json'] if write_json else []) + (['.bin'] if write_binary else [])
     
-    for area, postcodes in tqdm(postcode_lookup.items(), desc="Saving chunks"):
-        chunk_file = CHUNKS_DIR / f"{area}.json"
-        with open(chunk_file, 'w') as f:
-            json.dump(postcodes, f, separators=(',', ':'))
-        total_size += chunk_file.stat().st_size
+    # Save individual chunk files (one per postcode area, or per shard)
+    print(f"Saving chunk files ({chunk_format})...")
+    written = []
+    sizes = []
     
-    print(f"[OK] Saved {len(postcode_lookup)} chunk files ({total_size / 1024 / 1024:.1f} MB total)")
+    for area, chunk in tqdm(postcode_chunks, desc="Saving chunks"):
+        if write_json:
+            sizes.append(writer.write_json(f"chunks/{area}.json", chunk_to_dict(chunk)))
+        if write_binary:
+            encode = partial(encode_shard, shards[int(area)], chunk) if shards is not None else partial(encode_chunk, area, chunk)
+            sizes.append(writer.write(f"chunks/{area}.bin", encode))
+        written.append(area)
+    
+    sizes = [future.result() for future in sizes]
+    total_size = sum(sizes)
+    print(f"[OK] Saved {len(written)} {'shards' if shards is not None else 'chunks'} ({total_size / 1024 / 1024:.1f} MB total)")
+    if shards is not None and sizes:
+        # Sizes of the files the web app loads first
+        sizes = sizes[len(suffixes) - 1::len(suffixes)]
+        print(f"  {suffixes[-1]} shard sizes: {min(sizes) / 1024:.1f} KB min, "
+              f"{np.median(sizes) / 1024:.1f} KB median, {max(sizes) / 1024:.1f} KB max")
+    
+    # Chunks of an incremental build's untouched areas carry over as they are
+    if areas is not None and shards is None:
+        rewritten = set(written)
+        kept = sum(writer.keep(f"chunks/{area}{suffix}") for area in areas if area not in rewritten for suffix in suffixes)
+        if kept:
+            print(f"[OK] Kept {kept} unchanged chunk files")
+    if areas is None:
+        areas = written
     
     # Save index of available chunks
-    index_file = OUTPUT_DIR / "chunks_index.json"
     chunk_index = {
-        "areas": list(postcode_lookup.keys()),
-        "total_areas": len(postcode_lookup),
+        "areas": areas,
+        "total_areas": len(areas),
+        "format": chunk_format,
+        "layout": "shards" if shards is not None else "outward",
+        "overlaps": overlaps,
         "generated": str(pd.Timestamp.now())
     }
-    with open(index_file, 'w') as f:
-        json.dump(chunk_index, f, indent=2)
-    print(f"[OK] Saved chunk index ({len(postcode_lookup)} areas)")
+    if shards is not None:
+        chunk_index["shards"] = shards
+    writer.write_json("chunks_index.json", chunk_index, indent=2)
+    print(f"[OK] Saved chunk index ({len(areas)} areas{f', {len(shards)} shards' if shards is not None else ''})")
+    
+    # Save substation metadata, with boundaries split out into shards fetched on demand
+    write_details(substation_details, OUTPUT_DIR, boundary_geometries, writer, max_file_bytes)
+    
+    if postcode_keys is not None:
+        count = write_autocomplete_index(postcode_keys, OUTPUT_DIR, writer)
+        print(f"[OK] Saved autocomplete index ({count:,} area and district files)")
+    
+    return chunk_index
+
+
+def commit_outputs(writer: OutputWriter):
+    """Check every file against what was written, then switch output/ over to it."""
+    generation = writer.commit()
+    print(f"[OK] Verified {generation['files']:,} files ({generation['bytes'] / 1024 / 1024:.1f} MB), "
+          f"now live as generation {generation['generation']}")
+
+
+def save_substation_table(substations: gpd.GeoDataFrame, substation_details: Dict, writer: OutputWriter):
+    """
+    Save the standardized substation polygons (full resolution) with their
+    details as GeoParquet, for the coordinate query API in substation_query.py.
+    Postcode lists are left to the postcode list shards.
+    """
+    details = pd.DataFrame.from_dict(substation_details, orient='index').drop(columns=['boundary', 'postcodes'], errors='ignore')
+    table = gpd.GeoDataFrame(
+        details.reindex(substations['substation_id'].to_numpy()).reset_index(names='substation_id'),
+        geometry=substations.geometry.to_numpy(),
+        crs=substations.crs
+    )
+    
+    def serialize() -> bytes:
+        buffer = io.BytesIO()
+        table.to_parquet(buffer, index=False)
+        return buffer.getvalue()
+    
+    size = writer.write(SUBSTATION_TABLE_FILE, serialize).result()
+    print(f"[OK] Saved {OUTPUT_DIR / SUBSTATION_TABLE_FILE} ({size / 1024 / 1024:.1f} MB)")
+
+
+def save_postcode_index(matched: pd.DataFrame, writer: OutputWriter):
+    """Save the national postcode index used by PostcodeIndex and the check scripts."""
+    print("\n=== Saving Postcode Index ===\n")
+    
+    data, count = encode_postcode_index(matched)
+    size = writer.write(POSTCODE_INDEX_FILE, lambda: data).result()
+    print(f"[OK] Saved {OUTPUT_DIR / POSTCODE_INDEX_FILE} ({count:,} postcodes, {size / 1024 / 1024:.1f} MB)")
+
+
+def publish_outputs(workers: int = 1):
+    """Publish the web app's files with content-hashed names, pre-compressed variants and a manifest."""
+    print("\n=== Publishing Artifacts ===\n")
     
-    # Save substation details (unchanged)
-    details_file = OUTPUT_DIR / "substations.json"
-    with open(details_file, 'w') as f:
-        json.dump(substation_details, f, separators=(',', ':'))
-    print(f"[OK] Saved {details_file} ({details_file.stat().st_size / 1024 / 1024:.1f} MB)")
+    if brotli is None:
+        print("WARNING: brotli isn't installed - writing gzip variants only")
+    publish_dir = OUTPUT_DIR / PUBLISH_DIR
+    manifest = publish_artifacts(OUTPUT_DIR, publish_dir, workers=workers)
+    count = len(manifest['files']) + sum(entry['count'] for entry in manifest['directories'].values())
+    print(f"[OK] Published {count:,} files to {publish_dir}")
+
+
+def count_matches(stage: Stage, matched: pd.DataFrame):
+    """Record the rows, matched and unmatched postcodes of a matching stage in its report."""
+    matched_rows = matched['substation_id'].notna()
+    stage.rows_out = len(matched)
+    stage.counts['matched'] = matched.loc[matched_rows, 'key'].nunique()
+    stage.counts['unmatched'] = (~matched_rows).sum()
+    stage.counts['substations_matched'] = matched.loc[matched_rows, 'substation_id'].nunique()
+    stage.counts['matched_frame_bytes'] = matched.memory_usage(deep=True).sum()
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    """Parse command-line options for the processing pipeline."""
+    parser = argparse.ArgumentParser(description="Match UK postcodes to substation areas and build web app data.")
+    parser.add_argument(
+        '--batch-size', type=int, default=POSTCODE_BATCH_SIZE,
+        help=f"Postcode rows read and joined per batch (default: {POSTCODE_BATCH_SIZE:,}; 0 loads the whole file at once)"
+    )
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help="Worker processes for the spatial join (default: 1, a single serial join)"
+    )
+    parser.add_argument(
+        '--join-engine', choices=['sjoin', 'grid'], default='sjoin',
+        help="Spatial join engine: geopandas sjoin (default) or the hierarchical grid index"
+    )
+    parser.add_argument(
+        '--grid-index', type=Path, default=None,
+        help=f"Grid index file to reuse for --join-engine grid (default: build and save output/{GRID_INDEX_FILE})"
+    )
+    parser.add_argument(
+        '--incremental', action='store_true',
+        help=f"Reuse cached per-DNO results from {CACHE_DIR}/ and only rebuild licence areas whose input files changed"
+    )
+    parser.add_argument(
+        '--no-cache', action='store_true',
+        help=f"Always re-read the raw DNO files instead of using the substation cache in {CACHE_DIR}/"
+    )
+    parser.add_argument(
+        '--chunk-format', choices=['json', 'binary', 'both'], default='both',
+        help="Chunk file format: JSON, compact binary, or binary with JSON as a fallback (default: both)"
+    )
+    parser.add_argument(
+        '--chunk-shard-kb', type=float, default=0, metavar='KB',
+        help="Pack the postcode lookup into shards of about KB each - large districts split by sector, "
+             "small ones merged - with a routing index, instead of one chunk per outward code (default: 0, off)"
+    )
+    parser.add_argument(
+        '--boundary-format', choices=['geojson', 'topojson'], default='geojson',
+        help="Boundary shard format: GeoJSON (default), or a shared-arc topology per shard"
+    )
+    parser.add_argument(
+        '--boundary-budget', type=float, default=0, metavar='MB',
+        help="Fit the substation details into MB by optimizing each boundary's simplification and precision "
+             "(default: 0, a fixed 0.001 degree simplification)"
+    )
+    parser.add_argument(
+        '--max-error-m', type=float, default=DEFAULT_MAX_ERROR_M,
+        help=f"Largest boundary displacement allowed by --boundary-budget, in metres (default: {DEFAULT_MAX_ERROR_M})"
+    )
+    parser.add_argument(
+        '--overlaps', choices=['all'] + OVERLAP_RULES, default='all',
+        help="Postcodes inside overlapping substations: keep every match (default), or keep one "
+             "by rule - the last substation, the smallest or largest polygon, or DNO priority"
+    )
+    parser.add_argument(
+        '--nearest-fallback', type=float, default=0, metavar='METRES',
+        help="Assign postcodes outside every substation to the nearest one within METRES (default: 0, off)"
+    )
+    parser.add_argument(
+        '--publish', action='store_true',
+        help=f"Also publish the web app's files to {OUTPUT_DIR / PUBLISH_DIR}/ with content-hashed names, "
+             f"Brotli and gzip variants and a manifest"
+    )
+    parser.add_argument(
+        '--profile', type=Path, default=None, metavar='DIR',
+        help="Also run each stage under cProfile and save its stats to DIR/<stage>.prof"
+    )
+    return parser.parse_args(argv)
 
 
-def main():
+def main(args: argparse.Namespace = None):
     """Main processing pipeline."""
+    if args is None:
+        args = parse_args([])
+    
     print("\n" + "="*60)
     print("UK POSTCODE TO SUBSTATION MATCHING - DATA PROCESSING")
     print("="*60)
     
-    # Load all substation boundaries
-    substations = load_all_substations()
-    
-    # Load postcode locations
-    postcodes = load_postcode_data()
-    if postcodes is None:
-        print("\n[ERROR] Cannot proceed without postcode data")
-        return
-    
-    # Match postcodes to substations
-    matched = match_postcodes_to_substations(postcodes, substations)
-    
-    # Load household census data
-    household_data = load_household_data()
+    # Time, memory and output of each stage, saved to output/build_report.json
+    OUTPUT_DIR.mkdir(exist_ok=True)
+    report = BuildReport(
+        OUTPUT_DIR, args.profile,
+        options={key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()}
+    )
     
-    # Create output files
-    postcode_lookup = create_postcode_lookup(matched)
-    substation_details = create_substation_details(substations, matched, household_data)
+    # Every file the build writes goes into one generation, made live together once the build
+    # report is in it - a build that stops early leaves the live output as it was
+    with OutputWriter(OUTPUT_DIR) as writer:
+        touched_areas = None
+        
+        if args.incremental:
+            # Load substations and matches from the build cache where inputs are unchanged
+            cache = BuildCache()
+            with report.stage('load_substations') as stage:
+                substations = load_all_substations(cache)
+                stage.rows_out = len(substations)
+            with report.stage('match_postcodes') as stage:
+                matched, touched_areas = match_postcodes_incremental(
+                    substations, cache,
+                    batch_size=args.batch_size,
+                    workers=args.workers,
+                    engine=args.join_engine,
+                    grid_index_file=args.grid_index,
+                    overlaps=args.overlaps,
+                    writer=writer
+                )
+                if matched is not None:
+                    count_matches(stage, matched)
+            if matched is None:
+                print("\n[ERROR] Cannot proceed without postcode data")
+                return
+        else:
+            # Load all substation boundaries (from the GeoParquet cache where unchanged)
+            with report.stage('load_substations') as stage:
+                substations = load_all_substations(None if args.no_cache else BuildCache())
+                stage.rows_out = len(substations)
+            
+            # Load postcode locations (streamed batches are read during matching)
+            with report.stage('load_postcodes') as stage:
+                postcodes = load_postcode_data(batch_size=args.batch_size)
+                if isinstance(postcodes, gpd.GeoDataFrame):
+                    stage.rows_out = len(postcodes)
+            if postcodes is None:
+                print("\n[ERROR] Cannot proceed without postcode data")
+                return
+            
+            # Match postcodes to substations
+            with report.stage('match_postcodes', rows_in=report.stages[-1].rows_out) as stage:
+                matched = match_postcodes_to_substations(
+                    postcodes, substations,
+                    workers=args.workers,
+                    engine=args.join_engine,
+                    grid_index_file=args.grid_index,
+                    overlaps=args.overlaps,
+                    writer=writer
+                )
+                count_matches(stage, matched)
+            del postcodes
+        
+        if args.nearest_fallback:
+            if args.incremental:
+                print("\nWARNING: --nearest-fallback needs every unmatched postcode, which incremental builds don't keep - skipping")
+            else:
+                with report.stage('nearest_fallback', rows_in=len(matched)) as stage:
+                    matched = assign_nearest_substations(matched, substations, args.nearest_fallback)
+                    count_matches(stage, matched)
+                    stage.counts['assigned_nearest'] = (matched['match_type'] == 'nearest').sum()
+        
+        # Load household census data
+        with report.stage('load_households') as stage:
+            household_data = load_household_data()
+            stage.rows_out = len(household_data)
+        
+        # Create output files
+        with report.stage('create_substation_details', rows_in=len(matched)) as stage:
+            substation_details = create_substation_details(substations, matched, household_data)
+            stage.rows_out = len(substation_details)
+            stage.counts['substations_without_postcodes'] = sum(
+                1 for details in substation_details.values() if not details['postcode_count']
+            )
+            stage.counts['households'] = sum(details['household_count'] for details in substation_details.values())
+        geometries = substations.drop_duplicates('substation_id', keep='last').set_index('substation_id').geometry
+        boundary_geometries = geometries if args.boundary_format == 'topojson' else None
+        if args.boundary_budget and boundary_geometries is not None:
+            print("\nWARNING: --boundary-budget applies to GeoJSON boundaries only - ignoring it")
+        elif args.boundary_budget:
+            with report.stage('fit_boundary_budget', rows_in=len(substation_details)) as stage:
+                substation_details = fit_details_to_budget(
+                    substation_details, geometries.reindex(list(substation_details)).to_numpy(),
+                    args.boundary_budget, args.max_error_m, args.workers
+                )
+        
+        # Chunks written in another format, or with another overlap rule, can't be kept
+        index_file = live_dir(OUTPUT_DIR) / "chunks_index.json"
+        if touched_areas is not None and index_file.exists():
+            previous = json.loads(index_file.read_text())
+            if previous.get('format', 'json') != args.chunk_format:
+                print(f"\nChunk format changed to {args.chunk_format}, rewriting all chunks")
+                touched_areas = None
+            elif previous.get('overlaps', 'all') != args.overlaps:
+                print(f"\nOverlap rule changed to {args.overlaps}, rewriting all chunks")
+                touched_areas = None
+            elif previous.get('layout', 'outward') != 'outward' and not args.chunk_shard_kb:
+                print("\nChunk layout changed to one chunk per outward code, rewriting all chunks")
+                touched_areas = None
+        
+        # Save to disk - lookup chunks are built and written one outward code at a time.
+        # A boundary budget also caps each boundary shard
+        max_file_bytes = int(args.boundary_budget * 1024 * 1024) if args.boundary_budget else PAGES_FILE_BYTES
+        with report.stage('save_outputs', rows_in=len(matched)) as stage:
+            postcode_keys = matched.loc[matched['substation_id'].notna(), 'key'].to_numpy()
+            if args.chunk_shard_kb:
+                # Shard boundaries move with any district's size, so shards are always repacked in full
+                shards, postcode_shards = shard_postcode_chunks(matched, int(args.chunk_shard_kb * 1024), args.chunk_format)
+                chunk_index = save_outputs(
+                    postcode_shards, substation_details,
+                    areas=outward_codes(postcode_keys),
+                    chunk_format=args.chunk_format, overlaps=args.overlaps, boundary_geometries=boundary_geometries,
+                    shards=shards, postcode_keys=postcode_keys, writer=writer, max_file_bytes=max_file_bytes
+                )
+                stage.counts['shards'] = len(shards)
+            elif touched_areas is None:
+                chunk_index = save_outputs(
+                    iter_postcode_chunks(matched), substation_details,
+                    chunk_format=args.chunk_format, overlaps=args.overlaps, boundary_geometries=boundary_geometries,
+                    postcode_keys=postcode_keys, writer=writer, max_file_bytes=max_file_bytes
+                )
+            else:
+                # Only rewrite chunks for postcode areas touched by the changed licence areas
+                outward = matched['key'].to_numpy() // INWARD_CODES
+                outward_ids = np.unique(outward)
+                areas = decode_outward(outward_ids).tolist()
+                touched_ids = outward_ids[np.isin(areas, list(touched_areas))]
+                chunk_index = save_outputs(
+                    iter_postcode_chunks(matched[np.isin(outward, touched_ids)]), substation_details,
+                    areas=areas, chunk_format=args.chunk_format, overlaps=args.overlaps, boundary_geometries=boundary_geometries,
+                    postcode_keys=postcode_keys, writer=writer, max_file_bytes=max_file_bytes
+                )
+                stage.counts['chunks_rewritten'] = len(set(touched_areas) & set(areas))
+            stage.counts['chunks'] = len(chunk_index['areas'])
+        with report.stage('save_substation_table', rows_in=len(substations)):
+            save_substation_table(substations, substation_details, writer)
+        with report.stage('save_postcode_index', rows_in=len(matched)):
+            save_postcode_index(matched, writer)
+        
+        print("\n=== Build Report ===")
+        report.save(REPORT_FILE, writer)
+        commit_outputs(writer)
     
-    # Save to disk
-    save_outputs(postcode_lookup, substation_details)
+    # Publishing copies the live generation, so it runs once the build is live (and isn't in the report)
+    if args.publish:
+        publish_outputs(args.workers)
     
     print("\n" + "="*60)
     print("[SUCCESS] PROCESSING COMPLETE!")
     print("="*60)
     print("\nNext steps:")
     print("1. Review output files in data-processing/output/")
-    print("2. Copy output files to public/data/ for the web app")
+    print("2. Copy output files to public/data/ for the web app (cp -rL, or from output/current/)")
     print("3. Test the web application")
     print()
 
 
 if __name__ == "__main__":
-    main()
+    main(parse_args())
@@ -0,0 +1,205 @@
+"""
+Content-hashed, pre-compressed copies of the web app's data files.
+
+Files saved under fixed names (substations.json, chunks/AB1.bin, ...) change
+in place, so browsers and mirrors have to revalidate every one after each
+deploy. This publishes a copy of the web app's files in which each file's
+name carries a hash of its contents, next to Brotli (.br) and gzip (.gz)
+variants for servers that serve pre-compressed files:
+
+    publish/manifest.json                       revalidated on every load
+    publish/substations.3f2a9c1b0d4e.json       immutable, cached forever
+    publish/substations.3f2a9c1b0d4e.json.br
+    publish/substations.3f2a9c1b0d4e.json.gz
+    publish/chunks/manifest.9be0c2d71a33.json   the chunks/ files
+    publish/chunks/AB1.c0ffee123456.bin
+    ...
+
+manifest.json maps each logical name to its hashed file, size and SHA-256,
+with the compressed sizes:
+
+    {"version": 1, "generated": "...",
+     "files": {"substations.json": {"file": "substations.3f2a9c1b0d4e.json", "bytes": 419141,
+                                    "sha256": "...", "br_bytes": 51234, "gzip_bytes": 60123}},
+     "directories": {"chunks": {"file": "chunks/manifest.9be0c2d71a33.json", ...}}}
+
+Each directory's files are listed in a content-hashed manifest of their own
+(same entries, by file name), so the top-level manifest stays small however
+many chunks there are. Unchanged files keep their names from build to build
+and are not rewritten. Files of the previous build are kept so clients holding
+its manifest can finish loading; older ones are removed. Each file is written
+under a temporary name and renamed into place, manifest.json last, so a reader
+never gets part of a file or a manifest listing files not yet written.
+
+Brotli variants need the brotli package; without it only gzip is written.
+
+Usage:
+    python publish.py                          # output/ -> output/publish/
+    python publish.py output ../public/data --workers 4
+
+The JavaScript reader is fetchArtifact() in public/app.js.
+
+Author: postcodes.energy
+License: MIT
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Set
+
+import pandas as pd
+
+from output_writer import live_dir
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+PUBLISH_DIR = "publish"
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+
+# Files and directories of the output that the web app loads
+WEB_ARTIFACTS = ['substations.json', 'chunks_index.json', 'chunks', 'boundaries', 'postcodes', 'autocomplete']
+
+# Hex digits of the SHA-256 kept in file names
+HASH_LENGTH = 12
+
+BROTLI_QUALITY = 11
+GZIP_LEVEL = 9
+
+
+def hashed_name(name: str, digest: str) -> str:
+    """File name with a content hash before its extension: AB1.bin -> AB1.<hash>.bin."""
+    path = Path(name)
+    return f"{path.stem}.{digest[:HASH_LENGTH]}{path.suffix}"
+
+
+def compressors() -> Dict[str, Callable[[bytes], bytes]]:
+    """Compression for each pre-compressed variant, by file suffix (.br only with brotli installed)."""
+    variants = {'.gz': lambda data: gzip.compress(data, GZIP_LEVEL, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = lambda data: brotli.compress(data, quality=BROTLI_QUALITY)
+    return variants
+
+
+def write_compressed(path: Path, data: bytes, overwrite: bool = False) -> Dict:
+    """
+    Write data to path with its pre-compressed variants. Content-hashed files
+    already there are left as they are unless overwrite. Returns the compressed
+    sizes, by manifest key.
+    """
+    sizes = {}
+    for suffix, compress in compressors().items():
+        variant = path.with_name(path.name + suffix)
+        if overwrite or not variant.exists():
+            _replace_file(variant, compress(data))
+        sizes[('br' if suffix == '.br' else 'gzip') + '_bytes'] = variant.stat().st_size
+    if overwrite or not path.exists():
+        _replace_file(path, data)
+    return sizes
+
+
+def _replace_file(path: Path, data: bytes):
+    """
+    Write a file with one rename, so readers see the old contents or the new,
+    never part of a file (and a file left by a failed run is never taken as complete).
+    """
+    temporary = path.with_name(f".{path.name}.tmp")
+    temporary.write_bytes(data)
+    os.replace(temporary, path)
+
+
+def publish_bytes(name: str, data: bytes, target_dir: Path) -> Dict:
+    """Publish content as name, hashed, in target_dir. Returns its manifest entry."""
+    digest = hashlib.sha256(data).hexdigest()
+    hashed = hashed_name(name, digest)
+    sizes = write_compressed(target_dir / hashed, data)
+    return {'file': hashed, 'bytes': len(data), 'sha256': digest, **sizes}
+
+
+def publish_file(source: Path, target_dir: Path) -> Dict:
+    """Publish one file into target_dir under its hashed name. Returns its manifest entry."""
+    return publish_bytes(source.name, source.read_bytes(), target_dir)
+
+
+def _referenced(publish_dir: Path) -> Set[Path]:
+    """Files referenced by the manifest in publish_dir, and their compressed variants."""
+    manifest_file = publish_dir / MANIFEST_FILE
+    if not manifest_file.exists():
+        return set()
+    manifest = json.loads(manifest_file.read_text())
+
+    files = {publish_dir / entry['file'] for entry in manifest.get('files', {}).values()}
+    for directory, entry in manifest.get('directories', {}).items():
+        directory_manifest = publish_dir / entry['file']
+        files.add(directory_manifest)
+        if directory_manifest.exists():
+            listing = json.loads(directory_manifest.read_text())
+            files.update(publish_dir / directory / file_entry['file'] for file_entry in listing.values())
+    return {variant for path in files for variant in (path, path.with_name(path.name + '.br'), path.with_name(path.name + '.gz'))}
+
+
+def publish_artifacts(output_dir: Path, publish_dir: Path, artifacts: List[str] = WEB_ARTIFACTS,
+                      workers: int = 1) -> Dict:
+    """
+    Publish the artifacts of output_dir (its live generation, see output_writer.py)
+    to publish_dir with content-hashed names and pre-compressed variants, and
+    write the manifest. Returns the manifest.
+    """
+    output_dir = live_dir(output_dir)
+    publish_dir.mkdir(parents=True, exist_ok=True)
+    previous = _referenced(publish_dir)
+
+    manifest = {'version': MANIFEST_VERSION, 'generated': str(pd.Timestamp.now()), 'files': {}, 'directories': {}}
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        for artifact in artifacts:
+            source = output_dir / artifact
+            if source.is_file():
+                manifest['files'][artifact] = publish_file(source, publish_dir)
+            elif source.is_dir():
+                target_dir = publish_dir / artifact
+                target_dir.mkdir(exist_ok=True)
+                files = sorted(path for path in source.iterdir() if path.is_file())
+                entries = executor.map(publish_file, files, [target_dir] * len(files))
+                listing = {path.name: entry for path, entry in zip(files, entries)}
+                entry = publish_bytes(MANIFEST_FILE, json.dumps(listing, separators=(',', ':')).encode(), target_dir)
+                manifest['directories'][artifact] = {**entry, 'file': f"{artifact}/{entry['file']}", 'count': len(listing)}
+
+    # The manifest goes last, replacing the old one at once, so it only ever lists files already written
+    manifest_file = publish_dir / MANIFEST_FILE
+    write_compressed(manifest_file, json.dumps(manifest, indent=2).encode(), overwrite=True)
+
+    # Keep this build's files and the previous build's, remove older ones
+    keep = _referenced(publish_dir) | previous
+    keep |= {manifest_file.with_name(MANIFEST_FILE + suffix) for suffix in ('', '.br', '.gz')}
+    for path in publish_dir.rglob('*'):
+        if path.is_file() and path not in keep:
+            path.unlink()
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish the web app's data files with content-hashed names and pre-compressed variants.")
+    parser.add_argument('output', type=Path, nargs='?', default=Path("output"), help="Pipeline output directory (default: output)")
+    parser.add_argument('publish', type=Path, nargs='?', help=f"Directory to publish to (default: <output>/{PUBLISH_DIR})")
+    parser.add_argument('--workers', type=int, default=1, help="Threads hashing and compressing files (default: 1)")
+    args = parser.parse_args()
+
+    print("\n=== Publishing Artifacts ===\n")
+    if brotli is None:
+        print("WARNING: brotli isn't installed - writing gzip variants only")
+    publish_dir = args.publish or args.output / PUBLISH_DIR
+    manifest = publish_artifacts(args.output, publish_dir, workers=args.workers)
+    count = len(manifest['files']) + sum(entry['count'] for entry in manifest['directories'].values())
+    print(f"[OK] Published {count:,} files to {publish_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,15 @@ let substationDetails = {};
 let allPostcodesInArea = [];
 let currentPage = 1;
 const POSTCODES_PER_PAGE = 100;
+let chunkFormat = 'bin'; // 'bin' or 'json' - switches to JSON if binary chunks aren't deployed
+const CHUNK_COORD_SCALE = 1000000; // Fixed-point scale of binary chunk coordinates (COORD_SCALE in matched_frame.py)
+let chunkIndex = null; // Chunk index (promise), with the shard routing table of sharded builds
+let boundaryShards = {}; // Boundary shards by number (promises), fetched when first needed
+let postcodeShards = {}; // Postcode list shards by number (promises), fetched when first needed
+let autocompleteFiles = {}; // Autocomplete index files by name (promises), fetched when first needed
+let autocompleteRequest = 0; // Latest autocomplete request - results of earlier ones are dropped
+let artifactManifest = null; // Manifest of content-hashed files (publish.py), null if deployed under plain names
+let directoryManifests = {}; // Content-hashed file names of each published directory (promises)
 
 // DOM Elements
 const postcodeInput = document.getElementById('postcode-input');
@@ -52,26 +61,129 @@ async function init() {
     }
 }
 
-// Load data files (only substations - chunks loaded on-demand)
+// Load data files (only substation metadata - chunks and boundaries loaded on-demand)
 async function loadData() {
     try {
         console.log('Starting to load data files...');
         
+        // Published builds name files by content hash
+        await loadManifest();
+        
         // Load substation details only
-        const detailsResponse = await fetch('data/substations.json');
+        const detailsResponse = await fetchArtifact('substations.json');
         console.log('Substation details response:', detailsResponse.status);
         if (!detailsResponse.ok) throw new Error('Failed to load substation data');
         substationDetails = await detailsResponse.json();
         
         console.log(`✓ Loaded ${Object.keys(substationDetails).length} substations`);
-        console.log('✓ Postcode chunks will be loaded on-demand');
+        console.log('✓ Postcode chunks and boundaries will be loaded on-demand');
     } catch (error) {
         console.error('❌ Error loading data:', error);
         throw error;
     }
 }
 
-// Load a specific postcode area chunk on-demand
+// Load the manifest of content-hashed files, if the data was published with publish.py.
+// It's the only file revalidated on every visit - the files it names never change
+async function loadManifest() {
+    try {
+        const response = await fetch('data/manifest.json', { cache: 'no-cache' });
+        artifactManifest = response.ok ? await response.json() : null;
+    } catch (error) {
+        artifactManifest = null;
+    }
+    if (artifactManifest) console.log(`✓ Loaded manifest (${artifactManifest.generated})`);
+}
+
+// Fetch a data file by name (e.g. 'chunks/N15.bin'), through its content-hashed
+// name when the data was published; names the manifest doesn't list are 404s
+async function fetchArtifact(name) {
+    if (!artifactManifest) return fetch(`data/${name}`);
+    
+    const slash = name.indexOf('/');
+    if (slash < 0) {
+        const entry = artifactManifest.files[name];
+        return entry ? fetch(`data/${entry.file}`) : new Response(null, { status: 404 });
+    }
+    
+    const directory = name.slice(0, slash);
+    const listing = artifactManifest.directories[directory];
+    if (!listing) return new Response(null, { status: 404 });
+    if (!directoryManifests[directory]) {
+        directoryManifests[directory] = fetch(`data/${listing.file}`).then(response => {
+            if (!response.ok) throw new Error(`Manifest for ${directory} not found`);
+            return response.json();
+        });
+    }
+    
+    let entry;
+    try {
+        entry = (await directoryManifests[directory])[name.slice(slash + 1)];
+    } catch (error) {
+        delete directoryManifests[directory];
+        throw error;
+    }
+    return entry ? fetch(`data/${directory}/${entry.file}`) : new Response(null, { status: 404 });
+}
+
+// Fetch the chunk index once (null if it isn't deployed). Sharded builds list
+// the postcode prefix each shard starts at (see data-processing/chunk_shards.py)
+function loadChunkIndex() {
+    if (!chunkIndex) {
+        chunkIndex = fetchArtifact('chunks_index.json')
+            .then(response => response.ok ? response.json() : null)
+            .then(index => {
+                // JSON-only builds have no binary chunks to try
+                if (index && index.format === 'json') chunkFormat = 'json';
+                return index;
+            })
+            .catch(error => {
+                console.warn('Chunk index unavailable:', error);
+                return null;
+            });
+    }
+    return chunkIndex;
+}
+
+// Last shard starting at or before a formatted postcode or prefix (-1 if none):
+// prefixes sort as strings in the same order as the postcodes they start
+function findShard(shards, postcode) {
+    let low = 0;
+    let high = shards.length;
+    while (low < high) {
+        const mid = (low + high) >> 1;
+        if (shards[mid] <= postcode) low = mid + 1;
+        else high = mid;
+    }
+    return low - 1;
+}
+
+// Name of the chunk holding a formatted postcode ("N15 5QA") with the given
+// outward code: its shard in sharded builds, otherwise the outward code
+async function routeChunk(postcode, outward) {
+    const index = await loadChunkIndex();
+    if (!index || !index.shards) return outward;
+    const shard = findShard(index.shards, postcode);
+    return shard < 0 ? null : String(shard);
+}
+
+// Names of the chunks holding outward codes' postcodes: the outward codes
+// themselves, or the shards from each one's first postcode to its last
+async function routeOutwardCodes(outwardCodes) {
+    const index = await loadChunkIndex();
+    if (!index || !index.shards) return outwardCodes;
+    const names = new Set();
+    for (const outward of outwardCodes) {
+        const last = findShard(index.shards, `${outward} 9ZZ`);
+        for (let shard = Math.max(findShard(index.shards, outward), 0); shard <= last; shard++) {
+            names.add(String(shard));
+        }
+    }
+    return [...names];
+}
+
+// Load a specific postcode area chunk (or shard) on-demand
+// Tries the compact binary chunk first, falling back to JSON
 async function loadChunk(area) {
     // Check if already loaded
     if (postcodeLookup[area]) {
@@ -80,12 +192,26 @@ async function loadChunk(area) {
     }
     
     try {
-        console.log(`Loading chunk: ${area}.json`);
-        const response = await fetch(`data/chunks/${area}.json`);
-        if (!response.ok) {
-            throw new Error(`Chunk ${area} not found`);
+        let chunkData = null;
+        
+        if (chunkFormat === 'bin') {
+            chunkData = await fetchBinaryChunk(area);
+        }
+        
+        if (!chunkData) {
+            console.log(`Loading chunk: ${area}.json`);
+            const response = await fetchArtifact(`chunks/${area}.json`);
+            if (!response.ok) {
+                throw new Error(`Chunk ${area} not found`);
+            }
+            chunkData = await response.json();
+            
+            // Binary chunks aren't deployed - stop asking for them
+            if (chunkFormat === 'bin') {
+                console.log('Binary chunks unavailable, using JSON chunks');
+                chunkFormat = 'json';
+            }
         }
-        const chunkData = await response.json();
         
         // Cache the loaded chunk
         postcodeLookup[area] = chunkData;
@@ -98,6 +224,100 @@ async function loadChunk(area) {
     }
 }
 
+// Fetch and decode a binary chunk, or return null if it isn't available
+async function fetchBinaryChunk(area) {
+    try {
+        console.log(`Loading chunk: ${area}.bin`);
+        const response = await fetchArtifact(`chunks/${area}.bin`);
+        if (!response.ok) return null;
+        return decodeChunk(await response.arrayBuffer());
+    } catch (error) {
+        console.warn(`Binary chunk ${area} unavailable:`, error);
+        return null;
+    }
+}
+
+// Outward code of an outward code ID (postcode key / 6760, see postcode_codec.py):
+// area * 370 + district, the area letter * 27 + (0, or 1 + second letter) and
+// the district digit * 37 + (0, 1 + digit, or 11 + letter)
+function decodeOutward(id) {
+    const area = Math.floor(id / 370);
+    const district = id % 370;
+    const second = area % 27;
+    const rest = district % 37;
+    return String.fromCharCode(65 + Math.floor(area / 27)) + (second ? String.fromCharCode(64 + second) : '') +
+        Math.floor(district / 37) + (rest === 0 ? '' : rest <= 10 ? String(rest - 1) : String.fromCharCode(54 + rest));
+}
+
+// Decode a binary chunk into the same structure as a JSON chunk
+// (format documented in data-processing/chunk_format.py):
+// header of magic 'PEC2', count, outward code ID, string table length (uint32 LE),
+// then int32 lat/lng (fixed point), uint16 substation indices,
+// uint16 inward codes and a newline-separated table of outward code + substation IDs,
+// optionally followed by the rows and distances of nearest-fallback postcodes.
+// Shards (magic 'PES1') store full uint32 postcode keys before the substation
+// indices instead of the inward codes, and span several outward codes
+function decodeChunk(buffer) {
+    const view = new DataView(buffer);
+    const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+    if (magic !== 'PEC2' && magic !== 'PES1') throw new Error('Not a binary postcode chunk');
+    const sharded = magic === 'PES1';
+    
+    const count = view.getUint32(4, true);
+    const tableBytes = view.getUint32(12, true);
+    
+    // Typed arrays use platform byte order - little-endian on all mainstream browsers
+    let offset = 16;
+    const lat = new Int32Array(buffer, offset, count);
+    offset += 4 * count;
+    const lng = new Int32Array(buffer, offset, count);
+    offset += 4 * count;
+    const keys = sharded ? new Uint32Array(buffer, offset, count) : null;
+    if (sharded) offset += 4 * count;
+    const substationIndex = new Uint16Array(buffer, offset, count);
+    offset += 2 * count;
+    const inward = sharded ? null : new Uint16Array(buffer, offset, count);
+    if (!sharded) offset += 2 * count;
+    
+    const table = new TextDecoder().decode(new Uint8Array(buffer, offset, tableBytes)).split('\n');
+    let outward = table[0];
+    let outwardId = -1;
+    const substationIds = table.slice(1);
+    offset += tableBytes;
+    
+    const chunkData = {};
+    const postcodes = [];
+    for (let i = 0; i < count; i++) {
+        const code = sharded ? keys[i] % 6760 : inward[i];
+        if (sharded && Math.floor(keys[i] / 6760) !== outwardId) {
+            outwardId = Math.floor(keys[i] / 6760);
+            outward = decodeOutward(outwardId);
+        }
+        // Inward code: sector digit * 676 + unit letters (see postcode_codec.py)
+        const unit = code % 676;
+        const postcode = `${outward} ${Math.floor(code / 676)}` +
+            String.fromCharCode(65 + Math.floor(unit / 26), 65 + unit % 26);
+        postcodes.push(postcode);
+        chunkData[postcode] = {
+            substation_id: substationIds[substationIndex[i]],
+            lat: lat[i] / CHUNK_COORD_SCALE,
+            lng: lng[i] / CHUNK_COORD_SCALE
+        };
+    }
+    
+    // Postcodes assigned to their nearest substation (section may be unaligned, so read via DataView)
+    if (offset < buffer.byteLength) {
+        const nearest = view.getUint32(offset, true);
+        offset += 4;
+        for (let k = 0; k < nearest; k++) {
+            const entry = chunkData[postcodes[view.getUint32(offset + 4 * k, true)]];
+            entry.match = 'nearest';
+            entry.distance_m = view.getUint32(offset + 4 * (nearest + k), true);
+        }
+    }
+    return chunkData;
+}
+
 // Initialize Leaflet map
 function initMap() {
     try {
@@ -199,8 +419,9 @@ async function findSubstationForPostcode(postcode) {
     
     const outward = outwardMatch[1];
     
-    // Load the chunk for this area if not already cached
-    const chunkData = await loadChunk(outward);
+    // Load the chunk (or shard) for this postcode if not already cached
+    const chunkName = await routeChunk(postcode, outward);
+    const chunkData = chunkName === null ? null : await loadChunk(chunkName);
     
     if (!chunkData) {
         return null;
@@ -227,29 +448,69 @@ async function displayResults(postcode, postcodeData) {
     }
     
     // Update substation info
-    document.getElementById('sub-name').textContent = substation.name || substationId;
+    document.getElementById('sub-name').textContent = (substation.name || substationId) +
+        (postcodeData.match === 'nearest' ? ` (nearest substation, ${postcodeData.distance_m.toLocaleString()} m away)` : '');
     document.getElementById('sub-dno').textContent = substation.dno;
     document.getElementById('sub-area').textContent = substation.license_area;
     document.getElementById('sub-count').textContent = substation.postcode_count.toLocaleString();
     document.getElementById('sub-households').textContent = substation.household_count ? substation.household_count.toLocaleString() : 'Data unavailable';
     
-    // Load all chunks for this substation to get complete postcode list
-    await loadSubstationChunks(substation);
-    
     // Get all postcodes in this substation area
-    allPostcodesInArea = getAllPostcodesInSubstation(substationId);
+    allPostcodesInArea = await loadPostcodeList(substationId, substation);
     
     // Display postcodes list
     currentPage = 1;
     displayPostcodesList();
     
     // Update map immediately (it's already visible)
-    updateMap(postcode, postcodeData, substation);
+    const boundary = await loadBoundary(substationId, substation);
+    updateMap(postcode, postcodeData, substation, boundary);
     
     // Show results container (info and postcodes)
     resultsContainer.classList.remove('hidden');
 }
 
+// Load a substation's sorted postcode list from its postcode list shard
+// (older builds without shards fall back to scanning the substation's chunks)
+async function loadPostcodeList(substationId, substation) {
+    const shard = substation.postcode_shard;
+    if (shard === undefined) {
+        await loadSubstationChunks(substation);
+        return getAllPostcodesInSubstation(substationId);
+    }
+    
+    if (!postcodeShards[shard]) {
+        console.log(`Loading postcode shard: ${shard}.json`);
+        postcodeShards[shard] = fetchArtifact(`postcodes/${shard}.json`).then(response => {
+            if (!response.ok) throw new Error(`Postcode shard ${shard} not found`);
+            return response.json();
+        });
+    }
+    
+    try {
+        const postcodes = decodePostcodeList((await postcodeShards[shard])[substationId] || '');
+        console.log(`Found ${postcodes.length} postcodes in substation ${substationId}`);
+        return postcodes;
+    } catch (error) {
+        console.error(`Error loading postcode shard ${shard}:`, error);
+        delete postcodeShards[shard];
+        return [];
+    }
+}
+
+// Decode a front-coded postcode list (format documented in
+// data-processing/postcode_lists.py): comma separated entries of the number
+// of characters shared with the previous postcode, then the rest of the postcode
+function decodePostcodeList(encoded) {
+    const postcodes = [];
+    let previous = '';
+    for (const entry of encoded ? encoded.split(',') : []) {
+        previous = previous.slice(0, Number(entry[0])) + entry.slice(1);
+        postcodes.push(previous);
+    }
+    return postcodes;
+}
+
 // Load all chunks for a substation to get complete postcode list
 async function loadSubstationChunks(substation) {
     // Check if substation has chunks list
@@ -259,9 +520,10 @@ async function loadSubstationChunks(substation) {
         return;
     }
     
-    console.log(`Loading ${substation.chunks.length} chunks for substation: ${substation.name}`);
+    const chunkNames = await routeOutwardCodes(substation.chunks);
+    console.log(`Loading ${chunkNames.length} chunks for substation: ${substation.name}`);
     
-    const loadPromises = substation.chunks.map(chunkName => 
+    const loadPromises = chunkNames.map(chunkName => 
         loadChunk(chunkName).catch(() => {
             console.warn(`Failed to load chunk: ${chunkName}`);
             return null;
@@ -281,8 +543,8 @@ function getAllPostcodesInSubstation(substationId) {
     console.log(`Looking for postcodes in substation: ${substationId}`);
     console.log(`Loaded chunks: ${Object.keys(postcodeLookup).join(', ')}`);
     
-    for (const outwardCode in postcodeLookup) {
-        const chunk = postcodeLookup[outwardCode];
+    for (const chunkName in postcodeLookup) {
+        const chunk = postcodeLookup[chunkName];
         for (const postcode in chunk) {
             if (chunk[postcode].substation_id === substationId) {
                 postcodes.push(postcode);
@@ -337,17 +599,78 @@ function changePage(direction) {
     document.getElementById('postcodes-list').scrollIntoView({ behavior: 'smooth' });
 }
 
+// Load a substation's boundary from its boundary shard on-demand
+// (GeoJSON boundaries by substation ID, or a shared-arc topology)
+async function loadBoundary(substationId, substation) {
+    const shard = substation.boundary_shard;
+    if (shard === undefined) return substation.boundary || null;
+    
+    if (!boundaryShards[shard]) {
+        console.log(`Loading boundary shard: ${shard}.json`);
+        boundaryShards[shard] = fetchArtifact(`boundaries/${shard}.json`).then(response => {
+            if (!response.ok) throw new Error(`Boundary shard ${shard} not found`);
+            return response.json();
+        }).then(data => data.type === 'Topology' ? decodeTopology(data) : data);
+    }
+    
+    try {
+        return (await boundaryShards[shard])[substationId] || null;
+    } catch (error) {
+        console.error(`Error loading boundary shard ${shard}:`, error);
+        delete boundaryShards[shard];
+        return null;
+    }
+}
+
+// Decode a shared-arc boundary topology (format documented in
+// data-processing/boundary_topology.py) into GeoJSON geometries by substation ID:
+// arcs are delta encoded on a quantized grid, and a negative arc index ~i means arc i reversed
+function decodeTopology(topology) {
+    const [scaleX, scaleY] = topology.transform.scale;
+    const [translateX, translateY] = topology.transform.translate;
+    const arcs = topology.arcs.map(arc => {
+        let x = 0, y = 0;
+        return arc.map(([dx, dy]) => {
+            x += dx;
+            y += dy;
+            return [x * scaleX + translateX, y * scaleY + translateY];
+        });
+    });
+    
+    // Join a ring's arcs, dropping the point each arc shares with the one before
+    const ring = indices => {
+        const coordinates = [];
+        indices.forEach((index, n) => {
+            const arc = index >= 0 ? arcs[index] : arcs[~index].slice().reverse();
+            coordinates.push(...(n === 0 ? arc : arc.slice(1)));
+        });
+        return coordinates;
+    };
+    
+    const boundaries = {};
+    for (const geometry of topology.objects.substations.geometries) {
+        if (geometry.type === 'Polygon') {
+            boundaries[geometry.id] = { type: 'Polygon', coordinates: geometry.arcs.map(ring) };
+        } else if (geometry.type === 'MultiPolygon') {
+            boundaries[geometry.id] = { type: 'MultiPolygon', coordinates: geometry.arcs.map(polygon => polygon.map(ring)) };
+        } else {
+            boundaries[geometry.id] = null;
+        }
+    }
+    return boundaries;
+}
+
 // Update map with postcode and substation boundary
-function updateMap(postcode, postcodeData, substation) {
+function updateMap(postcode, postcodeData, substation, boundary) {
     // Remove existing markers/polygons
     if (currentMarker) map.removeLayer(currentMarker);
     if (currentPolygon) map.removeLayer(currentPolygon);
     
     // Add substation boundary
-    if (substation.boundary) {
+    if (boundary) {
         try {
             console.log('Drawing boundary for substation:', substation.name);
-            currentPolygon = L.geoJSON(substation.boundary, {
+            currentPolygon = L.geoJSON(boundary, {
                 style: {
                     color: '#667eea',
                     weight: 2,
@@ -380,29 +703,18 @@ function updateMap(postcode, postcodeData, substation) {
 }
 
 // Autocomplete functionality (works with loaded chunks only)
-function handleAutocomplete() {
+async function handleAutocomplete() {
     const value = postcodeInput.value.replace(/\s+/g, '').toUpperCase();
+    const request = ++autocompleteRequest;
     
     if (value.length < 3) {  // Require 3+ characters to avoid too many suggestions
         autocompleteList.classList.remove('active');
         return;
     }
     
-    // Note: Autocomplete only works with already-loaded chunks
-    // This is a lightweight approach to avoid loading all 2,414 chunk files
-    const matches = [];
-    
-    // Check loaded chunks for matches
-    for (const outward in postcodeLookup) {
-        const chunkData = postcodeLookup[outward];
-        for (const postcode in chunkData) {
-            if (postcode.replace(/\s+/g, '').startsWith(value)) {
-                matches.push(postcode);
-                if (matches.length >= 10) break;
-            }
-        }
-        if (matches.length >= 10) break;
-    }
+    // Suggestions come from the autocomplete index - a few KB per keystroke at most
+    const matches = await completePostcode(value, 10);
+    if (request !== autocompleteRequest) return;  // A later keystroke has taken over
     
     // Display matches
     if (matches.length > 0) {
@@ -426,6 +738,62 @@ function handleAutocomplete() {
     }
 }
 
+// Fetch a file of the autocomplete index ({} if it doesn't exist)
+function loadAutocompleteFile(name) {
+    if (!autocompleteFiles[name]) {
+        autocompleteFiles[name] = fetchArtifact(`autocomplete/${name}.json`)
+            .then(response => response.ok ? response.json() : {})
+            .catch(error => {
+                console.warn(`Autocomplete file ${name} unavailable:`, error);
+                delete autocompleteFiles[name];
+                return {};
+            });
+    }
+    return autocompleteFiles[name];
+}
+
+// Complete a postcode prefix (uppercase, no spaces) from the autocomplete index
+// (format documented in data-processing/autocomplete_index.py): the area file
+// lists each district's sectors, and only reachable district files are fetched
+async function completePostcode(value, limit = 10) {
+    const area = value.match(/^[A-Z]{0,2}/)[0];
+    if (!area) return [];
+    
+    // A lone letter may start several areas
+    let areas = [area];
+    if (area === value) {
+        const listed = await loadAutocompleteFile('areas');
+        areas = Array.isArray(listed) ? listed.filter(candidate => candidate.startsWith(area)) : [];
+    }
+    
+    const matches = [];
+    for (const candidate of areas) {
+        const districts = await loadAutocompleteFile(candidate);
+        for (const [district, sectors] of Object.entries(districts)) {
+            let inward;
+            if (district.startsWith(value)) {
+                inward = '';
+            } else if (value.startsWith(district) && value.length > district.length && sectors.includes(value[district.length])) {
+                inward = value.slice(district.length);
+            } else {
+                continue;
+            }
+            
+            const units = await loadAutocompleteFile(district);
+            for (const [sector, letters] of Object.entries(units)) {
+                for (let i = 0; i < letters.length; i += 2) {
+                    const unit = sector + letters.slice(i, i + 2);
+                    if (unit.startsWith(inward)) {
+                        matches.push(`${district} ${unit}`);
+                        if (matches.length >= limit) return matches;
+                    }
+                }
+            }
+        }
+    }
+    return matches;
+}
+
 // Export postcodes to CSV
 function exportToCSV() {
     const csv = ['Postcode'].concat(allPostcodesInArea.map(formatPostcode)).join('\n');